@@ -0,0 +1,67 @@
+"""
+Compares graph_utils.ig_to_nx against the previous per-node / per-edge implementation
+on a random 20k-node street-like graph.
+
+    python benchmarks/bench_ig_to_nx.py
+"""
+import random
+import time
+
+import igraph as ig
+import networkx as nx
+
+from roc_bike_growth.graph_utils import ig_to_nx
+
+
+def ig_to_nx_legacy(G_ig: ig.Graph):
+    # Previous implementation: one add and one set_*_attributes call per node and per edge
+    G_nx = nx.MultiDiGraph()
+    for node in G_ig.vs:
+        key = node["_nx_name"]
+        G_nx.add_node(key)
+        a = node.attributes()
+        del a["_nx_name"]
+        nx.set_node_attributes(G_nx, {key: a})
+    for edge in G_ig.es:
+        src = G_ig.vs[edge.source]["_nx_name"]
+        trg = G_ig.vs[edge.target]["_nx_name"]
+        G_nx.add_edge(src, trg)
+        nx.set_edge_attributes(G_nx, {(src, trg, 0): edge.attributes()})
+    for a in G_ig.attributes():
+        G_nx.graph[a] = G_ig[a]
+    return G_nx
+
+
+def make_graph(n=20000, seed=0) -> nx.MultiDiGraph:
+    rng = random.Random(seed)
+    G = nx.MultiDiGraph(crs="epsg:4326")
+    for i in range(n):
+        G.add_node(10**9 + i, x=-77.6 + rng.random() * 0.1, y=43.1 + rng.random() * 0.1, street_count=3)
+    for _ in range(int(2.5 * n)):
+        u, v = 10**9 + rng.randrange(n), 10**9 + rng.randrange(n)
+        G.add_edge(u, v, length=rng.uniform(10, 500), name="Main Street", highway="residential", oneway=False)
+    return G
+
+
+def timed(f, *args, repeat=3):
+    best = float("inf")
+    for _ in range(repeat):
+        t = time.perf_counter()
+        out = f(*args)
+        best = min(best, time.perf_counter() - t)
+    return best, out
+
+
+if __name__ == "__main__":
+    G = make_graph()
+    G_ig = ig.Graph.from_networkx(G)
+    print(f"{G_ig.vcount()} nodes, {G_ig.ecount()} edges")
+
+    t_legacy, legacy = timed(ig_to_nx_legacy, G_ig, repeat=1)
+    t_bulk, bulk = timed(ig_to_nx, G_ig)
+    assert set(bulk.nodes) == set(legacy.nodes)
+    assert bulk.number_of_edges() == legacy.number_of_edges()
+    assert set(bulk.edges(keys=True)) == set(G.edges(keys=True))
+
+    print(f"legacy: {t_legacy:.2f}s")
+    print(f"bulk:   {t_bulk:.2f}s ({t_legacy / t_bulk:.0f}x)")
@@ -0,0 +1,293 @@
+import hashlib
+import json
+import os
+import pickle
+import shutil
+import sqlite3
+import time
+import numpy as np
+import networkx as nx
+import osmnx as ox
+import shapely
+from shapely.geometry.base import BaseGeometry
+from roc_bike_growth import graph_utils as gu
+from roc_bike_growth.settings import CONFIG
+
+from typing import Any, Callable, Dict, Iterable, Optional, Tuple, Union
+from shapely.geometry import Polygon, MultiPolygon
+
+
+def cache_key(kind: str, polygon: Optional[Union[Polygon, MultiPolygon]], params: Any = None) -> str:
+    """
+    Content address for a download: hash of the query polygon, the query parameters
+    and the osmnx version (which decides how responses become graphs).
+
+    Parameters
+    -------
+    kind: string
+        Type of download, e.g. "graph_from_polygon". Also used as cache subfolder.
+    polygon: Polygon | MultiPolygon | None
+        Query boundary, None for queries not bounded by a polygon (e.g. by county name).
+    params: Any
+        JSON-serializable query parameters (filters, network_type, ...).
+
+    Returns
+    -------
+    key: string
+    """
+    content = json.dumps(
+        {"kind": kind, "polygon": None if polygon is None else polygon.wkt, "params": params, "osmnx": ox.__version__},
+        sort_keys=True,
+        default=str,
+    )
+    return hashlib.sha256(content.encode()).hexdigest()
+
+
+_MISSING = object()
+
+
+def _column(values: list) -> tuple:
+    """
+    Compacts one attribute column to (positions, kind, data). positions is None when
+    every item has the attribute. Numbers become numpy arrays, geometries WKB and
+    repeated hashable values (names, highway types) integer codes into their uniques.
+    """
+    if any(v is _MISSING for v in values):
+        positions = np.array([i for i, v in enumerate(values) if v is not _MISSING], dtype=np.int64)
+        values = [values[i] for i in positions]
+    else:
+        positions = None
+    types = {type(v) for v in values}
+    if values and all(isinstance(v, BaseGeometry) for v in values):
+        return positions, "wkb", shapely.to_wkb(np.array(values, dtype=object))
+    if len(types) == 1 and types.pop() in (int, float):
+        return positions, "array", np.array(values)
+    try:
+        # Keyed with the type, as True, 1 and 1.0 are equal dict keys
+        uniques = {}
+        codes = np.array([uniques.setdefault((type(v), v), len(uniques)) for v in values], dtype=np.int32)
+        if len(uniques) <= len(values) // 2:
+            return positions, "codes", (codes, [v for _, v in uniques])
+    except TypeError:  # unhashable values, e.g. lists of osmids
+        pass
+    return positions, "list", values
+
+
+def _expand(column: tuple, n: int) -> tuple:
+    """Inverse of `_column`: (positions or range(n), values)."""
+    positions, kind, data = column
+    if kind == "wkb":
+        values = shapely.from_wkb(data).tolist()
+    elif kind == "array":
+        values = data.tolist()
+    elif kind == "codes":
+        codes, uniques = data
+        values = [uniques[c] for c in codes.tolist()]
+    else:
+        values = data
+    return (range(n) if positions is None else positions.tolist()), values
+
+
+def _records(columns: dict, n: int) -> list:
+    """Builds one attribute dict per item from `_column` outputs."""
+    dense = {a: c for a, c in columns.items() if c[0] is None}
+    names = list(dense)
+    if names:
+        records = [dict(zip(names, row)) for row in zip(*(_expand(dense[a], n)[1] for a in names))]
+    else:
+        records = [{} for _ in range(n)]
+    for a, column in columns.items():
+        if a in dense:
+            continue
+        for i, v in zip(*_expand(column, n)):
+            records[i][a] = v
+    return records
+
+
+def graph_to_arrays(G: nx.MultiDiGraph) -> dict:
+    """
+    Converts a graph into compact arrays: node ids, CSR adjacency (G.edges already
+    comes grouped by source node) and one sparse column per node/edge attribute.
+
+    Parameters
+    -------
+    G: nx.MultiDiGraph
+
+    Returns
+    -------
+    dict
+    """
+    nodes = list(G.nodes)
+    index = {n: i for i, n in enumerate(nodes)}
+    edges = list(G.edges(keys=True, data=True))
+
+    node_attrs = {a for _, d in G.nodes(data=True) for a in d}
+    edge_attrs = {a for _, _, _, d in edges for a in d}
+
+    src = np.fromiter((index[u] for u, _, _, _ in edges), dtype=np.int64, count=len(edges))
+    return {
+        "directed": G.is_directed(),
+        "graph": dict(G.graph),
+        "nodes": np.array(nodes) if nodes and all(type(n) is int for n in nodes) else nodes,
+        "indptr": np.searchsorted(src, np.arange(len(nodes) + 1)),
+        "indices": np.fromiter((index[v] for _, v, _, _ in edges), dtype=np.int64, count=len(edges)),
+        "keys": np.array([k for _, _, k, _ in edges]),
+        "node_attrs": {
+            a: _column([d.get(a, _MISSING) for _, d in G.nodes(data=True)]) for a in node_attrs
+        },
+        "edge_attrs": {a: _column([d.get(a, _MISSING) for _, _, _, d in edges]) for a in edge_attrs},
+    }
+
+
+def graph_from_arrays(data: dict) -> nx.MultiDiGraph:
+    """
+    Rebuilds the graph written by `graph_to_arrays`, with the same node and edge order.
+    """
+    nodes = data["nodes"].tolist() if isinstance(data["nodes"], np.ndarray) else data["nodes"]
+    node_data = _records(data["node_attrs"], len(nodes))
+
+    src = np.repeat(np.arange(len(nodes)), np.diff(data["indptr"])).tolist()
+    dst = data["indices"].tolist()
+    keys = data["keys"].tolist()
+    edge_data = _records(data["edge_attrs"], len(dst))
+
+    G = nx.MultiDiGraph() if data["directed"] else nx.MultiGraph()
+    G.graph.update(data["graph"])
+    G.add_nodes_from(zip(nodes, node_data))
+    if not data["directed"]:
+        G.add_edges_from(
+            (nodes[u], nodes[v], k, d) for u, v, k, d in zip(src, dst, keys, edge_data)
+        )
+        return G
+
+    gu.add_edges_unchecked(
+        G, ((nodes[u], nodes[v], k, d) for u, v, k, d in zip(src, dst, keys, edge_data))
+    )
+    return G
+
+
+def _path(kind: str, key: str) -> str:
+    return os.path.join(CONFIG.cache_dir, kind, f"{key}.pkl")
+
+
+def _write(path: str, value: Any) -> None:
+    if isinstance(value, nx.MultiDiGraph):
+        record = {"type": "graph", "data": graph_to_arrays(value)}
+    else:
+        record = {"type": "object", "data": value}
+    os.makedirs(os.path.dirname(path), exist_ok=True)
+    tmp = f"{path}.tmp"
+    with open(tmp, "wb") as f:
+        pickle.dump(record, f, protocol=pickle.HIGHEST_PROTOCOL)
+    os.replace(tmp, path)  # readers never see a half-written file
+
+
+def _read(path: str) -> Any:
+    with open(path, "rb") as f:
+        record = pickle.load(f)
+    if record["type"] == "graph":
+        return graph_from_arrays(record["data"])
+    return record["data"]
+
+
+def cached(
+    kind: str,
+    polygon: Optional[Union[Polygon, MultiPolygon]],
+    params: Any,
+    build: Callable[[], Any],
+) -> Any:
+    """
+    Returns the cached result for (kind, polygon, params), calling build() and storing
+    its result on a miss. Graphs are stored as compact arrays, anything else is pickled.
+
+    Controlled by `CONFIG.use_cache` (read and write the cache) and `CONFIG.cache_only`
+    (offline: raise instead of calling build on a miss).
+
+    Parameters
+    -------
+    kind: string
+        Type of download, e.g. "graph_from_polygon".
+    polygon: Polygon | MultiPolygon | None
+        Query boundary.
+    params: Any
+        JSON-serializable query parameters.
+    build: Callable
+        Performs the download.
+
+    Returns
+    -------
+    Any
+    """
+    path = _path(kind, cache_key(kind, polygon, params))
+    if CONFIG.use_cache and os.path.exists(path):
+        return _read(path)
+    if CONFIG.cache_only:
+        raise FileNotFoundError(f"No cached {kind} for these parameters in {CONFIG.cache_dir}.")
+
+    value = build()
+    if CONFIG.use_cache:
+        _write(path, value)
+    return value
+
+
+def invalidate(kind: str, polygon: Union[Polygon, MultiPolygon], params: Any) -> bool:
+    """
+    Removes one cached entry. Returns True if there was one.
+    """
+    path = _path(kind, cache_key(kind, polygon, params))
+    if os.path.exists(path):
+        os.remove(path)
+        return True
+    return False
+
+
+def clear_cache(kind: str = None) -> None:
+    """
+    Removes all cached entries, or only those of one kind.
+    """
+    path = CONFIG.cache_dir if kind is None else os.path.join(CONFIG.cache_dir, kind)
+    shutil.rmtree(path, ignore_errors=True)
+
+
+class GeocodeCache:
+    """
+    Persistent query -> (lat, lon) store of geocoding results in a SQLite file, by default
+    cache_dir/geocode.sqlite. Failed lookups are stored with their error and no point, so
+    they are not retried on every run.
+
+    Use from one thread: geocode in workers, store the results from the calling thread.
+    """
+
+    def __init__(self, path: str = None):
+        self.path = path or os.path.join(CONFIG.cache_dir, "geocode.sqlite")
+        os.makedirs(os.path.dirname(self.path) or ".", exist_ok=True)
+        self.conn = sqlite3.connect(self.path)
+        self.conn.execute(
+            "CREATE TABLE IF NOT EXISTS geocode "
+            "(query TEXT PRIMARY KEY, lat REAL, lon REAL, error TEXT, time REAL)"
+        )
+
+    def get(self, queries: Iterable[str]) -> Dict[str, Tuple[Optional[float], Optional[float], Optional[str]]]:
+        """
+        Stored (lat, lon, error) of the queries found in the cache. lat and lon are None for
+        failed lookups.
+        """
+        queries = list(dict.fromkeys(queries))
+        found = {}
+        for i in range(0, len(queries), 500):  # SQLite limits the number of parameters
+            chunk = queries[i : i + 500]
+            rows = self.conn.execute(
+                f"SELECT query, lat, lon, error FROM geocode WHERE query IN ({','.join('?' * len(chunk))})",
+                chunk,
+            )
+            found.update((q, (lat, lon, error)) for q, lat, lon, error in rows)
+        return found
+
+    def put(self, query: str, lat: Optional[float], lon: Optional[float], error: Optional[str] = None) -> None:
+        with self.conn:
+            self.conn.execute(
+                "INSERT OR REPLACE INTO geocode VALUES (?, ?, ?, ?, ?)", (query, lat, lon, error, time.time())
+            )
+
+    def close(self) -> None:
+        self.conn.close()
@@ -0,0 +1,236 @@
+import numpy as np
+import networkx as nx
+import igraph as ig
+
+from typing import Tuple
+
+# Bits of CompactGraph.flags
+EXISTING = 1
+GENERATED = 2
+
+
+class CompactGraph:
+    """
+    Array-backed graph holding only what routing and the metrics use: node ids,
+    coordinates, CSR adjacency, edge lengths, multi-edge keys and the
+    existing/generated edge flags as a bitmask. Replaces a dict per node and per
+    edge with a handful of numpy arrays, and converts to igraph and networkx
+    without going through attribute dicts.
+
+    Coordinates are stored as float32 offsets from a float64 origin, which keeps
+    them accurate to well under a meter across a city.
+
+    Edges are kept in the order of the source graph, grouped by source node, so
+    `indptr` and `dst` form the CSR adjacency of the (out-)edges.
+    """
+
+    __slots__ = (
+        "node_ids",
+        "origin",
+        "xy",
+        "indptr",
+        "dst",
+        "keys",
+        "length",
+        "flags",
+        "directed",
+    )
+
+    def __init__(
+        self,
+        node_ids: np.ndarray,
+        x: np.ndarray,
+        y: np.ndarray,
+        src: np.ndarray,
+        dst: np.ndarray,
+        keys: np.ndarray = None,
+        length: np.ndarray = None,
+        flags: np.ndarray = None,
+        directed: bool = True,
+    ):
+        n, m = len(node_ids), len(dst)
+        self.node_ids = node_ids
+        x = np.asarray(x, dtype=np.float64)
+        y = np.asarray(y, dtype=np.float64)
+        self.origin = np.array([np.nanmin(x), np.nanmin(y)]) if n else np.zeros(2)
+        self.xy = np.column_stack([x - self.origin[0], y - self.origin[1]]).astype(np.float32)
+
+        # Sort edges by source (stable, so a graph already grouped by source keeps its order)
+        src = np.asarray(src, dtype=np.int64)
+        order = np.argsort(src, kind="stable")
+        self.indptr = np.searchsorted(src[order], np.arange(n + 1))
+        self.dst = np.asarray(dst, dtype=np.int32)[order]
+        self.keys = (np.zeros(m, dtype=np.int64) if keys is None else np.asarray(keys))[order]
+        self.length = (np.zeros(m) if length is None else np.asarray(length, dtype=np.float64))[order]
+        self.flags = (np.zeros(m, dtype=np.uint8) if flags is None else np.asarray(flags, dtype=np.uint8))[order]
+        self.directed = directed
+
+    @classmethod
+    def from_networkx(cls, G: nx.MultiDiGraph, length: str = "length") -> "CompactGraph":
+        """
+        Parameters
+        -------
+        G: nx.MultiDiGraph
+            Graph with "x", "y" on nodes. `length`, "existing" and "generated" are read
+            from edges where present.
+        length: str
+            Edge attribute to store as length.
+        """
+        nodes = list(G.nodes)
+        index = {n: i for i, n in enumerate(nodes)}
+        n = len(nodes)
+        x = np.fromiter((d.get("x", np.nan) for _, d in G.nodes(data=True)), dtype=np.float64, count=n)
+        y = np.fromiter((d.get("y", np.nan) for _, d in G.nodes(data=True)), dtype=np.float64, count=n)
+
+        if G.is_multigraph():
+            edges = list(G.edges(keys=True, data=True))
+        else:
+            edges = [(u, v, 0, d) for u, v, d in G.edges(data=True)]
+        m = len(edges)
+        src = np.fromiter((index[u] for u, _, _, _ in edges), dtype=np.int64, count=m)
+        dst = np.fromiter((index[v] for _, v, _, _ in edges), dtype=np.int64, count=m)
+        keys = np.fromiter((k for _, _, k, _ in edges), dtype=np.int64, count=m)
+        lengths = np.fromiter(
+            (d.get(length) or 0.0 for _, _, _, d in edges), dtype=np.float64, count=m
+        )
+        flags = np.fromiter(
+            (
+                EXISTING * (d.get("existing") == True) + GENERATED * (d.get("generated") == True)
+                for _, _, _, d in edges
+            ),
+            dtype=np.uint8,
+            count=m,
+        )
+        node_ids = np.array(nodes) if nodes and all(type(v) is int for v in nodes) else np.array(nodes, dtype=object)
+        return cls(node_ids, x, y, src, dst, keys, lengths, flags, directed=G.is_directed())
+
+    @classmethod
+    def from_igraph(cls, G: ig.Graph, length: str = "length") -> "CompactGraph":
+        """
+        Parameters
+        -------
+        G: ig.Graph
+            Graph with "x", "y" on vertices, as made by `ig.Graph.from_networkx`. Node ids
+            come from "_nx_name" and keys from "_nx_multiedge_key" when present.
+        length: str
+            Edge attribute to store as length.
+        """
+        vattrs, eattrs = G.vs.attributes(), G.es.attributes()
+        n, m = G.vcount(), G.ecount()
+        node_ids = np.asarray(G.vs["_nx_name"] if "_nx_name" in vattrs else range(n))
+        edges = np.asarray(G.get_edgelist(), dtype=np.int64).reshape(-1, 2)
+
+        def edge_attr(name, default):
+            if name not in eattrs:
+                return [default] * m
+            return [default if v is None else v for v in G.es[name]]
+
+        flags = EXISTING * np.asarray(edge_attr("existing", False), dtype=bool) + GENERATED * np.asarray(
+            edge_attr("generated", False), dtype=bool
+        )
+        return cls(
+            node_ids,
+            G.vs["x"] if n else [],
+            G.vs["y"] if n else [],
+            edges[:, 0],
+            edges[:, 1],
+            np.asarray(edge_attr("_nx_multiedge_key", 0), dtype=np.int64),
+            np.asarray(edge_attr(length, 0.0), dtype=np.float64),
+            flags,
+            directed=G.is_directed(),
+        )
+
+    @property
+    def n_nodes(self) -> int:
+        return len(self.node_ids)
+
+    @property
+    def n_edges(self) -> int:
+        return len(self.dst)
+
+    @property
+    def x(self) -> np.ndarray:
+        return self.xy[:, 0].astype(np.float64) + self.origin[0]
+
+    @property
+    def y(self) -> np.ndarray:
+        return self.xy[:, 1].astype(np.float64) + self.origin[1]
+
+    @property
+    def src(self) -> np.ndarray:
+        """Source node index of every edge, expanded from the CSR offsets."""
+        return np.repeat(np.arange(self.n_nodes, dtype=np.int32), np.diff(self.indptr))
+
+    @property
+    def nbytes(self) -> int:
+        return sum(
+            getattr(self, a).nbytes for a in ["node_ids", "xy", "indptr", "dst", "keys", "length", "flags"]
+        )
+
+    def edge_ids(self) -> list:
+        """(u, v, key) node id triples of every edge, for looking edges up in the source graph."""
+        ids = self.node_ids
+        return list(zip(ids[self.src].tolist(), ids[self.dst].tolist(), self.keys.tolist()))
+
+    def to_undirected(self) -> "CompactGraph":
+        """
+        Simple undirected version, the same graph `nx.Graph(G)` gives: multi-edges and
+        reciprocal edges collapse into one, self-loops stay. Flags are or-ed together and the
+        shortest length is kept.
+        """
+        src, dst = self.src.astype(np.int64), self.dst.astype(np.int64)
+        lo, hi = np.minimum(src, dst), np.maximum(src, dst)
+        pair = lo * max(self.n_nodes, 1) + hi
+        uniq, first, inverse = np.unique(pair, return_index=True, return_inverse=True)
+        length = np.full(len(uniq), np.inf)
+        np.minimum.at(length, inverse, self.length)
+        flags = np.zeros(len(uniq), dtype=np.uint8)
+        np.bitwise_or.at(flags, inverse, self.flags)
+        return CompactGraph(
+            self.node_ids, self.x, self.y, lo[first], hi[first], None, length, flags, directed=False
+        )
+
+    def adjacency(self) -> Tuple[np.ndarray, np.ndarray]:
+        """
+        Symmetric CSR adjacency (indptr, indices) ignoring direction, multi-edges and
+        self-loops. Neighbors of node i are indices[indptr[i]:indptr[i + 1]], sorted.
+        """
+        src, dst = self.src.astype(np.int64), self.dst.astype(np.int64)
+        a = np.concatenate([src, dst])
+        b = np.concatenate([dst, src])
+        keep = a != b
+        pair = np.unique(a[keep] * max(self.n_nodes, 1) + b[keep])
+        a, b = pair // max(self.n_nodes, 1), pair % max(self.n_nodes, 1)
+        return np.searchsorted(a, np.arange(self.n_nodes + 1)), b
+
+    def to_igraph(self) -> ig.Graph:
+        """
+        igraph Graph with "_nx_name", "x", "y" on vertices and "length", "existing",
+        "generated", "_nx_multiedge_key" on edges, as `ig.Graph.from_networkx` names them.
+        """
+        G = ig.Graph(n=self.n_nodes, edges=np.column_stack([self.src, self.dst]).tolist(), directed=self.directed)
+        G.vs["_nx_name"] = self.node_ids.tolist()
+        G.vs["x"] = self.x.tolist()
+        G.vs["y"] = self.y.tolist()
+        G.es["length"] = self.length.tolist()
+        G.es["existing"] = (self.flags & EXISTING).astype(bool).tolist()
+        G.es["generated"] = (self.flags & GENERATED).astype(bool).tolist()
+        G.es["_nx_multiedge_key"] = self.keys.tolist()
+        return G
+
+    def to_networkx(self) -> nx.MultiDiGraph:
+        """
+        networkx graph with "x", "y" on nodes and "length", "existing", "generated" on edges.
+        """
+        G = nx.MultiDiGraph() if self.directed else nx.MultiGraph()
+        ids = self.node_ids.tolist()
+        G.add_nodes_from(zip(ids, ({"x": x, "y": y} for x, y in zip(self.x.tolist(), self.y.tolist()))))
+        existing = (self.flags & EXISTING).astype(bool).tolist()
+        generated = (self.flags & GENERATED).astype(bool).tolist()
+        G.add_edges_from(
+            (ids[u], ids[v], k, {"length": l, "existing": e, "generated": g})
+            for u, v, k, l, e, g in zip(
+                self.src.tolist(), self.dst.tolist(), self.keys.tolist(), self.length.tolist(), existing, generated
+            )
+        )
+        return G
@@ -1,12 +1,262 @@
-import osmnx as ox
+import difflib
+import re
+import weakref
 import networkx as nx
-from typing import List, Dict
+from typing import Callable, List, Dict, Set, Tuple
 import igraph as ig
 import numpy as np
+import pyproj
+from scipy.spatial import cKDTree
+
+
+def _normalize_name(name) -> str:
+    """Edge "name" as matched by the street lookups: lists joined by spaces, lowercased."""
+    if isinstance(name, list):  # Some street names are lists
+        name = " ".join(name)
+    return name.lower() if isinstance(name, str) else ""
+
+
+class StreetNameIndex:
+    """
+    Inverted index from normalized street names to the (u, v) edges that carry them, so
+    street lookups scan the few thousand distinct names instead of every edge of the graph.
+    As in the original scans, the name of an edge pair is the name of its key 0 edge.
+
+    Build it with `street_name_index(G)`, which caches it per graph.
+    """
+
+    def __init__(self, G: nx.MultiDiGraph):
+        self.names: Dict[str, List[tuple]] = {}  # normalized name -> [(u, v), ...]
+        self.tokens: Dict[str, Set[str]] = {}  # word -> normalized names containing it
+        for u, nbrs in G.adj.items():
+            for v, keydict in nbrs.items():
+                d = keydict[0] if 0 in keydict else next(iter(keydict.values()))
+                self.names.setdefault(_normalize_name(d.get("name", "")), []).append((u, v))
+        for name in self.names:
+            for token in name.split():
+                self.tokens.setdefault(token, set()).add(name)
+
+    def match(self, query: str, match: str = "substring", cutoff: float = 0.8) -> List[str]:
+        """
+        Normalized names matching query.
+
+        Parameters
+        -------
+        query: string
+            Street name, capitalization is ignored.
+        match: string
+            "substring" (query appears in the name, as the original scans did), "token" (name
+            contains every word of query), "regex" (re.search on the name) or "fuzzy" (names
+            within difflib ratio `cutoff` of query).
+        cutoff: float
+            Similarity cutoff for "fuzzy".
+
+        Returns
+        -------
+        names: list
+        """
+        if match == "substring":
+            query = query.lower()
+            return [name for name in self.names if query in name]
+        if match == "token":
+            words = query.lower().split()
+            if not words:
+                return list(self.names)
+            found = set.intersection(*(self.tokens.get(w, set()) for w in words))
+            return [name for name in self.names if name in found]
+        if match == "regex":
+            pattern = re.compile(query, re.IGNORECASE)
+            return [name for name in self.names if pattern.search(name)]
+        if match == "fuzzy":
+            return difflib.get_close_matches(query.lower(), list(self.names), n=len(self.names), cutoff=cutoff)
+        raise ValueError(f"Unknown match {match}, use substring, token, regex or fuzzy.")
+
+    def edges(self, query: str, match: str = "substring", **kwargs) -> Set[tuple]:
+        """(u, v) edges whose name matches query, see `match`."""
+        return {e for name in self.match(query, match, **kwargs) for e in self.names[name]}
+
+    def nodes(self, query: str, match: str = "substring", **kwargs) -> Set:
+        """Endpoints of the edges whose name matches query, see `match`."""
+        return {n for e in self.edges(query, match, **kwargs) for n in e}
+
+
+# Indexes derived from a graph: graph -> {index name: (version, content, index)}. Kept out of
+# G.graph, which copies share and which gets serialized, and dropped with the graph.
+_graph_indexes = weakref.WeakKeyDictionary()
+
+
+def _graph_version(G: nx.MultiDiGraph):
+    """
+    Token that changes whenever nodes or edges of G are added or removed: networkx clears
+    G.__networkx_cache__ on every such change, taking the token with it.
+    """
+    cache = getattr(G, "__networkx_cache__", None)
+    if cache is None:  # networkx < 3.3, fall back to the node and (u, v) pair counts
+        return (len(G), sum(map(len, G._adj.values())))
+    return cache.setdefault("roc_bike_growth_version", object())
+
+
+def _cached_index(G: nx.MultiDiGraph, name: str, build: Callable, content: Callable = None):
+    """
+    Index `name` of G, built with build(G) on first use and cached for this graph object.
+    Rebuilt after nodes or edges were added or removed and, if given, when content(G), the
+    attributes the index reads, changed since.
+    """
+    indexes = _graph_indexes.setdefault(G, {})
+    version = _graph_version(G)
+    data = content(G) if content is not None else None
+    cached = indexes.get(name)
+    if cached is None or cached[0] != version or cached[1] != data:
+        cached = indexes[name] = (version, data, build(G))
+    return cached[2]
+
+
+def _invalidate_index(G: nx.MultiDiGraph, name: str) -> None:
+    _graph_indexes.get(G, {}).pop(name, None)
+
+
+def street_name_index(G: nx.MultiDiGraph) -> StreetNameIndex:
+    """
+    Street name index of G, built on first use and cached for G (not for its copies).
+    It is rebuilt after nodes or edges of G were added or removed; call
+    `invalidate_street_name_index` after renaming edges in place.
+
+    Parameters
+    -------
+    G: MultiDiGraph
+        Graph of network
+
+    Returns
+    -------
+    index: StreetNameIndex
+    """
+    return _cached_index(G, "street_name", StreetNameIndex)
+
+
+def invalidate_street_name_index(G: nx.MultiDiGraph) -> None:
+    """Drops the cached street name index of G."""
+    _invalidate_index(G, "street_name")
+
+
+class NodeIndex:
+    """
+    KD-tree over the node coordinates of a graph, projected to a local azimuthal equidistant
+    projection in meters, for snapping many points to their nearest nodes in one call.
+
+    Build it with `node_index(G)`, which caches it per graph.
+    """
+
+    def __init__(self, G: nx.MultiDiGraph):
+        nodes = list(G)
+        self.node_ids = np.array(nodes) if nodes and all(type(n) is int for n in nodes) else np.array(nodes, dtype=object)
+        lon, lat = _node_coordinates(G)
+        loncenter = (lon.min() + lon.max()) / 2 if len(nodes) else 0
+        latcenter = (lat.min() + lat.max()) / 2 if len(nodes) else 0
+        local_azimuthal_projection = "+proj=aeqd +R=6371000 +units=m +lat_0={} +lon_0={}".format(latcenter, loncenter)
+        self.transformer = pyproj.Transformer.from_proj(
+            pyproj.Proj("+proj=longlat +datum=WGS84 +no_defs"), pyproj.Proj(local_azimuthal_projection)
+        )
+        self.tree = cKDTree(np.column_stack(self.transformer.transform(lon.tolist(), lat.tolist())).reshape(-1, 2))
+
+    def query(self, X: np.ndarray, Y: np.ndarray) -> Tuple[np.ndarray, np.ndarray]:
+        """
+        Nearest node of every (lon, lat) point.
+
+        Returns
+        -------
+        (node_ids, distances): Tuple[np.ndarray, np.ndarray]
+            Node id and distance in meters per point. Without nodes, ids are None and
+            distances inf.
+        """
+        n = len(X)
+        if n == 0 or len(self.node_ids) == 0:
+            return np.full(n, None, dtype=object), np.full(n, np.inf)
+        # As lists, since pyproj takes one-element arrays for scalars
+        x, y = self.transformer.transform(
+            np.asarray(X, dtype=np.float64).tolist(), np.asarray(Y, dtype=np.float64).tolist()
+        )
+        dist, idx = self.tree.query(np.column_stack([x, y]).reshape(-1, 2))
+        return self.node_ids[idx], dist
+
+
+def _node_coordinates(G: nx.MultiDiGraph) -> Tuple[np.ndarray, np.ndarray]:
+    lon = np.fromiter((d["x"] for _, d in G.nodes(data=True)), dtype=np.float64, count=len(G))
+    lat = np.fromiter((d["y"] for _, d in G.nodes(data=True)), dtype=np.float64, count=len(G))
+    return lon, lat
+
+
+def _node_coordinates_key(G: nx.MultiDiGraph) -> bytes:
+    # Reading the coordinates is cheap next to projecting them and building the tree
+    return b"".join(a.tobytes() for a in _node_coordinates(G))
+
+
+def node_index(G: nx.MultiDiGraph) -> NodeIndex:
+    """
+    Node KD-tree of G, built on first use and cached for G (not for its copies). It is rebuilt
+    after nodes or edges of G were added or removed and when node coordinates changed.
+
+    Parameters
+    -------
+    G: MultiDiGraph
+        Graph with "x", "y" (lon, lat) on nodes
+
+    Returns
+    -------
+    index: NodeIndex
+    """
+    return _cached_index(G, "node", NodeIndex, _node_coordinates_key)
+
+
+def invalidate_node_index(G: nx.MultiDiGraph) -> None:
+    """Drops the cached node index of G."""
+    _invalidate_index(G, "node")
+
+
+def snap_to_nodes(
+    G: nx.MultiDiGraph, X: np.ndarray, Y: np.ndarray, max_dist: float = None
+) -> Tuple[np.ndarray, np.ndarray, np.ndarray]:
+    """
+    Snaps points to their nearest nodes of G in one batch query of `node_index(G)`.
+
+    Parameters
+    -------
+    G: MultiDiGraph
+        Graph with "x", "y" (lon, lat) on nodes
+    X: np.ndarray
+        Longitudes of the points
+    Y: np.ndarray
+        Latitudes of the points
+    max_dist: float
+        Points further than this from every node (meters) are dropped. None keeps all, unless
+        G has no nodes.
+
+    Returns
+    -------
+    (node_ids, distances, snapped): Tuple[np.ndarray, np.ndarray, np.ndarray]
+        Nearest node and distance in meters of the snapped points, and the boolean mask of the
+        input points that were snapped.
+    """
+    node_ids, dist = node_index(G).query(X, Y)
+    snapped = np.isfinite(dist) if max_dist is None else dist <= max_dist
+    return node_ids[snapped], dist[snapped], snapped
+
+
+def _intersection_nodes(street_nodes: set, edges: set) -> set:
+    """
+    Street nodes at the named edges: the tails of those edges that leave a street node, and
+    their heads if also on the street (what scanning G.edges(street_nodes) gave).
+    """
+    nodes = set()
+    for u, v in edges:
+        if u in street_nodes:
+            nodes.add(u)
+            if v in street_nodes:
+                nodes.add(v)
+    return nodes
 
 
 def get_intersections(
-    G: nx.MultiDiGraph, street_1_name: str, street_2_name: str
+    G: nx.MultiDiGraph, street_1_name: str, street_2_name: str, match: str = "substring"
 ) -> List[int]:
     """
     Identifies nodes in G that have edges of both street_1_name and street_2_name.
@@ -19,6 +269,8 @@ def get_intersections(
         Street of interest, without abbreviations. Capitalization will be ignored. E.x. 'Broad Street'.
     street_2_name: string
         Street name for intersection. Same naming conventions as `street_1_name`.
+    match: string
+        How names are matched, see `StreetNameIndex.match`. Default "substring".
 
 
     Returns
@@ -26,43 +278,9 @@ def get_intersections(
     nodes: Set
         set of nodes where edges with name `street_1_name` intersect with edges with name `street_2_name`.
     """
-    street_1_name = street_1_name.lower()
-    street_2_name = street_2_name.lower()
-
-    # Get all edges for street_name_1
-    street_1_edges = {}
-    street_1_nodes = []
-    for u, v in G.edges():
-        d = G.get_edge_data(u, v, 0)
-        edge_name = d.get("name", "")
-        if isinstance(edge_name, list):
-            edge_name = " ".join(edge_name)
-
-        edge_name = edge_name.lower()
-        if street_1_name in edge_name:
-            street_1_edges[(u, v)] = d
-            street_1_nodes += [u, v]
-
-    # Remove duplicate nodes
-    street_1_nodes = set(street_1_nodes)
-
-    # Loop through edges to our street nodes to find edges with intersection street names
-    street_2_nodes = []
-    for u, v in G.edges(street_1_nodes):
-        d = G.get_edge_data(u, v, 0)
-        edge_name = d.get("name", "")
-        if isinstance(edge_name, list):  # Some street names are lists
-            edge_name = " ".join(edge_name)
-
-        edge_name = edge_name.lower()
-
-        # TODO change these to regexes?
-        if street_2_name in edge_name:
-            street_2_nodes += [u, v]
-        else:
-            pass
-
-    return street_1_nodes.intersection(set(street_2_nodes))
+    index = street_name_index(G)
+    street_1_nodes = index.nodes(street_1_name, match)
+    return _intersection_nodes(street_1_nodes, index.edges(street_2_name, match))
 
 
 def get_street_segment(
@@ -70,6 +288,7 @@ def get_street_segment(
     street_name: str,
     intersection_src_name: str,
     intersection_dest_name: str,
+    match: str = "substring",
 ) -> list:
     """
     Gets the directed segements of edges with street_name that are between intersection_1_name
@@ -87,69 +306,146 @@ def get_street_segment(
         Street name for source intersection with. Same naming conventions as `street_name`.
     intersection_dest_name: str
         Street name for dest intersection with. Same naming conventions as `street_name`.
+    match: string
+        How names are matched, see `StreetNameIndex.match`. Default "substring".
 
     Returns
     -------
     nodes: list
         List of nodes along the directed segement.
     """
-    # TODO -- could refactor this to use get_intersections() for brevity. Current implementation works fine.
-
-    # Clean up names
-    street_name = street_name.lower()
-    intersection_src_name = intersection_src_name.lower()
-    intersection_dest_name = intersection_dest_name.lower()
-
-    # Get all edges for street_name
-    street_edges = {}
-    street_nodes = []
-    for u, v in G.edges():
-        d = G.get_edge_data(u, v, 0)
-        edge_name = d.get("name", "")
-        if isinstance(edge_name, list):
-            edge_name = " ".join(edge_name)
-
-        edge_name = edge_name.lower()
-        if street_name in edge_name:
-            street_edges[(u, v)] = d
-            street_nodes += [u, v]
-
-    # Remove duplicate nodes
-    street_nodes = set(street_nodes)
-
-    # Loop through edges to our street nodes to find edges with intersection street names
-    src_nodes = []
-    dest_nodes = []
-    for u, v in G.edges(street_nodes):
-        d = G.get_edge_data(u, v, 0)
-        edge_name = d.get("name", "")
-        if isinstance(edge_name, list):  # Some street names are lists
-            edge_name = " ".join(edge_name)
-
-        edge_name = edge_name.lower()
-
-        # TODO change these to regexes?
-        if intersection_src_name in edge_name:
-            src_nodes += [u, v]
-        elif intersection_dest_name in edge_name:
-            dest_nodes += [u, v]
-        else:
-            pass
-
-    src_intersections = street_nodes.intersection(set(src_nodes))
-    dest_intersections = street_nodes.intersection(set(dest_nodes))
-
-    # Find the longest route between intersections in case there are multiple of either src or dest
-    route = []
-    for src in src_intersections:
-        for dest in dest_intersections:
-            # Shortest path of our subgraph will comprise all nodes in between
-            new_route = ox.distance.shortest_path(G.subgraph(street_nodes), src, dest)
-            # Replace route with longest
-            if len(new_route) > len(route):
-                route = new_route
-
-    return route
+    routes, _ = get_street_segments(
+        G, [(street_name, intersection_src_name, intersection_dest_name)], match
+    )
+    return routes[0]
+
+
+def get_street_segments(
+    G: nx.MultiDiGraph, segments: List[tuple], match: str = "substring"
+) -> Tuple[List[list], List[dict]]:
+    """
+    Resolves many (street_name, intersection_src_name, intersection_dest_name) segments at once,
+    as `get_street_segment` does one. Each street subgraph is built once, and one single-source
+    search (weighted by "length") per source intersection gives the routes to all destinations.
+
+    Parameters
+    -------
+    G: MultiDiGraph
+        Graph of network
+    segments: list
+        (street_name, intersection_src_name, intersection_dest_name) tuples, same naming
+        conventions as `get_street_segment`.
+    match: string
+        How names are matched, see `StreetNameIndex.match`. Default "substring".
+
+    Returns
+    -------
+    routes: list
+        List of nodes along each segment, empty if none was found.
+    diagnostics: list
+        One dict per segment with the number of "street_nodes", "src_matches" and
+        "dest_matches", the number of connected src-dest "candidates", and "found" and
+        "ambiguous" (more than one candidate route).
+    """
+    index = street_name_index(G)
+    subgraphs = {}  # street name -> (street nodes, street subgraph)
+    paths = {}  # (street name, src) -> {dest: route}
+
+    routes, diagnostics = [], []
+    for street_name, intersection_src_name, intersection_dest_name in segments:
+        if street_name not in subgraphs:
+            street_nodes = index.nodes(street_name, match)
+            subgraphs[street_name] = (street_nodes, G.subgraph(street_nodes))
+        street_nodes, street_graph = subgraphs[street_name]
+
+        # An edge matching both intersection names counts for the source only
+        src_edges = index.edges(intersection_src_name, match)
+        dest_edges = index.edges(intersection_dest_name, match) - src_edges
+
+        src_intersections = _intersection_nodes(street_nodes, src_edges)
+        dest_intersections = _intersection_nodes(street_nodes, dest_edges)
+
+        # Find the longest route between intersections in case there are multiple of either src or dest
+        route = []
+        candidates = 0
+        for src in src_intersections:
+            if (street_name, src) not in paths:
+                paths[(street_name, src)] = nx.single_source_dijkstra_path(street_graph, src, weight="length")
+            src_paths = paths[(street_name, src)]
+            for dest in dest_intersections:
+                new_route = src_paths.get(dest)
+                if new_route is None:
+                    continue
+                candidates += 1
+                # Replace route with longest
+                if len(new_route) > len(route):
+                    route = new_route
+
+        routes.append(route)
+        diagnostics.append(
+            {
+                "segment": (street_name, intersection_src_name, intersection_dest_name),
+                "street_nodes": len(street_nodes),
+                "src_matches": len(src_intersections),
+                "dest_matches": len(dest_intersections),
+                "candidates": candidates,
+                "found": bool(route),
+                "ambiguous": candidates > 1,
+            }
+        )
+    return routes, diagnostics
+
+
+def merge_graphs(
+    dst: nx.MultiDiGraph,
+    src: nx.MultiDiGraph,
+    node_attributes=["x", "y", "street_count"],
+    nodes: bool = True,
+    edges: bool = True,
+) -> Dict[str, int]:
+    """
+    Adds the nodes and edges of src that are not in dst to dst, in place. Membership is
+    checked against dst's adjacency dicts, and all additions are applied in one bulk call
+    for nodes and one for edges.
+
+    Parameters
+    -------
+    dst: MultiDiGraph
+        Graph of network that nodes and edges are being added to
+    src: MultiDiGraph
+        Graph of network whose nodes and edges are added to dst
+    node_attributes: list
+        Node attributes copied from src for the added nodes.
+    nodes: bool
+        Whether to add the missing nodes.
+    edges: bool
+        Whether to add the missing edges, matched by (u, v, key). Edge attributes are copied.
+        Endpoints not in dst are added without attributes.
+
+    Returns
+    -------
+    counts: dict
+        "nodes_added", "nodes_skipped", "edges_added" and "edges_skipped".
+    """
+    counts = {"nodes_added": 0, "nodes_skipped": 0, "edges_added": 0, "edges_skipped": 0}
+
+    if nodes:
+        new_nodes = [
+            (n, {a: d[a] for a in node_attributes}) for n, d in src.nodes(data=True) if n not in dst
+        ]
+        counts["nodes_added"] = len(new_nodes)
+        counts["nodes_skipped"] = src.number_of_nodes() - len(new_nodes)
+        dst.add_nodes_from(new_nodes)
+
+    if edges:
+        new_edges = [
+            (u, v, k, dict(d)) for u, v, k, d in src.edges(keys=True, data=True) if not dst.has_edge(u, v, k)
+        ]
+        counts["edges_added"] = len(new_edges)
+        counts["edges_skipped"] = src.number_of_edges() - len(new_edges)
+        dst.add_edges_from(new_edges)
+
+    return counts
 
 
 def combine_nodes(
@@ -174,22 +470,9 @@ def combine_nodes(
     dst:
         Graph dst with added edges from src
     """
-
-    # Get the keys for the nodes in both graphs
-
-    dst_nodes = list(dict(dst.nodes(data=True)).keys())
-    src_nodes = list(dict(src.nodes(data=True)).keys())
-
-    # Add the nodes from src not in dst to dst
-
-    for node in src_nodes:
-        if node in dst_nodes:
-            pass
-        else:
-            dst.add_node(node)
-            for a in node_attributes:
-                # set attributes
-                dst.nodes[node][a] = src.nodes[node][a]
+    counts = merge_graphs(dst, src, node_attributes, edges=False)
+    if debug:
+        print(counts)
     return dst
 
 
@@ -212,68 +495,79 @@ def combine_edges(dst: nx.MultiDiGraph, src: nx.MultiDiGraph, debug=False):
     dst:
         Graph dst with added edges from src
     """
-
-    # Get the keys for the values between edges (would need to use multiple edges
-
-    src_edges = list(src.edges)
-    dst_edges = list(dst.edges)
-
-    # Add edges not in dst to dst from src
-
-    for edge in src_edges:
-        if edge in dst_edges:
-            pass
-        else:
-            attr = dict(src[edge[0]][edge[1]][edge[2]])
-            dst.add_edge(edge[0], edge[1])
-            edge_attr = {edge: attr}
-            if debug:
-                print(edge_a)
-            nx.set_edge_attributes(dst, edge_attr)
+    counts = merge_graphs(dst, src, nodes=False)
+    if debug:
+        print(counts)
     return dst
 
 
-def ig_to_nx(G_ig: ig.Graph):
-
-    # Inits empty networkx MultiDiGraph
-
-    G_nx = nx.MultiDiGraph()
-
-    for node in G_ig.vs:
-        # The networkx key values are called _nx_name in iGraph
-
-        key = node["_nx_name"]
-
-        # adds the node attributes of the iGraph node to new node in nx at key of node
-
-        G_nx.add_node(key)
-        a = node.attributes()
-        del a["_nx_name"]
-        attrs = {key: a}
-
-        nx.set_node_attributes(G_nx, attrs)
-
-    for edge in G_ig.es:
-
-        # Get the keys of the edge in terms of nx keys
+def add_edges_unchecked(G: nx.MultiDiGraph, edges) -> None:
+    """
+    Adds (u, v, key, data) edges to G by filling its adjacency dicts directly, skipping the
+    per-edge checks of `add_edges_from`. Both endpoints must already be nodes of G, and an
+    edge whose (u, v, key) already exists has its data dict replaced rather than updated.
 
-        src_i = edge.source
-        trg_i = edge.target
-        src = G_ig.vs[src_i]["_nx_name"]
-        trg = G_ig.vs[trg_i]["_nx_name"]
+    Parameters
+    -------
+    G: MultiDiGraph
+    edges: iterable
+        (u, v, key, data) tuples. data is stored as is, not copied.
+    """
+    succ, pred = G._succ, G._pred
+    factory = G.edge_key_dict_factory
+    for u, v, k, d in edges:
+        keydict = succ[u].get(v)
+        if keydict is None:
+            # _succ and _pred share the key dict, as MultiDiGraph.add_edge does
+            keydict = succ[u][v] = pred[v][u] = factory()
+        keydict[k] = d
+    getattr(G, "__networkx_cache__", {}).clear()
+
+
+def ig_to_nx(G_ig: ig.Graph) -> nx.MultiDiGraph:
+    """
+    Converts an igraph Graph made by `ig.Graph.from_networkx` back to a networkx MultiDiGraph.
+    Node ids come from the "_nx_name" vertex attribute and edge keys from "_nx_multiedge_key",
+    so parallel edges keep their original keys. Attribute dicts are built column-wise and
+    inserted in bulk.
 
-        # add the edges to the nx graph with attributes
+    Parameters
+    -------
+    G_ig: ig.Graph
+        Graph with "_nx_name" on vertices.
 
-        G_nx.add_edge(src, trg)
-        a = edge.attributes()
-        attrs = {(src, trg, 0): a}
+    Returns
+    -------
+    G_nx: MultiDiGraph
+        Graph with the vertex, edge and graph attributes of G_ig.
+    """
+    G_nx = nx.MultiDiGraph()
+    for a in G_ig.attributes():
+        G_nx.graph[a] = G_ig[a]
 
-        nx.set_edge_attributes(G_nx, attrs)
+    # The networkx key values are called _nx_name in iGraph
+    names = G_ig.vs["_nx_name"]
+    node_attrs = [a for a in G_ig.vs.attributes() if a != "_nx_name"]
+    node_columns = [G_ig.vs[a] for a in node_attrs]
+    G_nx.add_nodes_from(
+        zip(names, (dict(zip(node_attrs, row)) for row in zip(*node_columns)))
+        if node_attrs
+        else names
+    )
 
-    # Sets the graph attributes
+    edge_attrs = [a for a in G_ig.es.attributes() if a != "_nx_multiedge_key"]
+    edge_data = [dict(zip(edge_attrs, row)) for row in zip(*(G_ig.es[a] for a in edge_attrs))]
+    if not edge_attrs:
+        edge_data = [{} for _ in range(G_ig.ecount())]
+    if "_nx_multiedge_key" in G_ig.es.attributes():
+        keys = G_ig.es["_nx_multiedge_key"]
+    else:
+        keys = [None] * G_ig.ecount()
 
-    for a in G_ig.attributes():
-        G_nx.graph[a] = G_ig[a]
+    edges = [(names[src], names[trg], key, d) for (src, trg), key, d in zip(G_ig.get_edgelist(), keys, edge_data)]
+    add_edges_unchecked(G_nx, (e for e in edges if e[2] is not None))
+    # Edges added on the igraph side have no key, give them the next free one
+    G_nx.add_edges_from((u, v, d) for u, v, key, d in edges if key is None)
 
     return G_nx
 
@@ -282,29 +576,65 @@ def graph_union(G_1, G_2):
     return [0, 0, 0, 0]
 
 
-def graph_length_km(G) -> float:
+def graph_length_km(G, by_type: bool = False):
     """
     Calculates total length of graph, counting bi-directional
     edges (e.g. (u,v), (v,u)) only once.
 
+    Edges are matched up as (max(u, v), min(u, v), key) and each pair takes
+    the length of its (max, min, key) edge if there is one, else of the
+    reverse edge. Edges without "length" are ignored.
+
     Parameters
     -------
     G: MultiDiGraph
         Graph with "length" attribute on all edges.
+    by_type: bool
+        Also return the length per "bike_infrastructure_type" of the
+        counted edges (None for edges without one).
 
     Returns
     -------
     length: float
         Graph length in km
+    lengths_by_type: dict
+        Only if by_type. Infrastructure type : length in km.
     """
-    length_dict = nx.get_edge_attributes(G, "length")
-    unique_edges = np.unique(
-        [sorted(t, reverse=True) for t in length_dict.keys()], axis=0
+    index = {n: i for i, n in enumerate(G)}
+    if G.is_directed():  # reading the adjacency dicts directly is several times faster than G.edges
+        edge_iter = (
+            (i, index[v], k, d)
+            for i, nbrs in enumerate(G._adj.values())
+            for v, keydict in nbrs.items()
+            for k, d in keydict.items()
+        )
+    else:
+        edge_iter = ((index[u], index[v], k, d) for u, v, k, d in G.edges(keys=True, data=True))
+    edges = [e for e in edge_iter if "length" in e[3]]
+    m = len(edges)
+    u = np.fromiter((e[0] for e in edges), dtype=np.int64, count=m)
+    v = np.fromiter((e[1] for e in edges), dtype=np.int64, count=m)
+    key = np.fromiter((e[2] for e in edges), dtype=np.int64, count=m)
+    length = np.fromiter((e[3]["length"] for e in edges), dtype=np.float64, count=m)
+
+    # Canonical (max, min, key) edge; the (max, min) direction sorts first within a pair
+    uid = np.fromiter(G, dtype=np.int64 if all(type(n) is int for n in G) else object, count=len(index))
+    forward = uid[u] >= uid[v]
+    hi, lo = np.where(forward, u, v), np.where(forward, v, u)
+    order = np.lexsort((~forward, key, lo, hi))
+    hi, lo, key = hi[order], lo[order], key[order]
+    first = np.ones(m, dtype=bool)
+    first[1:] = (hi[1:] != hi[:-1]) | (lo[1:] != lo[:-1]) | (key[1:] != key[:-1])
+    counted = order[first]
+    total_length = length[counted].sum()
+    if not by_type:
+        return total_length / 1000
+
+    codes = {}
+    type_code = np.fromiter(
+        (codes.setdefault(edges[i][3].get("bike_infrastructure_type"), len(codes)) for i in counted.tolist()),
+        dtype=np.int64,
+        count=len(counted),
     )
-    total_length = 0
-    for e in unique_edges:
-        try:
-            total_length += length_dict[tuple(e)]
-        except KeyError as err:
-            total_length += length_dict[(e[1], e[0], e[2])]  # if error try reverse
-    return total_length / 1000
+    lengths = np.bincount(type_code, weights=length[counted], minlength=len(codes)) / 1000
+    return total_length / 1000, dict(zip(codes, lengths.tolist()))
@@ -1,15 +1,21 @@
 from distutils.command.config import config
+import functools
+import os
+import threading
+import time
 import osmnx as ox
 import networkx as nx
 import numpy as np
-import pandas as pd
 import geopandas as gpd
+import pyproj
+import shapely
 from roc_bike_growth.settings import CONFIG
-from roc_bike_growth.graph_utils import get_street_segment
+from roc_bike_growth.graph_utils import get_street_segments, snap_to_nodes
+from roc_bike_growth import cache
 from shapely.geometry import Polygon, MultiPolygon, LineString, Point
-from cenpy import products
 
-from typing import List, Union, Tuple
+from concurrent.futures import ThreadPoolExecutor, as_completed
+from typing import Dict, List, Optional, Union, Tuple
 
 
 def download_osm_POIs(
@@ -59,7 +65,30 @@ def download_osm_POIs(
     # Do overpass query
     query = f"{overpass_settings};({';'.join(components)};>;);out;"
 
-    return ox.downloader.overpass_request(data={"data": query})
+    return cache.cached(
+        "osm_pois",
+        polygon,
+        custom_filters,
+        lambda: ox.downloader.overpass_request(data={"data": query}),
+    )
+
+
+def _graph_from_polygon(polygon: Polygon, **params) -> nx.MultiDiGraph:
+    """
+    `ox.graph_from_polygon` through the local download cache (see `cache.py`).
+    Empty responses are cached too, so offline runs raise the same error.
+    """
+
+    def build():
+        try:
+            return ox.graph_from_polygon(polygon, **params)
+        except ox._errors.EmptyOverpassResponse:
+            return None
+
+    G = cache.cached("graph_from_polygon", polygon, params, build)
+    if G is None:
+        raise ox._errors.EmptyOverpassResponse("There are no data elements in the response JSON")
+    return G
 
 
 def POI_graph_from_polygon(
@@ -86,28 +115,135 @@ def POI_graph_from_polygon(
     return ox.graph._create_graph([response], retain_all=True)
 
 
+class _RateLimiter:
+    """Spaces out calls from several threads to at most `rate` per second."""
+
+    def __init__(self, rate: float):
+        self.interval = 1 / rate if rate else 0
+        self.lock = threading.Lock()
+        self.next = 0.0
+
+    def wait(self) -> None:
+        with self.lock:
+            now = time.monotonic()
+            start = max(now, self.next)
+            self.next = start + self.interval
+        time.sleep(start - now)
+
+
+def _is_no_result(e: Exception) -> bool:
+    # ox.geocoder.geocode's answer for queries Nominatim has no match for. The same exception
+    # type is also raised for unparsable responses, hence the message check.
+    return isinstance(e, ox._errors.InsufficientResponseError) and "could not geocode" in str(e)
+
+
+def geocode_addresses(
+    queries: List[str],
+    n_workers: int = CONFIG.geocode_workers,
+    rate: float = CONFIG.geocode_rate,
+    retry_failed: bool = False,
+) -> Dict[str, Optional[Point]]:
+    """
+    Geocodes a batch of queries through the persistent `cache.GeocodeCache`.
+
+    Only queries missing from the cache are geocoded, concurrently in a pool of n_workers
+    threads with at most `rate` requests per second overall. Every result is stored as soon
+    as it arrives, so a warm run does no geocoding at all and an interrupted one keeps what it
+    got. Of the failures only "no result" answers are stored; transport and HTTP errors
+    (connection, timeout, 429) are not, so the next run tries those queries again. Follows
+    CONFIG.use_cache and CONFIG.cache_only like the download cache.
+
+    Parameters
+    -------
+    queries: List[str]
+        Free-form queries for `ox.geocoder.geocode`.
+    n_workers: int
+        Geocoding threads.
+    rate: float
+        Max requests per second. 0 for no limit.
+    retry_failed: bool = False
+        Geocode again the queries that failed in an earlier run.
+
+    Returns
+    -------
+    dict of query : Point, None for queries that could not be geocoded
+    """
+    db = cache.GeocodeCache() if CONFIG.use_cache else None
+    points = {}
+    try:
+        for query, (lat, lon, _) in (db.get(queries) if db else {}).items():
+            if lat is not None:
+                points[query] = Point(lon, lat)
+            elif not retry_failed:
+                points[query] = None
+        todo = [q for q in dict.fromkeys(queries) if q not in points]
+        if todo and CONFIG.cache_only:
+            raise FileNotFoundError(f"{len(todo)} addresses are not geocoded in {CONFIG.cache_dir}.")
+
+        limiter = _RateLimiter(rate)
+
+        def geocode(query: str) -> Tuple[float, float]:
+            limiter.wait()
+            return ox.geocoder.geocode(query)
+
+        with ThreadPoolExecutor(n_workers) as pool:
+            futures = {pool.submit(geocode, query): query for query in todo}
+            for future in as_completed(futures):
+                query = futures[future]
+                try:
+                    lat, lon = future.result()
+                    points[query], error = Point(lon, lat), None
+                except Exception as e:
+                    print(f"Exception at {query}. This point will be dropped:")
+                    print(f" {e}")
+                    lat = lon = points[query] = None
+                    error = f"{type(e).__name__}: {e}"
+                    if not _is_no_result(e):
+                        continue  # transient, geocode again next run
+                if db:
+                    db.put(query, lat, lon, error)
+    finally:
+        if db:
+            db.close()
+    return points
+
+
 def POIs_from_file(filepath: str) -> gpd.GeoDataFrame:
     """
     Loads pois from file and convert projection.
+    Addresses are geocoded with `geocode_addresses`, so only the first run does lookups.
     """
     gdf = gpd.read_file(filepath)
+    queries = [f"{address} rochester ny" for address in gdf["Address"]]
+    points = geocode_addresses(queries)
+    failed = sum(points[q] is None for q in queries)
+    if failed:
+        print(f"{failed} addresses could not be geocoded and are dropped.")
 
-    def address2point(address: str) -> Point:
-        """
-        Geocodes address and converts to Point
-        """
-        try:
-            lat, lon = ox.geocoder.geocode(f"{address} rochester ny")
-        except Exception as e:
-            print(f"Exception at {address}. This point will be dropped:")
-            print(f" {e}")
-            return
+    return gdf.assign(geometry=[points[q] for q in queries]).dropna(subset=["geometry"])
 
-        return Point(lon, lat)
 
-    return gdf.assign(geometry=gdf["Address"].apply(address2point)).dropna(
-        subset=["geometry"]
-    )
+@functools.lru_cache(maxsize=None)
+def _tract_income(county: str) -> gpd.GeoDataFrame:
+    """
+    Census tract polygons of a county with their median income (CONFIG.median_income_var) from
+    ACS 2019, in EPSG:4326. Downloaded via cenpy once, then read from the local cache (see
+    `cache.py`) and kept in memory with its spatial index.
+    """
+
+    def build():
+        # cenpy contacts the census API on import, so only import it when needed
+        from cenpy import products
+
+        income_df = (
+            products.ACS(2019)
+            .from_county(county, level="tract", variables=[CONFIG.median_income_var])
+            .to_crs("EPSG:4326")
+        )
+        return income_df[["GEOID", CONFIG.median_income_var, "geometry"]].reset_index(drop=True)
+
+    params = {"county": county, "year": 2019, "variables": [CONFIG.median_income_var]}
+    return cache.cached("acs_tract_income", None, params, build)
 
 
 def _downsample_poi_nodes_by_income(
@@ -116,10 +252,12 @@ def _downsample_poi_nodes_by_income(
     county: str,
     downsample_pct: float = 0.1,
     income_cutoff_quantile: float = 0.25,
+    seed: int = 0,
 ) -> Tuple[np.ndarray, np.ndarray]:
     """
-    Downsamples POIs in wealthier areas using census data via cenpy. May
-    take a few minutes to download necessary census data.
+    Downsamples POIs in wealthier areas using census data via cenpy. The
+    census data takes a few minutes to download the first time, and is
+    cached after that (see `_tract_income`).
 
     Parameters
     -------
@@ -135,42 +273,29 @@ def _downsample_poi_nodes_by_income(
     income_cutoff_quantile: float
         Quantile of median income by census tract to use for cutoff between
         high and low income areas.
+    seed: int
+        Seed of the sample of upper-income POIs that is kept.
 
     Returns
     -------
     (X,Y) : Tuple[np.ndarray, np.ndarray]
+        Kept POIs, in input order. POIs outside all tracts are kept.
     """
-    variables = {
-        "B07011_001E": "median_income_curr_res",  # EMdian income in the past 12 months by geographical mobility in the past year for current residence in the united states
-    }
-    income_df = (
-        products.ACS(2019)
-        .from_county(county, level="tract", variables=list(variables.keys()))
-        .to_crs("EPSG:4326")
-    )
+    income_df = _tract_income(county)
+    income = income_df[CONFIG.median_income_var].to_numpy(dtype=float)
+    income_cutoff = np.nanquantile(income, income_cutoff_quantile)
 
-    poi_gdf = gpd.GeoDataFrame(
-        geometry=[Point(x, y) for x, y in zip(X, Y)], crs="EPSG:4326"
-    )
-    poi_with_income = poi_gdf.sjoin(
-        income_df[["GEOID", "geometry", CONFIG.median_income_var]],
-        how="left",
-        predicate="within",
-    )
-    income_cutoff = income_df[CONFIG.median_income_var].quantile(0.25)
-    upper_income = poi_with_income.query(
-        f"{CONFIG.median_income_var} > {income_cutoff}"
-    )
-    lower_income = poi_with_income.query(
-        f"{CONFIG.median_income_var} <= {income_cutoff}"
-    )
-    adjust_pois = pd.concat(
-        [lower_income, upper_income.sample(frac=(1 - downsample_pct), replace=False)]
-    )
+    X, Y = np.asarray(X, dtype=float), np.asarray(Y, dtype=float)
+    poi_idx, tract_idx = income_df.sindex.query(gpd.points_from_xy(X, Y), predicate="within")
+    poi_income = np.full(len(X), np.nan)
+    poi_income[poi_idx] = income[tract_idx]
+    upper_income = np.flatnonzero(poi_income > income_cutoff)
 
-    X = list(adjust_pois.geometry.x)
-    Y = list(adjust_pois.geometry.y)
-    return X, Y
+    keep = np.ones(len(X), dtype=bool)
+    n_keep = round(len(upper_income) * (1 - downsample_pct))
+    keep[upper_income] = False
+    keep[np.random.default_rng(seed).choice(upper_income, n_keep, replace=False)] = True
+    return X[keep], Y[keep]
 
 
 def _fill_edge_geometry(G: nx.MultiDiGraph) -> nx.MultiDiGraph:
@@ -178,6 +303,7 @@ def _fill_edge_geometry(G: nx.MultiDiGraph) -> nx.MultiDiGraph:
     Naive filling of empty edge geometries. For edge (u,v), creates LineString from u to v.
 
     Adapted from https://github.com/gboeing/osmnx/blob/main/osmnx/utils_graph.py
+    All missing geometries are built in one `shapely.linestrings` call.
 
     Parameters
     -------
@@ -188,23 +314,129 @@ def _fill_edge_geometry(G: nx.MultiDiGraph) -> nx.MultiDiGraph:
     -------
     G with edges geometries added in.
     """
-    x_lookup = nx.get_node_attributes(G, "x")
-    y_lookup = nx.get_node_attributes(G, "y")
-    eattrs = {}
-    for u, v, k, data in G.edges(keys=True, data=True):
-        if data.get("geometry", None) is None:
-            geom = LineString(
-                (
-                    Point((x_lookup[u], y_lookup[u])),
-                    Point((x_lookup[v], y_lookup[v])),
-                )
-            )
-            eattrs[(u, v, k)] = {"geometry": geom}
+    missing = [(u, v, d) for u, v, d in G.edges(data=True) if d.get("geometry", None) is None]
+    if missing:
+        index = {n: i for i, n in enumerate(G)}
+        xy = np.array([(d["x"], d["y"]) for _, d in G.nodes(data=True)], dtype=np.float64)
+        ends = np.array([(index[u], index[v]) for u, v, _ in missing], dtype=np.int64)
+        geoms = shapely.linestrings(xy[ends])  # coordinates of shape (edges, 2, 2)
+        for (_, _, d), geom in zip(missing, geoms.tolist()):
+            d["geometry"] = geom
+    G.graph["edge_geometry"] = "filled"
+    return G
+
 
-    nx.set_edge_attributes(G, eattrs)
+def ensure_edge_geometry(G: nx.MultiDiGraph, force: bool = False) -> nx.MultiDiGraph:
+    """
+    Fills missing edge geometries of a graph loaded with fill_edge_geometry="lazy". Call it
+    before plotting or exporting such a graph with code that reads d["geometry"] of every edge;
+    the loaders leave it to the caller. Returns right away if they were filled before, so it
+    can be called on every frame.
+
+    Parameters
+    -------
+    G: nx.MultiDiGraph
+        graph
+    force: bool = False
+        Fill again, e.g. after adding edges to the graph.
+
+    Returns
+    -------
+    G with edges geometries added in.
+    """
+    if force or G.graph.get("edge_geometry") != "filled":
+        _fill_edge_geometry(G)
     return G
 
 
+def _apply_edge_geometry(G: nx.MultiDiGraph, fill_edge_geometry: Union[bool, str]) -> nx.MultiDiGraph:
+    if fill_edge_geometry == "lazy":
+        G.graph["edge_geometry"] = "lazy"
+        return G
+    if fill_edge_geometry:
+        return _fill_edge_geometry(G)
+    return G
+
+
+def load_crash_events(filepath: str = CONFIG.crash_filepath) -> gpd.GeoDataFrame:
+    """
+    Loads the crash event points. The shapefile comes without attribute table, so this
+    is only geometries, in the file's projected CRS.
+    """
+    return gpd.read_file(filepath)
+
+
+def _projected_edge_lines(G: nx.MultiDiGraph, edges: list, crs) -> np.ndarray:
+    """
+    Geometries of (u, v, data) edges projected to crs, as an array: the edge "geometry"
+    where present, the straight line from u to v otherwise.
+    """
+    index = {n: i for i, n in enumerate(G)}
+    xy = np.array([(d["x"], d["y"]) for _, d in G.nodes(data=True)], dtype=np.float64)
+    ends = np.array([(index[u], index[v]) for u, v, _ in edges], dtype=np.int64).reshape(-1, 2)
+    lines = shapely.linestrings(xy[ends])
+    geometry = [d.get("geometry") for _, _, d in edges]
+    has_geometry = np.array([g is not None for g in geometry], dtype=bool)
+    lines[has_geometry] = [g for g in geometry if g is not None]
+
+    transformer = pyproj.Transformer.from_crs(G.graph.get("crs", "epsg:4326"), crs, always_xy=True)
+    return shapely.transform(lines, lambda c: np.column_stack(transformer.transform(c[:, 0], c[:, 1])))
+
+
+def crash_counts(
+    G: nx.MultiDiGraph,
+    events: gpd.GeoDataFrame = None,
+    max_dist: float = CONFIG.crash_snap_dist,
+) -> np.ndarray:
+    """
+    Number of crash events snapped to each edge of G, in G.edges order.
+
+    All events are snapped in one STRtree nearest query over the edge geometries, projected to
+    the CRS of the events. An event on a two-way street counts for both directions, and one at
+    equal distance from several edges (e.g. on an intersection node) counts for each of them.
+
+    Parameters
+    -------
+    G: nx.MultiDiGraph
+        Graph with "x", "y" on nodes. Edge geometries are used where present, straight lines otherwise.
+    events: gpd.GeoDataFrame = None
+        Crash points with a projected CRS in meters. Defaults to `load_crash_events()`.
+    max_dist: float
+        Events further than this from every edge (meters) are dropped.
+
+    Returns
+    -------
+    counts: np.ndarray
+        int32, one count per edge.
+    """
+    if events is None:
+        events = load_crash_events()
+    edges = list(G.edges(data=True))
+    counts = np.zeros(len(edges), dtype=np.int32)
+    if not edges or events.empty:
+        return counts
+
+    tree = shapely.STRtree(_projected_edge_lines(G, edges, events.crs))
+    _, edge_idx = tree.query_nearest(events.geometry.values, max_distance=max_dist)
+    np.add.at(counts, edge_idx, 1)
+    return counts
+
+
+def add_crash_counts(
+    G: nx.MultiDiGraph,
+    events: gpd.GeoDataFrame = None,
+    max_dist: float = CONFIG.crash_snap_dist,
+) -> np.ndarray:
+    """
+    Sets the `crash_counts` of each edge as "crashes" edge attribute, which
+    `paper_gt` weights into the routing cost with crash_factor. Returns the counts.
+    """
+    counts = crash_counts(G, events, max_dist)
+    for (_, _, d), n in zip(G.edges(data=True), counts.tolist()):
+        d["crashes"] = n
+    return counts
+
+
 def load_roc_in_progress(carall: nx.MultiDiGraph = None) -> nx.MultiDiGraph:
     """
     Downloads rochester in-progress bike infrastructure graph.
@@ -231,9 +463,11 @@ def load_roc_in_progress(carall: nx.MultiDiGraph = None) -> nx.MultiDiGraph:
     # Should probably just refactor this whole thing into a class...
     if carall is None:
         carall = carall_from_polygon(ox.geocode_to_gdf("rochester, ny").geometry[0])
-    nodes = []
-    for street, src, dest in segments:
-        nodes += get_street_segment(carall, street, src, dest)
+    routes, diagnostics = get_street_segments(carall, segments)
+    for d in diagnostics:
+        if not d["found"]:
+            print(f"No route found for segment {d['segment']}")
+    nodes = [n for route in routes for n in route]
 
     roc_in_progress = carall.subgraph(set(nodes)).copy()
 
@@ -296,9 +530,11 @@ def load_roc_proposed(
     # Should probably just refactor this whole thing into a class...
     if carall is None:
         carall = carall_from_polygon(ox.geocode_to_gdf("rochester, ny").geometry[0])
-    nodes = []
-    for street, src, dest in segments:
-        nodes += get_street_segment(carall, street, src, dest)
+    routes, diagnostics = get_street_segments(carall, segments)
+    for d in diagnostics:
+        if not d["found"]:
+            print(f"No route found for segment {d['segment']}")
+    nodes = [n for route in routes for n in route]
 
     return carall.subgraph(set(nodes)).copy()
 
@@ -307,7 +543,7 @@ def bike_infra_from_polygon(
     polygon: Polygon,
     custom_filters: dict = CONFIG.osm_bike_params,
     compose_all: bool = True,
-    fill_edge_geometry: bool = True,
+    fill_edge_geometry: Union[bool, str] = True,
     buffer_dist: float = 100,
     add_roc_in_progress: bool = True,
 ) -> nx.MultiDiGraph:
@@ -320,8 +556,10 @@ def bike_infra_from_polygon(
         Shapely Polygon object to use as query boundary.
     compose_all: bool = True
         If true, compose all into a signle graph
-    fill_edge_geometry: bool = True
+    fill_edge_geometry: bool | "lazy" = True
         Flag to fill missing edge geometries. For edge (u,v), creates LineString from u to v.
+        "lazy" leaves them missing: call `ensure_edge_geometry` on the graph before plotting or
+        exporting it, nothing in this package does so.
     buffer_dist: float = 100
         Buffer to pad the query polygon in meters
     add_roc_in_progress: bool = True
@@ -344,7 +582,7 @@ def bike_infra_from_polygon(
 
     for name, params in custom_filters.items():
         try:
-            G = ox.graph_from_polygon(polygon, truncate_by_edge=True, **params)
+            G = _graph_from_polygon(polygon, truncate_by_edge=True, **params)
             nx.set_edge_attributes(G, name, "bike_infrastructure_type")
             graphs.append(G)
             names.append(name)
@@ -361,22 +599,144 @@ def bike_infra_from_polygon(
 
     if compose_all:
         G = nx.compose_all(graphs)  # Returns a single graph
-        if fill_edge_geometry:
-            return _fill_edge_geometry(G)
-        else:
-            return G
+        return _apply_edge_geometry(G, fill_edge_geometry)
     else:
-        if fill_edge_geometry:
-            return list(zip(names, [_fill_edge_geometry(g) for g in graphs]))
+        return list(zip(names, [_apply_edge_geometry(g, fill_edge_geometry) for g in graphs]))
+
+
+def _read_bike_rochester_layer(name: str, bbox: gpd.GeoSeries, data_dir: str) -> gpd.GeoDataFrame:
+    gdf = gpd.read_file(os.path.join(data_dir, f"{name}.shp"), bbox=bbox)
+    if "Status" in gdf:  # planned infrastructure is not part of the existing network
+        excluded = gdf["Status"].isin(CONFIG.bike_rochester_excluded_statuses)
+        if excluded.any():
+            counts = gdf["Status"][excluded].value_counts().to_dict()
+            print(f"{name}: dropped {excluded.sum()} rows with Status {counts}")
+        gdf = gdf[~excluded]
+    return gdf
+
+
+def bike_infra_from_shapefiles(
+    carall: nx.MultiDiGraph,
+    polygon: Polygon = None,
+    layers: dict = CONFIG.bike_rochester_layers,
+    add_tentative: bool = True,
+    compose_all: bool = True,
+    snap_dist: float = CONFIG.bike_rochester_snap_dist,
+    data_dir: str = CONFIG.bike_rochester_dir,
+    min_parallel: float = 0.7,
+) -> nx.MultiDiGraph:
+    """
+    Offline version of `bike_infra_from_polygon` from the BikeRochester shapefiles in data/.
+
+    The bike lines are snapped onto the drive network: a carall edge is part of the bike
+    network if its points at 1/4, 1/2 and 3/4 of its length all lie within snap_dist of the
+    same bike line, checked with an STRtree over the lines in one bulk query per point, and
+    it runs along that line: the 1/4 and 3/4 points, projected onto the line, are at least
+    `min_parallel` of their distance apart. This drops short cross streets at intersections,
+    which lie within snap_dist of the line over their whole length. Edges matching several
+    lines take the type of the first layer (and row) in `layers`. Trails away
+    from streets have no drive edges to snap to and are left out. "Bike Features" points (bike
+    boxes, racks) are set as "bike_feature" on the nearest node of the result within snap_dist.
+
+    Parameters
+    -------
+    carall: nx.MultiDiGraph
+        Drive network, e.g. from `carall_from_polygon`.
+    polygon: Polygon = None
+        Query boundary used as bounding-box filter on the layers. Defaults to the extent of carall.
+    layers: dict
+        Layer name : bike_infrastructure_type, or {"Type" value: bike_infrastructure_type}.
+    add_tentative: bool = True
+        Also add the approved and built "Tentative Markings", like `add_roc_in_progress`,
+        typed with the mapping of "Bike Markings" (skipped if `layers` has none).
+    compose_all: bool = True
+        If true, compose all into a signle graph
+    snap_dist: float
+        Snapping distance in meters.
+    data_dir: str
+        Folder with the shapefiles.
+    min_parallel: float = 0.7
+        Cosine of the largest angle between an edge and its bike line, about 45 degrees.
+
+    Returns
+    -------
+    bike network within input polygon, edges and nodes taken from carall
+    """
+    if polygon is None:
+        x, y = zip(*((d["x"], d["y"]) for _, d in carall.nodes(data=True)))
+        polygon = shapely.box(min(x), min(y), max(x), max(y))
+    bbox = gpd.GeoSeries([polygon], crs=carall.graph.get("crs", "epsg:4326"))
+
+    layers = dict(layers)
+    if add_tentative and "Bike Markings" in layers:
+        layers["Tentative Markings"] = layers["Bike Markings"]
+    lines, types = [], []
+    for name, layer_types in layers.items():
+        gdf = _read_bike_rochester_layer(name, bbox, data_dir).to_crs(CONFIG.local_crs)
+        if isinstance(layer_types, dict):
+            gdf = gdf.assign(bike_type=gdf["Type"].map(layer_types)).dropna(subset=["bike_type"])
         else:
-            return list(zip(names, graphs))
+            gdf = gdf.assign(bike_type=layer_types)
+        lines.extend(gdf.geometry.values)
+        types.extend(gdf["bike_type"])
+
+    edges = list(carall.edges(keys=True, data=True))
+    matched = np.full(len(edges), -1, dtype=np.int64)  # first matching line of each edge
+    if lines and edges:
+        tree = shapely.STRtree(np.array(lines, dtype=object))
+        edge_lines = _projected_edge_lines(carall, [(u, v, d) for u, v, _, d in edges], CONFIG.local_crs)
+        pairs, points = None, {}
+        for fraction in [0.25, 0.5, 0.75]:
+            points[fraction] = shapely.line_interpolate_point(edge_lines, fraction, normalized=True)
+            edge_idx, line_idx = tree.query(points[fraction], predicate="dwithin", distance=snap_dist)
+            codes = edge_idx * len(lines) + line_idx
+            pairs = codes if pairs is None else np.intersect1d(pairs, codes)
+        pairs = np.unique(pairs)  # sorted: by edge, then line
+
+        # Keep the pairs where the edge runs along the line rather than across it
+        edge_idx, line_idx = pairs // len(lines), pairs % len(lines)
+        start, end = points[0.25][edge_idx], points[0.75][edge_idx]
+        along = np.abs(
+            shapely.line_locate_point(tree.geometries[line_idx], end)
+            - shapely.line_locate_point(tree.geometries[line_idx], start)
+        )
+        pairs = pairs[along >= min_parallel * shapely.distance(start, end)]
+        edge_idx, first = np.unique(pairs // len(lines), return_index=True)
+        matched[edge_idx] = pairs[first] % len(lines)
+
+    keep = np.flatnonzero(matched >= 0).tolist()
+    G = carall.edge_subgraph([edges[i][:3] for i in keep]).copy()
+    for i in keep:
+        u, v, k, _ = edges[i]
+        G.edges[u, v, k]["bike_infrastructure_type"] = types[matched[i]]
+    _add_bike_features(G, bbox, snap_dist, data_dir)
+
+    if compose_all:
+        return G
+    names = list(dict.fromkeys(types[matched[i]] for i in keep))
+    return [
+        (name, G.edge_subgraph([(u, v, k) for u, v, k, t in G.edges(keys=True, data="bike_infrastructure_type") if t == name]).copy())
+        for name in names
+    ]
+
+
+def _add_bike_features(G: nx.MultiDiGraph, bbox: gpd.GeoSeries, snap_dist: float, data_dir: str) -> None:
+    features = _read_bike_rochester_layer("Bike Features", bbox, data_dir)
+    if features.empty or not len(G):
+        return
+    features = features.to_crs(G.graph.get("crs", "epsg:4326"))
+    nodes, _, snapped = snap_to_nodes(G, features.geometry.x, features.geometry.y, snap_dist)
+    for n, name in zip(nodes.tolist(), features["Name"][snapped]):
+        G.nodes[n]["bike_feature"] = name
 
 
 def carall_from_polygon(
     polygon: Polygon,
     add_pois: bool = False,
     poi_downsample_pct: float = 0,
-    fill_edge_geometry: bool = True,
+    fill_edge_geometry: Union[bool, str] = True,
+    add_crashes: bool = False,
+    poi_seed: int = 0,
 ) -> nx.MultiDiGraph:
     """
     Downloads network of "driveable" roads
@@ -389,39 +749,44 @@ def carall_from_polygon(
         Flag to also tag nodes that are nearest to pois identified in `download_osm_POIs`.
     poi_downsample_pct: float = 0
         Percent of downsampling to apply to higher-income POIs.
-    fill_edge_geometry: bool = True
+    fill_edge_geometry: bool | "lazy" = True
         Flag to fill missing edge geometries. For edge (u,v), creates LineString from u to v.
+        "lazy" leaves them missing: call `ensure_edge_geometry` on the graph before plotting or
+        exporting it, nothing in this package does so.
+    add_crashes: bool = False
+        Flag to snap the crash events of CONFIG.crash_filepath to the edges, see `add_crash_counts`.
+    poi_seed: int = 0
+        Seed of the POI downsampling.
     Returns
     -------
     driveable network within input polygon
     """
 
     try:
-        G = ox.graph_from_polygon(polygon, **CONFIG.osm_carall_params["carall"])
+        G = _graph_from_polygon(polygon, **CONFIG.osm_carall_params["carall"])
 
         if add_pois:
             # Download osm POIs
             pois = download_osm_POIs(polygon)
 
             # Find nearest node in G for each POI
-            X, Y = [], []
-            for node in pois["elements"]:
-                X.append(node["lon"])
-                Y.append(node["lat"])
+            X = np.array([node["lon"] for node in pois["elements"]], dtype=float)
+            Y = np.array([node["lat"] for node in pois["elements"]], dtype=float)
 
             # Add POIs from file
             gdf = POIs_from_file(CONFIG.poi_filepath)
-            for _, row in gdf.iterrows():
-                x, y = row["geometry"].coords[0]
-                X.append(x)
-                Y.append(y)
+            X = np.concatenate([X, gdf.geometry.x.to_numpy()])
+            Y = np.concatenate([Y, gdf.geometry.y.to_numpy()])
 
             if poi_downsample_pct > 0:
                 X, Y = _downsample_poi_nodes_by_income(
-                    X, Y, "Monroe, NY", poi_downsample_pct
+                    X, Y, "Monroe, NY", poi_downsample_pct, seed=poi_seed
                 )
 
-            poi_nodes = np.unique(ox.distance.nearest_nodes(G, X=X, Y=Y))
+            poi_nodes, _, snapped = snap_to_nodes(G, X, Y, CONFIG.poi_snap_dist)
+            if not snapped.all():
+                print(f"{(~snapped).sum()} POIs are further than {CONFIG.poi_snap_dist} m from the network and are dropped.")
+            poi_nodes = np.unique(poi_nodes)
 
             # Update those nodes to contain attribute 'poi'=True
             update_dict = {}
@@ -429,10 +794,10 @@ def carall_from_polygon(
                 update_dict[node] = True
             nx.set_node_attributes(G, update_dict, name="poi")
 
-        if fill_edge_geometry:
-            G = _fill_edge_geometry(G)
+        if add_crashes:
+            add_crash_counts(G)
 
-        return G
+        return _apply_edge_geometry(G, fill_edge_geometry)
 
     except ox._errors.EmptyOverpassResponse:
         print(f"No OSM data for carall")
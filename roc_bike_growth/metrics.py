@@ -1,12 +1,14 @@
 import networkx as nx
 import random
-import itertools
+from dataclasses import dataclass, asdict
+from functools import cached_property
+from typing import Optional, Tuple
 import igraph as ig
 from haversine import haversine_vector
+import numpy as np
 import pyproj
-from shapely import ops
-from shapely.geometry import Polygon, LineString
-import copy
+import shapely
+from roc_bike_growth.compact import CompactGraph
 
 def graph_resilience(G, variant = 'density'):
     assert variant in ['density', 'largest_component']
@@ -35,76 +37,398 @@ def graph_global_efficiency(G):
 def graph_local_efficiency(G):
     return nx.algorithms.efficiency.local_efficiency(G)
 
-def paper_global_efficiency(G, pairs_thresh=500):
-    # Input is a igraph Graph
-    try:
-        G = ig.Graph.from_networkx(nx.Graph(G))
-    except:
-        pass
-    
-    if G.vcount() > pairs_thresh:
-        nodeindices = random.sample(list(G.vs.indices), pairs_thresh)
-    else:
-        nodeindices = list(G.vs.indices)
-    
-    d_ij = G.shortest_paths(source = nodeindices, target = nodeindices)
-    d_ij = [item for sublist in d_ij for item in sublist] # flatten
-    EG  = sum([1/d for d in d_ij if d != 0])
-    pairs = list(itertools.permutations(nodeindices, 2))
-    l_ij = dist_vector([(G.vs[p[0]]["y"], G.vs[p[0]]["x"]) for p in pairs],
-                            [(G.vs[p[1]]["y"], G.vs[p[1]]["x"]) for p in pairs]) # must be in format lat,lon = y,x
-    EG_id = sum([1/l for l in l_ij if l != 0])
-    
-    return EG / EG_id
-
-def paper_local_efficiency(G, numnodepairs=500):
+def _undirected_compact(G):
+    # Same graph as nx.Graph(G) as CompactGraph, CompactGraph input is taken as already converted
+    if isinstance(G, CompactGraph):
+        return G
+    return CompactGraph.from_networkx(G).to_undirected()
+
+def _undirected_igraph(G):
+    # Same graph as ig.Graph.from_networkx(nx.Graph(G)) with only coordinates, without copying attribute dicts
+    if isinstance(G, ig.Graph):
+        return G
+    return _undirected_compact(G).to_igraph()
+
+def _haversine_matrix(lat, lon):
+    # Pairwise great-circle distances in meters, same formula and radius as haversine_vector.
+    # Leading dimensions are batch dimensions.
+    lat, lon = np.radians(lat), np.radians(lon)
+    dlat = lat[..., :, None] - lat[..., None, :]
+    dlon = lon[..., :, None] - lon[..., None, :]
+    a = np.sin(dlat / 2) ** 2 + np.cos(lat)[..., :, None] * np.cos(lat)[..., None, :] * np.sin(dlon / 2) ** 2
+    return 2 * 6371008.8 * np.arcsin(np.sqrt(a))
+
+def _reciprocal(d):
+    # 1/d with zero (same node) and infinite (disconnected) distances contributing 0
+    out = np.zeros(d.shape)
+    np.divide(1, d, out=out, where=(d != 0) & np.isfinite(d))
+    return out
+
+def _rng(seed):
+    return random if seed is None else seed if isinstance(seed, random.Random) else random.Random(seed)
+
+def _sample_nodes(n, size, rng):
+    return rng.sample(range(n), size) if n > size else list(range(n))
+
+def _efficiency_matrices(G, nodeindices):
+    # Reciprocal hop distance and great-circle distance matrices between the sampled nodes of igraph G
+    inv_d = _reciprocal(np.array(G.distances(source = nodeindices, target = nodeindices), dtype=float))
+    lat = np.array(G.vs["y"], dtype=float)[nodeindices]
+    lon = np.array(G.vs["x"], dtype=float)[nodeindices]
+    inv_l = _reciprocal(_haversine_matrix(lat, lon))
+    return inv_d, inv_l
+
+def _efficiency_ci(inv_d, inv_l, rng, ci, n_boot):
+    # Resampled node sets as multiplicities w, each giving (w^T inv_d w) / (w^T inv_l w).
+    # Self pairs of repeated nodes have zero weight on both sides.
+    k = len(inv_d)
+    np_rng = np.random.default_rng(rng.getrandbits(64))
+    w = np_rng.multinomial(k, np.full(k, 1 / k), size=n_boot)
+    boot = ((w @ inv_d) * w).sum(axis=1) / ((w @ inv_l) * w).sum(axis=1)
+    lower, upper = np.nanquantile(boot, [(1 - ci) / 2, (1 + ci) / 2])
+    return float(lower), float(upper)
+
+def paper_global_efficiency(G, pairs_thresh=500, seed=None, ci=None, n_boot=1000):
+    """
+    Global efficiency of G, shortest path (in hops) efficiency over great-circle distance efficiency,
+    on a sample of `pairs_thresh` nodes for larger graphs.
+
+    seed (int or random.Random) fixes the node sample, by default the global random module is used.
+    With ci (e.g. 0.95), returns (efficiency, (lower, upper)), a bootstrap confidence interval over
+    the sampled nodes from `n_boot` resamples.
+    """
     # Input is a igraph Graph
-    try:
-        G = ig.Graph.from_networkx(nx.Graph(G))
-    except:
-        pass
-    
-    if G.vcount() > numnodepairs:
-        nodeindices = random.sample(list(G.vs.indices), numnodepairs)
-    else:
-        nodeindices = list(G.vs.indices)
-    EGi = []
+    G = _undirected_igraph(G)
+    rng = _rng(seed)
+    inv_d, inv_l = _efficiency_matrices(G, _sample_nodes(G.vcount(), pairs_thresh, rng))
+
+    EG = float(inv_d.sum()) / float(inv_l.sum())
+    if ci is None:
+        return EG
+    return EG, _efficiency_ci(inv_d, inv_l, rng, ci, n_boot)
+
+def _local_efficiency_arrays(G):
+    """
+    Arrays the local efficiency kernel works on: symmetric CSR (indptr, indices) for neighborhoods,
+    CSR (indptr, indices) of the edges paths may follow, degree as counted by igraph's neighbors()
+    (self-loops twice), a self-loop flag and lat/lon per node.
+    """
+    C = CompactGraph.from_igraph(G) if isinstance(G, ig.Graph) else _undirected_compact(G)
+    src, dst = C.src, C.dst
+    degree = np.bincount(src, minlength=C.n_nodes) + np.bincount(dst, minlength=C.n_nodes)
+    selfloop = np.zeros(C.n_nodes, dtype=bool)
+    selfloop[src[src == dst]] = True
+    neighbors = C.adjacency()
+    paths = (C.indptr, C.dst) if C.directed else neighbors
+    return neighbors, paths, degree, selfloop, C.y, C.x
+
+def _neighborhood(arrays, i):
+    (indptr, indices), _, _, selfloop, _, _ = arrays
+    nb = indices[indptr[i] : indptr[i + 1]]
+    return np.union1d(nb, [i]) if selfloop[i] else nb
+
+def _neighborhood_efficiencies(arrays, neighborhoods):
+    # Global efficiency of the subgraph induced by each (sorted) node array in neighborhoods.
+    # Neighborhoods of equal size are stacked, and hop distances come from a BFS restricted to
+    # the neighborhood, run as batched boolean matrix products over the local adjacency.
+    _, (indptr, indices), _, _, lat, lon = arrays
+    n = len(lat)
+    edge_codes = np.unique(np.repeat(np.arange(n, dtype=np.int64), np.diff(indptr)) * n + indices)
+
+    out = np.zeros(len(neighborhoods))
+    sizes = np.array([len(nb) for nb in neighborhoods])
+    for k in np.unique(sizes):
+        batch = np.flatnonzero(sizes == k)
+        nb = np.array([neighborhoods[b] for b in batch], dtype=np.int64).reshape(len(batch), k)
+
+        codes = nb[:, :, None] * n + nb[:, None, :]
+        pos = np.minimum(np.searchsorted(edge_codes, codes), len(edge_codes) - 1)
+        A = (edge_codes[pos] == codes).astype(np.int64)
+
+        d = np.full((len(batch), k, k), np.inf)
+        reached = np.broadcast_to(np.eye(k, dtype=bool), d.shape).copy()
+        frontier = reached.copy()
+        d[reached] = 0
+        for step in range(1, k):
+            frontier = (np.matmul(frontier.astype(np.int64), A) > 0) & ~reached
+            if not frontier.any():
+                break
+            d[frontier] = step
+            reached |= frontier
+
+        l = _haversine_matrix(lat[nb], lon[nb])
+        out[batch] = _reciprocal(d).sum(axis=(1, 2)) / _reciprocal(l).sum(axis=(1, 2))
+    return out.tolist()
+
+_local_efficiency_state = None
+
+def _init_local_efficiency_worker(arrays):
+    global _local_efficiency_state
+    _local_efficiency_state = arrays
+
+def _local_efficiency_chunk(neighborhoods):
+    return _neighborhood_efficiencies(_local_efficiency_state, neighborhoods)
+
+def paper_local_efficiency(G, numnodepairs=500, seed=None, n_jobs=1):
+    """
+    Local efficiency of G: mean global efficiency (see `paper_global_efficiency`) of the
+    neighborhoods of a sample of `numnodepairs` nodes.
+
+    Works on CSR arrays of G instead of building an induced igraph per neighborhood. seed
+    fixes the node sample as in `paper_global_efficiency`, n_jobs > 1 spreads the neighborhoods
+    over that many processes.
+    """
+    arrays = _local_efficiency_arrays(G)
+    rng = _rng(seed)
+    nodeindices = _sample_nodes(len(arrays[2]), numnodepairs, rng)
+
+    neighborhoods = []
     for i in nodeindices:
-        if len(G.neighbors(i)) > 1: # If we have a nontrivial neighborhood
-            G_induced = G.induced_subgraph(G.neighbors(i))
-            EGi.append(paper_global_efficiency(G_induced, numnodepairs))
+        if arrays[2][i] > 1: # If we have a nontrivial neighborhood
+            nb = _neighborhood(arrays, i)
+            if len(nb) < 2: # Only a self-loop, no pairs to measure
+                continue
+            if len(nb) > numnodepairs:
+                nb = np.sort(rng.sample(list(nb), numnodepairs))
+            neighborhoods.append(nb)
+
+    if n_jobs > 1 and len(neighborhoods) > 1:
+        from concurrent.futures import ProcessPoolExecutor
+
+        chunks = [neighborhoods[c::n_jobs] for c in range(n_jobs)]  # order does not matter for the mean
+        with ProcessPoolExecutor(n_jobs, initializer=_init_local_efficiency_worker, initargs=(arrays,)) as pool:
+            EGi = [e for chunk in pool.map(_local_efficiency_chunk, chunks) for e in chunk]
+    else:
+        EGi = _neighborhood_efficiencies(arrays, neighborhoods)
     EGi = sum(EGi) / len(EGi)
-    
+
     return EGi
 
-def paper_coverage(G):
-    G = ig.Graph.from_networkx(nx.Graph(G))
-    G_added = copy.deepcopy(G)
-    
+def _segment_coordinates(G):
+    # lon, lat of every vertex and source/target vertex indices of every edge of the undirected simple graph
+    if isinstance(G, ig.Graph):
+        edges = np.array(G.get_edgelist(), dtype=np.int64).reshape(-1, 2)
+        return np.array(G.vs["x"], dtype=float), np.array(G.vs["y"], dtype=float), edges[:, 0], edges[:, 1]
+    C = _undirected_compact(G)
+    return C.x, C.y, C.src, C.dst
+
+def _projected_segments(G):
+    # Edges as (m, 2, 2) coordinate array in a local azimuthal equidistant projection, in meters
+    lon, lat, src, dst = _segment_coordinates(G)
+
     # https://gis.stackexchange.com/questions/121256/creating-a-circle-with-radius-in-metres
-    longitudes = [v["x"] for v in G.vs]
-    loncenter = sum(longitudes) / (len(longitudes) + 0.0001)
-    latitudes = [v["y"] for v in G.vs]
-    latcenter = sum(latitudes) / (len(latitudes) + 0.0001)
+    loncenter = lon.sum() / (len(lon) + 0.0001)
+    latcenter = lat.sum() / (len(lat) + 0.0001)
     local_azimuthal_projection = "+proj=aeqd +R=6371000 +units=m +lat_0={} +lon_0={}".format(latcenter, loncenter)
-    
-    # Use transformer: https://gis.stackexchange.com/questions/127427/transforming-shapely-polygon-and-multipolygon-objects
     wgs84_to_aeqd = pyproj.Transformer.from_proj(
         pyproj.Proj("+proj=longlat +datum=WGS84 +no_defs"),
         pyproj.Proj(local_azimuthal_projection))
-    aeqd_to_wgs84 = pyproj.Transformer.from_proj(
-        pyproj.Proj(local_azimuthal_projection),
-        pyproj.Proj("+proj=longlat +datum=WGS84 +no_defs"))
-    edgetuples = [((e.source_vertex["x"], e.source_vertex["y"]), (e.target_vertex["x"], e.target_vertex["y"])) for e in G_added.es]
-    
-    # # Shapely buffer seems slow for complex objects: https://stackoverflow.com/questions/57753813/speed-up-shapely-buffer
-    # # Therefore we buffer piecewise.
-    cov_added = Polygon()
-    for c, t in enumerate(edgetuples):
-        buf = ops.transform(aeqd_to_wgs84.transform, ops.transform(wgs84_to_aeqd.transform, LineString(t)).buffer(500))
-        cov_added = ops.unary_union([cov_added, Polygon(buf)])
-
-    cov_transformed = ops.transform(wgs84_to_aeqd.transform, cov_added)
-    covered_area = cov_transformed.area / 1000000 # turn from m2 to km2
-
-    return covered_area
\ No newline at end of file
+
+    # One call for all vertices, edges then just index into the projected coordinates
+    x, y = wgs84_to_aeqd.transform(lon, lat)
+    xy = np.column_stack([x, y])
+    return np.stack([xy[src], xy[dst]], axis=1)
+
+def paper_coverage(G, buffer=500, method="exact", cell_size=None):
+    """
+    Area in km2 within `buffer` meters of the edges of G.
+
+    method "exact" unions the buffered edges, "grid" counts the grid cells whose center is
+    within `buffer` of an edge (see `grid_coverage` for its error bounds).
+    """
+    assert method in ["exact", "grid"]
+    if method == "grid":
+        return grid_coverage(G, buffer, cell_size)[0]
+    return _union_coverage(_projected_segments(G), buffer)
+
+def _union_coverage(segments, buffer):
+    if len(segments) == 0:
+        return 0.0
+    # Project once, buffer all edges in one call and let GEOS union them as a tree
+    buffers = shapely.buffer(shapely.linestrings(segments), buffer)
+    covered_area = shapely.union_all(buffers).area / 1000000 # turn from m2 to km2
+
+    return covered_area
+
+def grid_coverage(G, buffer=500, cell_size=None):
+    """
+    Raster approximation of `paper_coverage`: edges are drawn onto a grid of square cells
+    (default size buffer / 10) and a cell counts as covered if a Euclidean distance transform
+    puts its center within `buffer` of a drawn cell.
+
+    Returns (area, lower, upper) in km2. Drawn cell centers are within h, half the cell diagonal,
+    of the edges, and every edge point is within h + cell_size / 4 of a drawn cell center (edges
+    are sampled half a cell apart). Cells whose center is closer than buffer - 2h are therefore
+    fully covered and cells farther than buffer + 2h + cell_size / 4 fully uncovered, and the
+    exact coverage lies between lower and upper.
+    """
+    return _raster_coverage(_projected_segments(G), buffer, cell_size)
+
+def _raster_coverage(segments, buffer, cell_size=None):
+    from scipy import ndimage
+
+    if cell_size is None:
+        cell_size = buffer / 10
+    if len(segments) == 0:
+        return 0.0, 0.0, 0.0
+    half_diagonal = cell_size * np.sqrt(2) / 2
+    reach = buffer + 2 * half_diagonal + cell_size / 4
+    margin = reach + cell_size
+    origin = segments.min(axis=(0, 1)) - margin
+    shape = np.ceil((segments.max(axis=(0, 1)) + margin - origin) / cell_size).astype(int)
+
+    # Sample every edge at most half a cell apart and mark the cells the samples fall in
+    starts, ends = segments[:, 0], segments[:, 1]
+    n_samples = np.ceil(np.linalg.norm(ends - starts, axis=1) / (cell_size / 2)).astype(int) + 1
+    edge = np.repeat(np.arange(len(segments)), n_samples)
+    offsets = np.arange(len(edge)) - np.repeat(np.cumsum(n_samples) - n_samples, n_samples)
+    t = (offsets / np.maximum(n_samples[edge] - 1, 1))[:, None]
+    cells = ((starts[edge] + t * (ends[edge] - starts[edge]) - origin) // cell_size).astype(int)
+    drawn = np.ones(shape, dtype=bool)
+    drawn[cells[:, 0], cells[:, 1]] = False
+
+    distance = ndimage.distance_transform_edt(drawn, sampling=cell_size)
+    cell_area = cell_size ** 2 / 1000000
+    return (
+        np.count_nonzero(distance <= buffer) * cell_area,
+        np.count_nonzero(distance <= buffer - 2 * half_diagonal) * cell_area,
+        np.count_nonzero(distance <= reach) * cell_area,
+    )
+
+@dataclass
+class MetricRecord:
+    """Metrics of one graph, None where not requested. Areas in km2."""
+    density: Optional[float] = None
+    largest_component: Optional[int] = None
+    n_components: Optional[int] = None
+    coverage: Optional[float] = None
+    cohesion: Optional[float] = None
+    global_efficiency: Optional[float] = None
+    global_efficiency_ci: Optional[Tuple[float, float]] = None
+    local_efficiency: Optional[float] = None
+
+    def as_dict(self) -> dict:
+        return asdict(self)
+
+class MetricSuite:
+    """
+    Computes any subset of the network metrics of one graph, converting it once and sharing the
+    connected components, projected edge segments and sampled distance matrices between metrics.
+    Values are the same as from the separate functions called with the same arguments and seed
+    (igraph input is treated as undirected throughout). A random.Random seed is split into one
+    child generator for global and one for local efficiency up front, so neither value depends
+    on which metric ran first.
+
+    suite = MetricSuite(G, seed=0)
+    record = suite.compute(["coverage", "cohesion"])
+    """
+    METRICS = ("density", "largest_component", "n_components", "coverage", "cohesion", "global_efficiency", "local_efficiency")
+
+    def __init__(self, G, buffer=500, coverage_method="exact", cell_size=None, pairs_thresh=500,
+                 numnodepairs=500, seed=None, ci=None, n_boot=1000, n_jobs=1):
+        assert coverage_method in ["exact", "grid"]
+        self.G = G
+        self.buffer = buffer
+        self.coverage_method = coverage_method
+        self.cell_size = cell_size
+        self.pairs_thresh = pairs_thresh
+        self.numnodepairs = numnodepairs
+        self.seed = seed
+        if isinstance(seed, random.Random):
+            self._global_seed, self._local_seed = random.Random(seed.random()), random.Random(seed.random())
+        else:
+            self._global_seed = self._local_seed = seed
+        self.ci = ci
+        self.n_boot = n_boot
+        self.n_jobs = n_jobs
+        self._values = {}
+
+    @cached_property
+    def compact(self) -> CompactGraph:
+        """Graph as converted once: undirected and simple, as nx.Graph(G)."""
+        if isinstance(self.G, ig.Graph):
+            return CompactGraph.from_igraph(self.G).to_undirected()
+        return _undirected_compact(self.G)
+
+    @cached_property
+    def igraph(self) -> ig.Graph:
+        return self.compact.to_igraph()
+
+    @cached_property
+    def component_sizes(self) -> np.ndarray:
+        return np.array(self.igraph.connected_components().sizes())
+
+    @cached_property
+    def segments(self) -> np.ndarray:
+        return _projected_segments(self.compact)
+
+    @cached_property
+    def efficiency_matrices(self):
+        return _efficiency_matrices(self.igraph, _sample_nodes(self.igraph.vcount(), self.pairs_thresh, self._global_rng))
+
+    @cached_property
+    def _global_rng(self):
+        # Global and local efficiency each get their own sampler, as with separate seeded calls
+        return _rng(self._global_seed)
+
+    def density(self) -> float:
+        # nx.density of the input graph, which counts every directed (multi-)edge
+        G = self.G
+        n = G.vcount() if isinstance(G, ig.Graph) else G.number_of_nodes()
+        m = G.ecount() if isinstance(G, ig.Graph) else G.number_of_edges()
+        if n <= 1:
+            return 0
+        return m / (n * (n - 1)) * (1 if G.is_directed() else 2)
+
+    def largest_component(self) -> int:
+        return int(self.component_sizes.max()) if len(self.component_sizes) else 0
+
+    def n_components(self) -> int:
+        return len(self.component_sizes)
+
+    def coverage(self) -> float:
+        if self.coverage_method == "grid":
+            return _raster_coverage(self.segments, self.buffer, self.cell_size)[0]
+        return _union_coverage(self.segments, self.buffer)
+
+    def cohesion(self) -> float:
+        return self._value("coverage") / (self._value("n_components")**2 + 0.00001)
+
+    def global_efficiency(self) -> float:
+        inv_d, inv_l = self.efficiency_matrices
+        return float(inv_d.sum()) / float(inv_l.sum())
+
+    def global_efficiency_ci(self) -> Tuple[float, float]:
+        return _efficiency_ci(*self.efficiency_matrices, self._global_rng, self.ci, self.n_boot)
+
+    def local_efficiency(self) -> float:
+        return paper_local_efficiency(self.compact, self.numnodepairs, _rng(self._local_seed), self.n_jobs)
+
+    def _value(self, metric):
+        if metric not in self._values:
+            self._values[metric] = getattr(self, metric)()
+        return self._values[metric]
+
+    def compute(self, metrics=None) -> MetricRecord:
+        """
+        Parameters
+        -------
+        metrics: list
+            Names from MetricSuite.METRICS, all by default. The global efficiency CI is added
+            with global_efficiency when the suite has a `ci`.
+
+        Returns
+        -------
+        record: MetricRecord
+        """
+        metrics = self.METRICS if metrics is None else metrics
+        unknown = set(metrics) - set(self.METRICS)
+        assert not unknown, f"Unknown metrics {unknown}, choose from {self.METRICS}"
+        values = {metric: self._value(metric) for metric in metrics}
+        if "global_efficiency" in metrics and self.ci is not None:
+            values["global_efficiency_ci"] = self._value("global_efficiency_ci")
+        return MetricRecord(**values)
+
+def compute_metrics(G, metrics=None, **kwargs) -> MetricRecord:
+    """Shorthand for MetricSuite(G, **kwargs).compute(metrics)."""
+    return MetricSuite(G, **kwargs).compute(metrics)
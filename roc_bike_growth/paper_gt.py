@@ -10,25 +10,53 @@ import time
 import pickle as pk
 import roc_bike_growth.graph_utils as gu
 
+def crash_cost(weight, crashes, crash_factor):
+    """Default crash cost: every crash snapped to an edge adds crash_factor times its length."""
+    return weight * (1 + crash_factor * crashes)
+
+
+def _set_mod_weight(G, route_factor=0, crash_factor=0):
+    """Sets the routing cost "mod_weight" on all edges of G in one bulk assignment.
+    Existing infrastructure is discounted by route_factor.
+
+    crash_factor weights the "crashes" edge counts (see loader.add_crash_counts) into the cost,
+    through crash_cost. It can also be a function (weight, crashes) -> cost on numpy arrays."""
+    weight = np.asarray(G.es["weight"], dtype=float)
+    if callable(crash_factor) or crash_factor:
+        if "crashes" not in G.es.attributes():
+            raise ValueError('crash_factor needs "crashes" on the edges, see loader.add_crash_counts.')
+        crashes = np.fromiter((x or 0 for x in G.es["crashes"]), dtype=float, count=G.ecount())
+        if callable(crash_factor):
+            weight = np.asarray(crash_factor(weight, crashes), dtype=float)
+        else:
+            weight = crash_cost(weight, crashes, crash_factor)
+    existing = np.fromiter((x == True for x in G.es["existing"]), dtype=bool, count=G.ecount())
+    G.es["mod_weight"] = list(weight - weight * route_factor * existing)
+
+
 # Algorithm the same as the one in their code with some unnessecary bits  removed.
 # Enumerates all of the connections between points of interest in graph and sums over their weights
-def get_poipairs_by_distance(G, pois_indices, route_factor = 0):
+def get_poipairs_by_distance(G, pois_indices, route_factor = 0, batched = True, crash_factor = 0):
+    """Returns all pairs of pois with their routed distance, sorted by distance,
+    as [((id_a, id_b), distance), ...].
+
+    With batched=True all poi-to-poi distances come from a single multi-source
+    distances() call and are sorted with numpy. Paths are not materialized since
+    only their lengths are needed here; route_node_pairs rebuilds the paths of the
+    pairs that survive triangulation. batched=False keeps the original path-by-path
+    implementation, which gives the same list.
+    """
+    _set_mod_weight(G, route_factor, crash_factor)
+    if batched:
+        return _get_poipairs_by_distance_batched(G, pois_indices)
+
     # Get sequences of nodes and edges in shortest paths between all pairs of pois
     poi_nodes = []
     poi_edges = []
-    
-    if(True):
-        for e in G.es:
-            e["mod_weight"] = e["weight"] - e["weight"] * route_factor * int(
-                e["existing"] == True
-            )
-            
-        
-    
+
     for c, v in enumerate(pois_indices):
-        # Possible cost parameters we could add to weight could be calculated here.
-        # We'd have to implement a "get shortest paths  weighted on accident data etc."
-        # could also include node weights
+        # "mod_weight" already holds the route and crash factors, see _set_mod_weight.
+        # Node weights could be added here.
         poi_nodes.append(G.get_shortest_paths(v, pois_indices[c:], output="vpath", weights = "mod_weight"))
         poi_edges.append(G.get_shortest_paths(v, pois_indices[c:], output="epath", weights = "mod_weight"))
     
@@ -38,8 +66,7 @@ def get_poipairs_by_distance(G, pois_indices, route_factor = 0):
     poi_dist = {}
     for paths_n, paths_e in zip(poi_nodes, poi_edges):
         for path_n, path_e in zip(paths_n, paths_e):
-            # Sum up distances of path segments from first to last node
-            # would have to use distances incorporating parameters if we were to use them here.
+            # Sum up the costs of the path segments from first to last node
             path_dist = sum([G.es[e]["mod_weight"] for e in path_e])
             if path_dist > 0:
                 poi_dist[(path_n[0], path_n[-1])] = path_dist
@@ -53,7 +80,37 @@ def get_poipairs_by_distance(G, pois_indices, route_factor = 0):
     return poipairs
 
 
+def _get_poipairs_by_distance_batched(G, pois_indices):
+    pois_indices = list(pois_indices)
+    if not pois_indices:
+        return []
+    D = np.array(G.distances(source=pois_indices, target=pois_indices, weights="mod_weight"), dtype=float)
+
+    # Same pairs as the path-by-path version: each poi to itself and every later poi,
+    # skipping unreachable and zero-length pairs. Row-major order plus a stable sort
+    # keeps ties in the same order as before.
+    rows, cols = np.triu_indices(len(pois_indices))
+    dists = D[rows, cols]
+    keep = np.isfinite(dists) & (dists > 0)
+    rows, cols, dists = rows[keep], cols[keep], dists[keep]
+    order = np.argsort(dists, kind="stable")
+
+    ids = np.asarray(G.vs[pois_indices]["id"], dtype=object)
+    return [
+        [(a, b), d]
+        for a, b, d in zip(ids[rows[order]].tolist(), ids[cols[order]].tolist(), dists[order].tolist())
+    ]
+
+
 def greedy_triangulation(GT, poipairs, prune_factor=1, route_factor = 0, prune_measure="betweenness"):
+    GT = triangulate(GT, poipairs)
+    return prune_triangulation(GT, prune_factor, prune_measure)
+
+
+def triangulate(GT, poipairs):
+    """Adds poipairs to GT in order, skipping any that would cross an edge already added."""
+    # Spatial index over the GT edges, kept in sync with GT.add_edge below
+    index = SegmentGrid.from_graph(GT)
     for poipair, poipair_distance in poipairs:
         try:
             poipair_ind = (
@@ -65,42 +122,50 @@ def greedy_triangulation(GT, poipairs, prune_factor=1, route_factor = 0, prune_m
             for v in GT.vs:
                 print(v["id"])
 
-        if not new_edge_intersects(
-            GT,
-            (
-                GT.vs[poipair_ind[0]]["x"],
-                GT.vs[poipair_ind[0]]["y"],
-                GT.vs[poipair_ind[1]]["x"],
-                GT.vs[poipair_ind[1]]["y"],
-            ),
-        ):
+        enew = (
+            GT.vs[poipair_ind[0]]["x"],
+            GT.vs[poipair_ind[0]]["y"],
+            GT.vs[poipair_ind[1]]["x"],
+            GT.vs[poipair_ind[1]]["y"],
+        )
+        if not new_edge_intersects(GT, enew, index=index):
             GT.add_edge(poipair_ind[0], poipair_ind[1], weight=poipair_distance)
+            index.add(*enew)
+    return GT
+
+
+def pruning_measure(GT, prune_measure="betweenness"):
+    """Returns the values prune_triangulation cuts on: edge betweenness for "betweenness"
+    and "hybrid", vertex closeness for "closeness", None otherwise."""
+    if prune_measure == "betweenness" or prune_measure == "hybrid":
+        return GT.edge_betweenness(directed = True, weights = "weight")
+    elif prune_measure == "closeness":
+        return GT.closeness(vertices = None, weights = "weight")
+    return None
+
 
+def prune_triangulation(GT, prune_factor=1, prune_measure="betweenness", measure=None):
+    """Keeps the top prune_factor quantile of GT by prune_measure. measure can be passed
+    in (see pruning_measure) to reuse it across prune factors."""
     # Get the measure for pruning
-    
-    # print(prune_measure)
+    if measure is None:
+        measure = pruning_measure(GT, prune_measure)
     
     prune_quantile = prune_factor
     
     if prune_measure == "betweenness" or prune_measure == "hybrid":
-        BW = GT.edge_betweenness(directed = True, weights = "weight")
+        BW = measure
         qt = np.quantile(BW, 1-prune_quantile)
-        sub_edges = []
-        for c, e in enumerate(GT.es):
-            if BW[c] >= qt: 
-                sub_edges.append(c)
-            GT.es[c]["bw"] = BW[c]
-            GT.es[c]["width"] = math.sqrt(BW[c]+1)*0.5
+        sub_edges = np.flatnonzero(np.asarray(BW) >= qt).tolist()
+        GT.es["bw"] = list(BW)
+        GT.es["width"] = [math.sqrt(bw+1)*0.5 for bw in BW]
         # Prune
         GT = GT.subgraph_edges(sub_edges)
     elif prune_measure == "closeness":
-        CC = GT.closeness(vertices = None, weights = "weight")
+        CC = measure
         qt = np.quantile(CC, 1-prune_quantile)
-        sub_nodes = []
-        for c, v in enumerate(GT.vs):
-            if CC[c] >= qt: 
-                sub_nodes.append(c)
-            GT.vs[c]["cc"] = CC[c]
+        sub_nodes = np.flatnonzero(np.asarray(CC) >= qt).tolist()
+        GT.vs["cc"] = list(CC)
         GT = GT.induced_subgraph(sub_nodes) 
         
     # elif prune_measure == "iter_betweenness":
@@ -111,12 +176,9 @@ def greedy_triangulation(GT, poipairs, prune_factor=1, route_factor = 0, prune_m
 
 # Get node pairs we need to route, sorted by distance
 # allows us to only includ relevant pairs in
-def route_node_pairs(G, GT, route_factor):
+def route_node_pairs(G, GT, route_factor, crash_factor=0):
     
-    for e in G.es:
-        e["mod_weight"] = e["weight"] - e["weight"] * route_factor * int(
-            e["existing"] == True
-        )
+    _set_mod_weight(G, route_factor, crash_factor)
     
     routenodepairs = {}
     for e in GT.es:
@@ -124,15 +186,16 @@ def route_node_pairs(G, GT, route_factor):
     routenodepairs = sorted(routenodepairs.items(), key=lambda x: x[1])
 
     # Do the routing
-    GT_indices = set()
+    GT_indices = _route_pairs(G, [poipair for poipair, _ in routenodepairs])
 
+    GT_final = G.induced_subgraph(GT_indices)
+    return GT_final
 
-    for e in G.es:
-        e["mod_weight"] = e["weight"] - e["weight"] * route_factor * int(
-            e["existing"] == True
-        )
 
-    for poipair, poipair_distance in routenodepairs:
+def _route_pairs(G, poipairs):
+    """Set of vertex indices on the "mod_weight" shortest paths between poipairs (by id)."""
+    GT_indices = set()
+    for poipair in poipairs:
         poipair_ind = (G.vs.find(id=poipair[0]).index, G.vs.find(id=poipair[1]).index)
         sp = set(
             G.get_shortest_paths(
@@ -141,9 +204,7 @@ def route_node_pairs(G, GT, route_factor):
             )[0]
         )
         GT_indices = GT_indices.union(sp)
-
-    GT_final = G.induced_subgraph(GT_indices)
-    return GT_final
+    return GT_indices
 
 
 # the below classes are ripped from the code. its an intersection function which could probably be optimized better but it definitely works :)
@@ -153,10 +214,92 @@ class MyPoint:
         self.y = y
 
 
-def new_edge_intersects(G, enew):
+class SegmentGrid:
+    """Uniform grid index over the bounding boxes of line segments.
+
+    Each segment is registered in every cell its bounding box covers. A query walks
+    only the cells the candidate segment passes through (the cell holding any
+    intersection point is one of them) and runs the exact test against segments
+    whose boxes overlap the candidate's.
+    """
+
+    def __init__(self, cell_size):
+        self.cell_size = cell_size
+        self.cells = {}
+        self.segments = []
+
+    @classmethod
+    def from_graph(cls, G, cell_size=None):
+        """Builds an index over the edges of G, sized from the extent of its vertices."""
+        if cell_size is None:
+            xs, ys = G.vs["x"], G.vs["y"]
+            extent = max(max(xs) - min(xs), max(ys) - min(ys)) if G.vcount() else 0
+            cell_size = extent / max(math.sqrt(G.vcount()), 1) or 1.0
+        index = cls(cell_size)
+        for e in G.es():
+            index.add(
+                e.source_vertex["x"], e.source_vertex["y"], e.target_vertex["x"], e.target_vertex["y"]
+            )
+        return index
+
+    def _cell(self, v):
+        return int(math.floor(v / self.cell_size))
+
+    def add(self, x1, y1, x2, y2):
+        seg_id = len(self.segments)
+        self.segments.append(
+            (MyPoint(x1, y1), MyPoint(x2, y2), min(x1, x2), min(y1, y2), max(x1, x2), max(y1, y2))
+        )
+        for ix in range(self._cell(min(x1, x2)), self._cell(max(x1, x2)) + 1):
+            for iy in range(self._cell(min(y1, y2)), self._cell(max(y1, y2)) + 1):
+                self.cells.setdefault((ix, iy), []).append(seg_id)
+
+    def _cells_along(self, x1, y1, x2, y2):
+        """Yields the cells a segment passes through, column by column."""
+        if x1 > x2:
+            x1, y1, x2, y2 = x2, y2, x1, y1
+        slope = (y2 - y1) / (x2 - x1) if x2 != x1 else 0.0
+        slack = self.cell_size * 1e-9  # guard against rounding at cell borders
+        for ix in range(self._cell(x1), self._cell(x2) + 1):
+            xa = max(x1, ix * self.cell_size - slack)
+            xb = min(x2, (ix + 1) * self.cell_size + slack)
+            if x2 == x1:
+                ya, yb = y1, y2
+            else:
+                ya, yb = y1 + (xa - x1) * slope, y1 + (xb - x1) * slope
+            for iy in range(self._cell(min(ya, yb) - slack), self._cell(max(ya, yb) + slack) + 1):
+                yield ix, iy
+
+    def intersects(self, x1, y1, x2, y2):
+        """Checks if the segment (x1, y1)-(x2, y2) properly intersects any indexed segment."""
+        E1 = MyPoint(x1, y1)
+        E2 = MyPoint(x2, y2)
+        minx, miny, maxx, maxy = min(x1, x2), min(y1, y2), max(x1, x2), max(y1, y2)
+        seen = set()
+        for cell in self._cells_along(x1, y1, x2, y2):
+            for seg_id in self.cells.get(cell, ()):
+                if seg_id in seen:
+                    continue
+                seen.add(seg_id)
+                O1, O2, ominx, ominy, omaxx, omaxy = self.segments[seg_id]
+                if ominx > maxx or omaxx < minx or ominy > maxy or omaxy < miny:
+                    continue
+                if segments_intersect(E1, E2, O1, O2):
+                    return True
+        return False
+
+
+def new_edge_intersects(G, enew, index=None, vectorized=True):
     """Given a graph G and a potential new edge enew,
     check if enew will intersect any old edge.
+    If a SegmentGrid over the edges of G is passed as index, only nearby edges are tested.
+    Otherwise all edges are tested at once with segments_intersect_array, or one
+    by one with segments_intersect if vectorized=False.
     """
+    if index is not None:
+        return index.intersects(*enew)
+    if vectorized:
+        return bool(segments_intersect_array(enew, edge_segments(G)).any())
     E1 = MyPoint(enew[0], enew[1])
     E2 = MyPoint(enew[2], enew[3])
     for e in G.es():
@@ -167,6 +310,64 @@ def new_edge_intersects(G, enew):
     return False
 
 
+def edge_segments(G):
+    """Returns the edges of G as an (E, 4) array of source x, source y, target x, target y."""
+    xy = np.column_stack([G.vs["x"], G.vs["y"]]).astype(np.float64) if G.vcount() else np.empty((0, 2))
+    edges = np.asarray(G.get_edgelist(), dtype=np.int64).reshape(-1, 2)
+    return np.hstack([xy[edges[:, 0]], xy[edges[:, 1]]])
+
+
+def _ccw_array(ax, ay, bx, by, cx, cy):
+    # Same expression as ccw, evaluated elementwise
+    return (cy - ay) * (bx - ax) > (by - ay) * (cx - ax)
+
+
+def _segments_intersect_arrays(a, c):
+    """a and c are broadcastable arrays with x1, y1, x2, y2 in the last axis."""
+    ax, ay, bx, by = a[..., 0], a[..., 1], a[..., 2], a[..., 3]
+    cx, cy, dx, dy = c[..., 0], c[..., 1], c[..., 2], c[..., 3]
+    shared = (
+        ((ax == cx) & (ay == cy))
+        | ((ax == dx) & (ay == dy))
+        | ((bx == cx) & (by == cy))
+        | ((bx == dx) & (by == dy))
+    )
+    return (
+        ~shared
+        & (_ccw_array(ax, ay, cx, cy, dx, dy) != _ccw_array(bx, by, cx, cy, dx, dy))
+        & (_ccw_array(ax, ay, bx, by, cx, cy) != _ccw_array(ax, ay, bx, by, dx, dy))
+    )
+
+
+def segments_intersect_array(seg, segs):
+    """Vectorized segments_intersect of one segment against many.
+
+    Parameters
+    -------
+    seg: sequence of 4 floats
+        Segment as (x1, y1, x2, y2).
+    segs: np.ndarray
+        (N, 4) array of segments in the same layout.
+
+    Returns
+    -------
+    np.ndarray
+        (N,) bool array, True where seg properly intersects segs[i]. Shared endpoints
+        and colinear segments do not count, as in segments_intersect.
+    """
+    seg = np.asarray(seg, dtype=np.float64)
+    segs = np.asarray(segs, dtype=np.float64).reshape(-1, 4)
+    return _segments_intersect_arrays(seg[None, :], segs)
+
+
+def segments_intersect_matrix(segs_a, segs_b):
+    """Vectorized segments_intersect of every segment in segs_a against every segment
+    in segs_b. Both are (M, 4) and (N, 4) arrays; returns an (M, N) bool array."""
+    segs_a = np.asarray(segs_a, dtype=np.float64).reshape(-1, 4)
+    segs_b = np.asarray(segs_b, dtype=np.float64).reshape(-1, 4)
+    return _segments_intersect_arrays(segs_a[:, None, :], segs_b[None, :, :])
+
+
 def segments_intersect(A, B, C, D):
     """Check if two line segments intersect (except for colinearity)
     Returns true if line segments AB and CD intersect properly.
@@ -199,49 +400,122 @@ def set_all_edge_attributes(G_src, G_dst, atr_name):
 
 
 # def greedy_triangulation_subgraph(G, pois_indices = [], pois_method = pass):
-def gt_from_scratch(G, pois_indices, route_factor=0, prune_factor=1, prune_measure = "betweenness"):
-    G_temp = copy.deepcopy(G)
-    for e in G_temp.es:  # delete all edges
-        G_temp.es.delete(e)
-    GT = copy.deepcopy(G_temp.subgraph(set(pois_indices)))
-    poipairs = get_poipairs_by_distance(G, pois_indices, route_factor = route_factor)
-    # print(poipairs)
-    GT = greedy_triangulation(GT, poipairs, prune_factor, prune_measure = prune_measure, route_factor = route_factor)
-    GT_final = route_node_pairs(G, GT, route_factor)
+def gt_from_scratch(G, pois_indices, route_factor=0, prune_factor=1, prune_measure = "betweenness", crash_factor=0):
+    GT = triangulate_pois(G, pois_indices, route_factor, crash_factor)
+    GT = prune_triangulation(GT, prune_factor, prune_measure)
+    GT_final = route_node_pairs(G, GT, route_factor, crash_factor)
     return GT_final
 
 
-def gt_with_existing_full(G_base, G_existing, route_factor=0, prune_factor=1, prune_measure = "betweenness", by_factor ="mod", distance_limit = 99999999999):
+def triangulate_pois(G, pois_indices, route_factor=0, crash_factor=0):
+    """Greedy triangulation (before pruning) of the pois in G, weighted by routed distance."""
+    # the pois of G with no edges
+    GT = G.induced_subgraph(sorted(set(pois_indices)))
+    GT.delete_edges(range(GT.ecount()))
+    poipairs = get_poipairs_by_distance(G, pois_indices, route_factor = route_factor, crash_factor = crash_factor)
+    # print(poipairs)
+    return triangulate(GT, poipairs)
+
 
-    G_comb_nx = gu.combine_nodes(G_base, G_existing)
-    G_comb_nx = gu.combine_edges(G_comb_nx, G_existing)
+def combined_igraph(G_base, G_existing):
+    """Merges G_existing into G_base (in place) and converts it to igraph with "id" and "weight" set.
+    This is the graph gt_with_existing_combined works on; build it once to run many parameter
+    combinations on the same networks."""
+    G_comb_nx = G_base
+    gu.merge_graphs(G_comb_nx, G_existing)
 
     G_comb_nx = set_all_edge_attributes(G_existing, G_comb_nx, "existing")
 
     G_comb = ig.Graph.from_networkx(G_comb_nx)
 
-    for i, v in enumerate(G_comb.vs):
-        v["id"] = i
-    for e in G_comb.es:
-        e["weight"] = e["length"]
-    pois_ids = [v_index for v_index, vertex in enumerate(G_comb.vs) if vertex["poi"]]
-    G_gen = gt_from_scratch(G_comb, pois_ids, route_factor, prune_factor,prune_measure = prune_measure)
-    if((prune_measure == 'iter_betweenness') or (prune_measure == 'hybrid')):
-        G_gen = iterative_pruning(G_gen,G_existing, prune_factor, by_factor)
+    G_comb.vs["id"] = list(range(G_comb.vcount()))
+    G_comb.es["weight"] = G_comb.es["length"]
+    return G_comb
+
 
+def _generated_to_nx(G_gen, G_existing, prune_measure):
+    """Converts a generated network back to networkx and merges the existing network into it."""
     G_nx = gu.ig_to_nx(G_gen)
-    G_nx = gu.combine_nodes(G_nx, G_existing)
-    G_nx = gu.combine_edges(G_nx, G_existing)
+    generated = list(G_nx.edges)
+    gu.merge_graphs(G_nx, G_existing)
 
     G_nx = set_all_edge_attributes(G_existing, G_nx, "existing")
-    G_nx = set_all_edge_attributes(gu.ig_to_nx(G_gen), G_nx, "generated")
+    nx.set_edge_attributes(G_nx, dict.fromkeys(generated, True), "generated")
     
     if(prune_measure == 'iter_betweenness'):
         G_nx.remove_nodes_from(list(nx.isolates(G_nx)))
         
     return G_nx
+
+
+def gt_with_existing_full(G_base, G_existing, route_factor=0, prune_factor=1, prune_measure = "betweenness", by_factor ="mod", distance_limit = 99999999999, bw_mode = "exact", bw_epsilon = 0.05, bw_delta = 0.1, seed = None, crash_factor = 0):
+
+    G_comb = combined_igraph(G_base, G_existing)
+    return gt_with_existing_combined(G_comb, G_existing, None, route_factor, prune_factor, prune_measure, by_factor, bw_mode, bw_epsilon, bw_delta, seed, crash_factor)
+
+
+def gt_with_existing_combined(G_comb, G_existing, pois_ids = None, route_factor=0, prune_factor=1, prune_measure = "betweenness", by_factor ="mod", bw_mode = "exact", bw_epsilon = 0.05, bw_delta = 0.1, seed = None, crash_factor = 0):
+    """gt_with_existing_full on a graph from combined_igraph. Only the "mod_weight"
+    edge attribute of G_comb is overwritten, so G_comb can be reused across calls.
+
+    pois_ids restricts the triangulation to these vertex indices of G_comb instead of
+    all vertices with "poi" set."""
+    if pois_ids is None:
+        pois_ids = [v_index for v_index, vertex in enumerate(G_comb.vs) if vertex["poi"]]
+    G_gen = gt_from_scratch(G_comb, pois_ids, route_factor, prune_factor,prune_measure = prune_measure, crash_factor = crash_factor)
+    if((prune_measure == 'iter_betweenness') or (prune_measure == 'hybrid')):
+        G_gen = iterative_pruning(G_gen,G_existing, prune_factor, by_factor, bw_mode = bw_mode, bw_epsilon = bw_epsilon, bw_delta = bw_delta, seed = seed)
+
+    return _generated_to_nx(G_gen, G_existing, prune_measure)
+
+
+def gt_with_existing_sweep(G_base, G_existing, prune_factors, route_factor=0, prune_measure = "betweenness", by_factor ="mod", bw_mode = "exact", bw_epsilon = 0.05, bw_delta = 0.1, seed = None, crash_factor = 0):
+    """Generates the network of gt_with_existing_full for every value in prune_factors
+    in a single pass.
+
+    The graph merge, poi routing, triangulation and pruning measure are computed once.
+    Going through prune_factors in increasing order only adds triangulation edges, so
+    each step routes just the pairs the previous step did not. iter_betweenness and
+    hybrid still run iterative_pruning per prune factor on the routed network.
+
+    Yields
+    -------
+    (prune_factor, G_nx): (float, nx.MultiDiGraph)
+        In increasing prune_factor order. G_nx is the same network gt_with_existing_full
+        returns for that prune_factor.
+    """
+    G_comb = combined_igraph(G_base, G_existing)
+    pois_ids = [v_index for v_index, vertex in enumerate(G_comb.vs) if vertex["poi"]]
+    GT = triangulate_pois(G_comb, pois_ids, route_factor, crash_factor)
+    measure = pruning_measure(GT, prune_measure)
+
+    _set_mod_weight(G_comb, route_factor, crash_factor)
+    routed_pairs = set()
+    GT_indices = set()
+    for prune_factor in sorted(prune_factors):
+        GT_pruned = prune_triangulation(GT, prune_factor, prune_measure, measure)
+        new_pairs = {(e.source_vertex["id"], e.target_vertex["id"]) for e in GT_pruned.es} - routed_pairs
+        GT_indices |= _route_pairs(G_comb, new_pairs)
+        routed_pairs |= new_pairs
+
+        G_gen = G_comb.induced_subgraph(GT_indices)
+        if((prune_measure == 'iter_betweenness') or (prune_measure == 'hybrid')):
+            G_gen = iterative_pruning(G_gen,G_existing, prune_factor, by_factor, bw_mode = bw_mode, bw_epsilon = bw_epsilon, bw_delta = bw_delta, seed = seed)
+
+        yield prune_factor, _generated_to_nx(G_gen, G_existing, prune_measure)
             
-def iterative_pruning(GT, existing, prune_factor, by_factor):
+def iterative_pruning(GT, existing, prune_factor, by_factor, bw_mode="exact", bw_epsilon=0.05, bw_delta=0.1, seed=None, removal_log=None):
+    """Repeatedly deletes the edges with the lowest betweenness until only
+    prune_factor of the generated edges (plus the existing ones) are left.
+
+    bw_mode picks how betweenness is kept up to date between rounds:
+    "exact" recomputes it over the whole graph every round, "incremental" only
+    recomputes the contributions of sources whose shortest paths used a deleted
+    edge (same values, up to float rounding), and "sampled" estimates it from a
+    fixed sample of sources sized by bw_epsilon and bw_delta (see
+    PruningBetweenness). If removal_log is a list, the edges deleted in each
+    round are appended to it.
+    """
     
     if(by_factor == "mod"):
         #modified by factor speeding up algorithm
@@ -255,6 +529,9 @@ def iterative_pruning(GT, existing, prune_factor, by_factor):
     rm_edges = edges - new_edges
     factor = 0.5
     bf_index = 0
+
+    bw = PruningBetweenness(GT, mode=bw_mode, epsilon=bw_epsilon, delta=bw_delta, seed=seed)
+    is_existing = np.fromiter((x == True for x in GT.es["existing"]), dtype=bool, count=GT.ecount())
     
     while(len(GT.es) > new_edges):
         
@@ -264,27 +541,125 @@ def iterative_pruning(GT, existing, prune_factor, by_factor):
             bf_index+=1
         # print('factor: ' + str(by_factors[bf_index]))
         
-        BW = GT.edge_betweenness(directed = True, weights = "mod_weight")
-        
-        for index,edge in enumerate(GT.es):
-            
-            if(edge['existing'] == True):
-                
-                BW[index] = 9999999999
+        BW = bw.values()
+        BW[is_existing] = 9999999999
            
         bf_temp  = by_factors[bf_index]        
-        min_values = sorted(list(set(BW)))[0:bf_temp]
-        edges = []
-        
-        for min_value in min_values:
-            
-            pos = list(np.where(np.array(BW) == min_value)[0])
-            edges = [GT.es[i] for i in pos] + edges
-        
-        # print(len(edges))
+        min_values = np.unique(BW)[0:bf_temp]
+        edges = np.flatnonzero(np.isin(BW, min_values))
+
+        if removal_log is not None:
+            removal_log.append(_edge_keys(GT, edges))
             
-        GT.delete_edges(edges)
+        bw.delete_edges(edges)
+        is_existing = np.delete(is_existing, edges)
         
     # print(len(GT.es))
     
     return GT
+
+
+def _edge_keys(GT, edges):
+    """Sorted (source id, target id, multiedge key) tuples identifying edges across graph copies."""
+    ids = GT.vs["id"] if "id" in GT.vs.attributes() else list(GT.vs.indices)
+    keys = GT.es["_nx_multiedge_key"] if "_nx_multiedge_key" in GT.es.attributes() else [None] * GT.ecount()
+    return sorted(
+        ((ids[GT.es[e].source], ids[GT.es[e].target], keys[e]) for e in edges),
+        key=repr,
+    )
+
+
+class PruningBetweenness:
+    """Keeps directed edge betweenness (weights "mod_weight") of GT current while
+    iterative_pruning deletes edges from it.
+
+    Betweenness is a sum of per-source contributions. Deleting edges can only
+    lengthen paths, so a source's shortest paths (and its contribution) are
+    unchanged unless one of them used a deleted edge, which is the case exactly
+    when the source contributes to that edge's betweenness. The "incremental" and
+    "sampled" modes split the sources into blocks of block_size nearby vertices,
+    keep a blocks x edges matrix of contributions, and after each deletion only
+    recompute the blocks that contributed to a deleted edge (one igraph call per
+    block, since per-source calls carry a large fixed overhead).
+
+    Modes
+    -------
+    "exact": full recomputation on every call to values(), as iterative_pruning always did.
+    "incremental": exact values, updated only for affected blocks of sources.
+    "sampled": contributions of k sources sampled without replacement, scaled by n / k.
+        k = ceil(ln(2 m / delta) / (2 epsilon^2)) (Hoeffding plus a union bound over the m
+        edges), so with probability at least 1 - delta every edge's betweenness,
+        normalized by n (n - 1), is within epsilon of the exact value. Falls back to all
+        sources if k >= n. Updates are incremental over the sample.
+    """
+
+    def __init__(self, GT, mode="exact", epsilon=0.05, delta=0.1, seed=None, block_size=32):
+        if mode not in ["exact", "incremental", "sampled"]:
+            raise ValueError(f"Unknown betweenness mode {mode}.")
+        self.GT = GT
+        self.mode = mode
+        n = GT.vcount()
+        sources = list(GT.vs.indices)
+        if mode == "sampled":
+            k = math.ceil(math.log(2 * max(GT.ecount(), 1) / delta) / (2 * epsilon ** 2))
+            if k < n:
+                sources = random.Random(seed).sample(sources, k)
+        self.scale = n / len(sources) if sources else 1.0
+        if mode != "exact":
+            # Nearby sources tend to share shortest paths, so block them by position
+            if "x" in GT.vs.attributes() and "y" in GT.vs.attributes():
+                sources = sorted(sources, key=lambda v: (GT.vs[v]["x"], GT.vs[v]["y"]))
+            self.blocks = [sources[i : i + block_size] for i in range(0, len(sources), block_size)]
+            self.contrib = np.zeros((len(self.blocks), GT.ecount()))
+            self._update_blocks(range(len(self.blocks)))
+
+    def _update_blocks(self, blocks):
+        for b in blocks:
+            self.contrib[b] = self.GT.edge_betweenness(
+                directed=True, weights="mod_weight", sources=self.blocks[b]
+            )
+
+    def values(self):
+        """Current edge betweenness as a fresh float array, one value per edge of GT."""
+        if self.mode == "exact":
+            return np.array(self.GT.edge_betweenness(directed=True, weights="mod_weight"), dtype=float)
+        # Summing per-block rows does not match igraph's float order; round so tied edges stay tied.
+        return np.round(self.contrib.sum(axis=0) * self.scale, 6)
+
+    def delete_edges(self, edges):
+        """Deletes edges (indices into GT.es) from GT and updates the betweenness."""
+        edges = np.asarray(edges, dtype=int)
+        self.GT.delete_edges(edges.tolist())
+        if self.mode == "exact":
+            return
+        affected = np.flatnonzero((self.contrib[:, edges] > 0).any(axis=1))
+        self.contrib = np.delete(self.contrib, edges, axis=1)
+        self._update_blocks(affected)
+
+
+def pruning_order_agreement(GT, existing, prune_factor, by_factor, bw_mode, **kwargs):
+    """Runs iterative_pruning on copies of GT with exact betweenness and with bw_mode,
+    and reports how often the approximate run deleted the same edges as the exact one.
+
+    Returns
+    -------
+    dict
+        rounds: number of rounds in the exact run
+        matching_rounds: rounds (by position) that deleted exactly the same edges
+        match_rate: matching_rounds / rounds
+        final_jaccard: Jaccard similarity of the edge sets left at the end
+    """
+    log_exact, log_mode = [], []
+    G_exact = iterative_pruning(GT.copy(), existing, prune_factor, by_factor, removal_log=log_exact)
+    G_mode = iterative_pruning(GT.copy(), existing, prune_factor, by_factor, bw_mode=bw_mode, removal_log=log_mode, **kwargs)
+
+    matching = sum(a == b for a, b in zip(log_exact, log_mode))
+    left_exact = set(_edge_keys(G_exact, range(G_exact.ecount())))
+    left_mode = set(_edge_keys(G_mode, range(G_mode.ecount())))
+    union = left_exact | left_mode
+    return {
+        "rounds": len(log_exact),
+        "matching_rounds": matching,
+        "match_rate": matching / len(log_exact) if log_exact else 1.0,
+        "final_jaccard": len(left_exact & left_mode) / len(union) if union else 1.0,
+    }
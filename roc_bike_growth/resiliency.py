@@ -1,75 +1,162 @@
-from collections import deque
+import random
+import numpy as np
+import networkx as nx
+import igraph as ig
+
+from typing import Iterable, Iterator, List, Union
+
+
+def _as_arrays(graph) -> tuple:
+    """
+    Node ids and undirected (u, v) index arrays of a neighbour mapping, networkx graph or
+    igraph Graph (whose node ids are vertex indices).
+    """
+    if isinstance(graph, ig.Graph):
+        nodes = list(range(graph.vcount()))
+        edges = np.array(graph.get_edgelist(), dtype=np.int64).reshape(-1, 2)
+        return nodes, edges[:, 0], edges[:, 1]
+    if isinstance(graph, nx.Graph):
+        nodes = list(graph.nodes)
+        pairs = graph.edges()
+    else:
+        nodes = list(graph)
+        pairs = ((u, v) for u, neighbours in graph.items() for v in neighbours)
+    index = {n: i for i, n in enumerate(nodes)}
+    edges = np.array([(index[u], index[v]) for u, v in pairs], dtype=np.int64).reshape(-1, 2)
+    return nodes, edges[:, 0], edges[:, 1]
+
+
+def _adjacency(n: int, src: np.ndarray, dst: np.ndarray) -> tuple:
+    """Symmetric CSR (indptr, indices) without self-loops or repeated neighbours."""
+    keep = src != dst
+    pairs = np.unique(np.concatenate([src[keep] * n + dst[keep], dst[keep] * n + src[keep]]))
+    return np.searchsorted(pairs // max(n, 1), np.arange(n + 1)), pairs % max(n, 1)
+
+
+def largest_component_curve(graph, attack_order: Iterable) -> np.ndarray:
+    """
+    Size of the largest connected component after removing each prefix of attack_order: entry k
+    is the size after the first k nodes are gone.
+
+    Runs the attack backwards: starting from the nodes that are never removed, nodes are added
+    back in reverse order and merged with their present neighbours in a union-find structure,
+    which takes near-linear time for the whole curve. Directed graphs are treated as undirected.
+
+    Parameters
+    -------
+    graph: dict | nx.Graph | ig.Graph
+        Mapping from nodes to an iterable of their neighbours, networkx graph or igraph Graph.
+    attack_order: iterable
+        Distinct nodes to remove, in order (vertex indices for igraph).
+
+    Returns
+    -------
+    curve: np.ndarray
+        len(attack_order) + 1 component sizes.
+    """
+    nodes, src, dst = _as_arrays(graph)
+    n = len(nodes)
+    index = {v: i for i, v in enumerate(nodes)}
+    order = [index[v] for v in attack_order]
+    if len(set(order)) != len(order):
+        raise ValueError("attack_order contains a node more than once.")
+    indptr, indices = _adjacency(n, src, dst)
+    indptr, indices = indptr.tolist(), indices.tolist()
+
+    parent = list(range(n))
+    size = [1] * n
+    present = [True] * n
+    for i in order:
+        present[i] = False
+
+    def find(i):
+        while parent[i] != i:
+            parent[i] = parent[parent[i]]  # path halving
+            i = parent[i]
+        return i
+
+    largest = 0
+
+    def add(i):
+        nonlocal largest
+        root = find(i)
+        for j in indices[indptr[i] : indptr[i + 1]]:
+            if not present[j]:
+                continue
+            other = find(j)
+            if other != root:
+                if size[root] < size[other]:
+                    root, other = other, root
+                parent[other] = root  # union by size
+                size[root] += size[other]
+        largest = max(largest, size[root])
+
+    survivors = [i for i in range(n) if present[i]]
+    for i in survivors:
+        present[i] = False
+    for i in survivors:
+        present[i] = True
+        add(i)
+
+    curve = [largest]
+    for i in reversed(order):
+        present[i] = True
+        add(i)
+        curve.append(largest)
+    return np.array(curve[::-1])
+
 
 # Resiliency metric
-# Taken from https://codereview.stackexchange.com/questions/184392/computing-resilience-of-the-network-presented-as-an-undirected-graph-in-python
-def resilience(graph, attack_order):
+# Interface taken from https://codereview.stackexchange.com/questions/184392/computing-resilience-of-the-network-presented-as-an-undirected-graph-in-python
+def resilience(graph, attack_order: Iterable) -> Iterator[int]:
     """Given an undirected graph represented as a mapping from nodes to
-    an iterable of their neighbours, and an iterable of nodes, generate
-    integers such that the the k-th result is the size of the largest
-    connected component after the removal of the first k-1 nodes.
+    an iterable of their neighbours (or a networkx / igraph graph), and an
+    iterable of nodes, generate integers such that the the k-th result is the
+    size of the largest connected component after the removal of the first
+    k-1 nodes.
 
+    See `largest_component_curve`, which computes the whole curve up front.
     """
-    # Take a copy of the graph so that we can destructively modify it.
-    graph = {node: set(neighbours) for node, neighbours in graph.items()}
-
-    canonical, components = connected_components(graph, set(graph))
-    largest = lambda: max(map(len, components.values()), default=0)
-    yield largest()
-    for node in attack_order:
-        # Find connected component containing node.
-        component = components.pop(canonical.pop(node))
-
-        # Remove node from graph.
-        for neighbor in graph[node]:
-            graph[neighbor].remove(node)
-        graph.pop(node)
-        component.remove(node)
-
-        # Component may have been split by removal of node, so search
-        # it for new connected components and update data structures
-        # accordingly.
-        canon, comp = connected_components(graph, component)
-        canonical.update(canon)
-        components.update(comp)
-        yield largest()
-        
-    def connected_components(graph, nodes):
-        """Given an undirected graph represented as a mapping from nodes to
-        the set of their neighbours, and a set of nodes, find the
-        connected components in the graph containing those nodes.
-
-        Returns:
-        - mapping from nodes to the canonical node of the connected
-        component they belong to
-        - mapping from canonical nodes to connected components
-
-        """
-        canonical = {}
-        components = {}
-        while nodes:
-            node = nodes.pop()
-            component = bfs_visited(graph, node)
-            components[node] = component
-            nodes.difference_update(component)
-            for n in component:
-                canonical[n] = node
-        return canonical, components
-
-    def bfs_visited(graph, node):
-        """undirected graph {Vertex: {neighbors}}
-        Returns the set of all nodes visited by the algrorithm"""
-        queue = deque()
-        queue.append(node)
-        visited = set([node])
-        while queue:
-            current_node = queue.popleft()
-            for neighbor in graph[current_node]:
-                if neighbor not in visited:
-                    visited.add(neighbor)
-                    queue.append(neighbor)
-        return visited
-    
-    
+    yield from largest_component_curve(graph, list(attack_order)).tolist()
+
+
+def attack_order(graph, strategy: str = "degree", seed: Union[int, random.Random] = None) -> List:
+    """
+    Order in which to remove the nodes of graph.
+
+    Parameters
+    -------
+    graph: dict | nx.Graph | ig.Graph
+        As in `largest_component_curve`.
+    strategy: string
+        "random", "degree" (highest number of neighbours first) or "betweenness" (highest
+        betweenness centrality first, on the undirected simple graph). Ties keep node order.
+    seed: int | random.Random
+        Seed for "random".
+
+    Returns
+    -------
+    order: list
+        All nodes of graph.
+    """
+    assert strategy in ["random", "degree", "betweenness"]
+    nodes, src, dst = _as_arrays(graph)
+    n = len(nodes)
+    if strategy == "random":
+        order = list(nodes)
+        (seed if isinstance(seed, random.Random) else random.Random(seed)).shuffle(order)
+        return order
+
+    indptr, indices = _adjacency(n, src, dst)
+    if strategy == "degree":
+        score = np.diff(indptr)
+    else:
+        a = np.repeat(np.arange(n), np.diff(indptr))
+        G = ig.Graph(n=n, edges=np.column_stack([a, indices])[a < indices].tolist())
+        score = np.array(G.betweenness(directed=False))
+    return [nodes[i] for i in np.argsort(-score, kind="stable")]
+
+
 if __name__ == '__main__':
     print('hello world')
     import osmnx as ox
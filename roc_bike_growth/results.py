@@ -0,0 +1,235 @@
+import json
+import os
+import numpy as np
+import pandas as pd
+import networkx as nx
+import pyarrow as pa
+
+from roc_bike_growth.compact import CompactGraph, EXISTING, GENERATED
+
+from typing import List, Optional
+
+
+def _write_table(table: pa.Table, path: str) -> None:
+    os.makedirs(os.path.dirname(path), exist_ok=True)
+    tmp = f"{path}.tmp"
+    with pa.OSFile(tmp, "wb") as sink, pa.ipc.new_file(sink, table.schema) as writer:
+        writer.write_table(table)
+    os.replace(tmp, path)  # a file is either complete or absent
+
+
+def _read_table(path: str, columns: Optional[List[str]] = None) -> pa.Table:
+    """Memory-maps an Arrow IPC file, only the requested columns are read from disk."""
+    with pa.memory_map(path, "r") as source:
+        table = pa.ipc.open_file(source).read_all()
+    if columns is not None:
+        table = table.select([c for c in columns if c in table.column_names])
+    return table
+
+
+def _concat_tables(tables: List[pa.Table]) -> pa.Table:
+    """
+    Concatenates tables whose columns may differ in type between files. Types are promoted where
+    Arrow can (int and float, null and anything), columns that still disagree, e.g. a parameter
+    that is a number in one run and a string in another, are read as strings.
+    """
+    types = {}
+    for table in tables:
+        for field in table.schema:
+            types.setdefault(field.name, set()).add(field.type)
+    as_string = set()
+    for name, column_types in types.items():
+        try:
+            pa.unify_schemas([pa.schema([(name, t)]) for t in column_types], promote_options="permissive")
+        except (pa.ArrowTypeError, pa.ArrowInvalid):
+            as_string.add(name)
+    if as_string:
+        tables = [
+            table.cast(pa.schema([
+                pa.field(f.name, pa.string()) if f.name in as_string else f for f in table.schema
+            ]))
+            for table in tables
+        ]
+    return pa.concat_tables(tables, promote_options="permissive")
+
+
+class ResultsStore:
+    """
+    On-disk store of growth runs: one metrics row and, optionally, the generated network of
+    every run, keyed by a run id (e.g. `scenarios.cell_id` of its parameters).
+
+    Everything is written as uncompressed Arrow IPC files and read back through memory maps,
+    so reading one network or one metric column of a thousand runs neither unpickles graphs nor
+    reads the other columns. Layout under `root`:
+
+        rows/<run_id>.arrow      metrics row of a run, written when the run finishes
+        rows.arrow               rows merged by `compact`
+        networks/<run_id>.arrow  edge list of a run: u, v, key, length, existing, generated
+
+    Writers only ever create their own files, so parallel workers can add runs at the same time.
+    `compact` and `remove` rewrite rows.arrow and should run from a single process.
+
+    Parameters
+    -------
+    root: string
+        Folder of the store, created on the first write.
+    id_column: string
+        Column of the rows holding the run id.
+    """
+
+    def __init__(self, root: str, id_column: str = "run_id"):
+        self.root = root
+        self.id_column = id_column
+
+    def _row_path(self, run_id: str) -> str:
+        return os.path.join(self.root, "rows", f"{run_id}.arrow")
+
+    def _network_path(self, run_id: str) -> str:
+        return os.path.join(self.root, "networks", f"{run_id}.arrow")
+
+    @property
+    def _compacted_path(self) -> str:
+        return os.path.join(self.root, "rows.arrow")
+
+    def _row_files(self) -> List[str]:
+        folder = os.path.join(self.root, "rows")
+        if not os.path.isdir(folder):
+            return []
+        return sorted(os.path.join(folder, f) for f in os.listdir(folder) if f.endswith(".arrow"))
+
+    def add_row(self, run_id: str, row: dict) -> None:
+        """
+        Stores the metrics row of a run, replacing an earlier row with the same id.
+
+        Parameters
+        -------
+        run_id: string
+        row: dict
+            Column name : scalar value. The id is stored in its `id_column`.
+        """
+        table = pa.Table.from_pandas(pd.DataFrame([{**row, self.id_column: run_id}]), preserve_index=False)
+        _write_table(table.replace_schema_metadata(None), self._row_path(run_id))
+
+    def add_network(self, run_id: str, G: nx.MultiDiGraph, params: Optional[dict] = None) -> None:
+        """
+        Stores the edge list of a generated network: node ids, multi-edge keys, lengths and the
+        existing/generated flags. Node attributes and isolated nodes are not stored, `network`
+        takes node attributes from the base graph.
+
+        Parameters
+        -------
+        run_id: string
+        G: nx.MultiDiGraph
+            Network as returned by `gt_with_existing_full`.
+        params: dict
+            Run parameters, kept in the file's schema metadata.
+        """
+        C = CompactGraph.from_networkx(G)
+        table = pa.table(
+            {
+                "u": C.node_ids[C.src],
+                "v": C.node_ids[C.dst],
+                "key": C.keys,
+                "length": C.length,
+                "existing": (C.flags & EXISTING).astype(bool),
+                "generated": (C.flags & GENERATED).astype(bool),
+            }
+        )
+        metadata = {"run_id": run_id, "params": json.dumps(params or {}, default=str)}
+        _write_table(table.replace_schema_metadata(metadata), self._network_path(run_id))
+
+    def rows(self, columns: Optional[List[str]] = None) -> pd.DataFrame:
+        """
+        Metrics rows of all runs, one per run id.
+
+        Parameters
+        -------
+        columns: list
+            Only read these columns (the id column is always included). All by default.
+            Columns holding values of different types across runs are returned as strings.
+
+        Returns
+        -------
+        pd.DataFrame
+        """
+        if columns is not None:
+            columns = [self.id_column] + [c for c in columns if c != self.id_column]
+        paths = ([self._compacted_path] if os.path.exists(self._compacted_path) else []) + self._row_files()
+        if not paths:
+            return pd.DataFrame()
+        tables = [_read_table(p, columns) for p in paths]
+        df = _concat_tables(tables).to_pandas()
+        # Later files are newer runs: a rerun after compaction replaces the compacted row
+        return df.drop_duplicates(self.id_column, keep="last").reset_index(drop=True)
+
+    def edges(self, run_id: str) -> pa.Table:
+        """Edge list of a run as a memory-mapped Arrow table, see `add_network`."""
+        return _read_table(self._network_path(run_id))
+
+    def network(self, run_id: str, G_base: Optional[nx.MultiDiGraph] = None) -> nx.MultiDiGraph:
+        """
+        Rebuilds a stored network with "length", "existing" and "generated" on its edges.
+
+        Parameters
+        -------
+        run_id: string
+        G_base: nx.MultiDiGraph
+            Graph the run was generated from. When given, node attributes (x, y, poi, ...) are
+            copied from it.
+
+        Returns
+        -------
+        nx.MultiDiGraph
+        """
+        table = self.edges(run_id)
+        columns = {c: table.column(c).to_pylist() for c in table.column_names}
+        G = nx.MultiDiGraph()
+        G.add_edges_from(
+            (u, v, k, {"length": l, "existing": e, "generated": g})
+            for u, v, k, l, e, g in zip(
+                columns["u"], columns["v"], columns["key"], columns["length"], columns["existing"], columns["generated"]
+            )
+        )
+        if G_base is not None:
+            nx.set_node_attributes(G, {n: G_base.nodes[n] for n in G if n in G_base})
+        return G
+
+    def params(self, run_id: str) -> dict:
+        """Run parameters stored with a network."""
+        with pa.memory_map(self._network_path(run_id), "r") as source:
+            metadata = pa.ipc.open_file(source).schema.metadata or {}
+        return json.loads(metadata.get(b"params", b"{}"))
+
+    def has_network(self, run_id: str) -> bool:
+        return os.path.exists(self._network_path(run_id))
+
+    def compact(self) -> int:
+        """
+        Merges the per-run rows into rows.arrow, so reading a column touches one file instead of
+        one per run. Returns the number of rows merged.
+        """
+        files = self._row_files()
+        if not files:
+            return 0
+        df = self.rows()
+        _write_table(pa.Table.from_pandas(df, preserve_index=False).replace_schema_metadata(None), self._compacted_path)
+        for path in files:
+            os.remove(path)
+        return len(files)
+
+    def remove(self, run_id: str) -> bool:
+        """
+        Removes the row and network of a run, e.g. to run it again. Returns True if there was one.
+        """
+        found = False
+        for path in [self._row_path(run_id), self._network_path(run_id)]:
+            if os.path.exists(path):
+                os.remove(path)
+                found = True
+        if os.path.exists(self._compacted_path):
+            table = _read_table(self._compacted_path)
+            keep = np.asarray(table.column(self.id_column).to_pylist()) != run_id
+            if not keep.all():
+                _write_table(table.filter(pa.array(keep)), self._compacted_path)
+                found = True
+        return found
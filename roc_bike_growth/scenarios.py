@@ -0,0 +1,235 @@
+import hashlib
+import itertools
+import json
+import os
+import random
+import time
+import multiprocessing
+import pandas as pd
+import networkx as nx
+import igraph as ig
+from concurrent.futures import ProcessPoolExecutor, as_completed
+
+from roc_bike_growth import graph_utils as gu
+from roc_bike_growth.metrics import MetricSuite
+from roc_bike_growth.paper_gt import combined_igraph, gt_with_existing_combined
+from roc_bike_growth.results import ResultsStore
+
+from typing import Callable, Dict, List, Optional
+
+
+# Scenario parameters and their defaults. poi_n samples that many of the POIs (None: all).
+SCENARIO_DEFAULTS = {
+    "route_factor": 0,
+    "crash_factor": 0,
+    "prune_factor": 1,
+    "prune_measure": "betweenness",
+    "by_factor": "mod",
+    "bw_mode": "exact",
+    "bw_epsilon": 0.05,
+    "bw_delta": 0.1,
+    "poi_n": None,
+}
+
+
+def scenario_grid(grid: Dict[str, list]) -> List[dict]:
+    """
+    Expands a parameter grid into one scenario dict per combination, in itertools.product order.
+    Parameters missing from the grid take their value from SCENARIO_DEFAULTS.
+
+    Parameters
+    -------
+    grid: dict
+        Parameter name : list of values, e.g. {"prune_factor": [0.1, 0.2], "route_factor": [0, 0.5]}.
+
+    Returns
+    -------
+    scenarios: list
+    """
+    unknown = set(grid) - set(SCENARIO_DEFAULTS)
+    if unknown:
+        raise ValueError(f"Unknown scenario parameters {unknown}, use {list(SCENARIO_DEFAULTS)}.")
+    names = list(grid)
+    return [
+        {**SCENARIO_DEFAULTS, **dict(zip(names, values))}
+        for values in itertools.product(*(grid[n] for n in names))
+    ]
+
+
+def cell_id(scenario: dict) -> str:
+    """Stable id of a scenario, the hash of its parameters. Used for file names and resuming."""
+    content = json.dumps({k: scenario[k] for k in sorted(scenario)}, default=str)
+    return hashlib.sha1(content.encode()).hexdigest()[:16]
+
+
+def cell_seed(scenario: dict, seed: int = 0) -> int:
+    """Seed of a scenario: depends only on its parameters and the sweep seed, not on run order."""
+    return int(hashlib.sha1(f"{seed}:{cell_id(scenario)}".encode()).hexdigest()[:8], 16)
+
+
+# Networks of the running sweep, filled by `_init_worker`: in this process for serial runs,
+# otherwise in each worker from the pool's initargs, once per worker rather than per cell.
+# With fork the workers inherit the initargs as process memory, with spawn they are pickled.
+_shared = {}
+
+
+def _init_worker(G_comb: ig.Graph, G_existing: nx.MultiDiGraph, options: dict) -> None:
+    _shared.update(G_comb=G_comb, G_existing=G_existing, options=options)
+
+
+def _run_cell(scenario: dict) -> dict:
+    G_comb, G_existing, options = _shared["G_comb"], _shared["G_existing"], _shared["options"]
+    store = ResultsStore(options["out_dir"], id_column="cell_id")
+    cid = cell_id(scenario)
+    seed = cell_seed(scenario, options["seed"])
+    row = {"cell_id": cid, "seed": seed, **scenario}
+    start = time.perf_counter()
+    try:
+        pois_ids = [v.index for v in G_comb.vs if v["poi"]]
+        if scenario["poi_n"] is not None and scenario["poi_n"] < len(pois_ids):
+            pois_ids = sorted(random.Random(seed).sample(pois_ids, scenario["poi_n"]))
+        params = {k: v for k, v in scenario.items() if k != "poi_n"}
+        G_nx = gt_with_existing_combined(G_comb, G_existing, pois_ids, seed=seed, **params)
+        if options["save_networks"]:
+            store.add_network(cid, G_nx, scenario)
+
+        record = MetricSuite(G_nx, seed=seed, **options["metric_kwargs"]).compute(options["metrics"])
+        for name, value in record.as_dict().items():
+            if isinstance(value, tuple):  # confidence intervals
+                row[f"{name}_low"], row[f"{name}_high"] = value
+            elif value is not None:
+                row[name] = value
+        row.update(
+            n_nodes=G_nx.number_of_nodes(),
+            n_edges=G_nx.number_of_edges(),
+            length_km=gu.graph_length_km(G_nx),
+            error=None,
+        )
+    except Exception as e:
+        row["error"] = f"{type(e).__name__}: {e}"
+    row["runtime_s"] = time.perf_counter() - start
+
+    store.add_row(cid, row)
+    return row
+
+
+def results_store(out_dir: str) -> ResultsStore:
+    """The ResultsStore a sweep writes to, for reading back single columns or stored networks."""
+    return ResultsStore(out_dir, id_column="cell_id")
+
+
+def load_results(out_dir: str, columns: Optional[List[str]] = None) -> pd.DataFrame:
+    """
+    All finished cells of a sweep, one row per scenario.
+
+    Parameters
+    -------
+    out_dir: string
+        Output folder of `run_scenarios`.
+    columns: list
+        Only read these columns (and "cell_id"). All by default.
+
+    Returns
+    -------
+    pd.DataFrame
+    """
+    return results_store(out_dir).rows(columns)
+
+
+def run_scenarios(
+    G_base: nx.MultiDiGraph,
+    G_existing: nx.MultiDiGraph,
+    grid: Dict[str, list],
+    out_dir: str,
+    metrics: Optional[List[str]] = None,
+    metric_kwargs: Optional[dict] = None,
+    n_jobs: Optional[int] = None,
+    seed: int = 0,
+    retry_failed: bool = False,
+    progress: Optional[Callable[[dict], None]] = None,
+    save_networks: bool = False,
+) -> pd.DataFrame:
+    """
+    Runs gt_with_existing_full and the network metrics for every scenario of a parameter grid in
+    a process pool.
+
+    The combined graph is built once and shared with the workers (copy-on-write where processes
+    fork). Each finished scenario is written to the ResultsStore in out_dir as soon as it is done,
+    so a crashed or interrupted sweep resumes where it stopped: scenarios with a stored row are
+    skipped. The rows are compacted into a single file once the sweep is through. Every scenario gets its own seed from its parameters and `seed`, used for poi sampling,
+    sampled betweenness and the metric samples, so results do not depend on scheduling.
+
+    Parameters
+    -------
+    G_base: nx.MultiDiGraph
+        Base network with "poi" on nodes, e.g. from `carall_from_polygon`. G_existing is merged into
+        it in place, as gt_with_existing_full does.
+    G_existing: nx.MultiDiGraph
+        Existing bike network.
+    grid: dict
+        Parameter name : list of values, see `scenario_grid` and SCENARIO_DEFAULTS.
+    out_dir: string
+        Folder of the ResultsStore, see `results_store`.
+    metrics: list
+        Metrics to compute, see MetricSuite.METRICS. All by default.
+    metric_kwargs: dict
+        Further MetricSuite arguments, e.g. {"buffer": 500, "coverage_method": "grid"}.
+    n_jobs: int
+        Worker processes, default os.cpu_count(). 1 runs in this process.
+    seed: int
+        Sweep seed the scenario seeds are derived from.
+    retry_failed: bool
+        Also rerun scenarios whose earlier run raised an error.
+    progress: Callable
+        Called with the result row of every scenario finished in this run.
+    save_networks: bool
+        Also store the edge list of every generated network, read back with
+        `results_store(out_dir).network(cell_id, G_base)`.
+
+    Returns
+    -------
+    pd.DataFrame
+        Results of all scenarios of the grid, including those of earlier runs.
+    """
+    os.makedirs(out_dir, exist_ok=True)
+    scenarios = scenario_grid(grid)
+
+    done = load_results(out_dir)
+    skip = set()
+    if len(done):
+        finished = done[done["error"].isna()] if retry_failed else done
+        skip = set(finished["cell_id"])
+    todo = [s for s in scenarios if cell_id(s) not in skip]
+
+    if todo:
+        G_comb = combined_igraph(G_base, G_existing)
+        options = {
+            "seed": seed,
+            "metrics": metrics,
+            "metric_kwargs": metric_kwargs or {},
+            "out_dir": out_dir,
+            "save_networks": save_networks,
+        }
+        n_jobs = n_jobs or os.cpu_count()
+        if n_jobs == 1:
+            _init_worker(G_comb, G_existing, options)
+            for scenario in todo:
+                row = _run_cell(scenario)
+                if progress:
+                    progress(row)
+        else:
+            methods = multiprocessing.get_all_start_methods()
+            context = multiprocessing.get_context("fork" if "fork" in methods else None)
+            with ProcessPoolExecutor(
+                n_jobs, mp_context=context, initializer=_init_worker, initargs=(G_comb, G_existing, options)
+            ) as pool:
+                for future in as_completed([pool.submit(_run_cell, s) for s in todo]):
+                    row = future.result()
+                    if progress:
+                        progress(row)
+
+        results_store(out_dir).compact()
+
+    ids = {cell_id(s) for s in scenarios}
+    results = load_results(out_dir)
+    return results[results["cell_id"].isin(ids)].reset_index(drop=True)
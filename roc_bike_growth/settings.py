@@ -43,5 +43,40 @@ class CONFIG:
     }
 
     poi_filepath = "data/POIsRochester.csv"
+    poi_snap_dist = 500  # meters, POIs further from the drive network are dropped
 
     median_income_var = "B07011_001E"
+
+    # Crash events 2011-2020 (points, no attributes) and how far from a drive edge they still count
+    crash_filepath = "data/2011_2020_Events/2011_2020_Events.shp"
+    crash_snap_dist = 30  # meters
+
+    # Local BikeRochester layers, an offline alternative to osm_bike_params (see
+    # `bike_infra_from_shapefiles`). Layer : bike_infrastructure_type, or "Type" column
+    # value : bike_infrastructure_type for layers with several kinds of infrastructure.
+    # Types are the osm_bike_params keys. Painted bike lanes have no category of their own
+    # there and count as "bike_boulevard", the on-street bicycle=designated ways.
+    bike_rochester_dir = "data/BikeRochester"
+    bike_rochester_layers = {
+        "Bike Markings": {
+            "Cycle Track": "bike_cyclewaytrack",
+            "Bike Lanes": "bike_boulevard",
+            "Bike Blvd": "bike_boulevard",
+            "Shared Use": "bike_sharedpath",
+        },
+        "Trails": "bike_highwaycycleway",
+    }
+    # "Status" values of infrastructure that is not built. Rows with any other Status,
+    # including none at all, count as existing.
+    bike_rochester_excluded_statuses = ("Proposed",)
+    bike_rochester_snap_dist = 15  # meters
+    local_crs = "epsg:26918"  # UTM 18N, for distances around Rochester
+
+    # Local cache of OSM downloads, see `cache.py`
+    cache_dir = "cache/roc_bike_growth"
+    use_cache = True
+    cache_only = False  # offline runs: raise on a cache miss instead of downloading
+
+    # Geocoding of addresses (POIs_from_file), cached in cache_dir/geocode.sqlite
+    geocode_workers = 4
+    geocode_rate = 1.0  # max requests per second, Nominatim's usage policy
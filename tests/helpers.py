@@ -0,0 +1,26 @@
+import networkx as nx
+import random
+
+
+def make_test_network(k=12, seed=0):
+    '''
+    Make a small drive network with pois and an existing bike network on a few of its streets
+    '''
+    rng = random.Random(seed)
+    G = nx.MultiDiGraph()
+    for i in range(k * k):
+        G.add_node(
+            i,
+            x=-77.6 + (i % k) * 0.002 + rng.uniform(-5e-4, 5e-4),
+            y=43.15 + (i // k) * 0.002 + rng.uniform(-5e-4, 5e-4),
+            street_count=4,
+            poi=rng.random() < 0.15,
+        )
+    for i in range(k * k):
+        for j in [i + 1, i + k]:
+            if j < k * k and (j != i + 1 or j % k):
+                length = rng.uniform(100, 250)
+                G.add_edge(i, j, length=length)
+                G.add_edge(j, i, length=length)
+    existing = G.edge_subgraph([(i, i + 1, 0) for i in range(k * 3, k * 4 - 1)]).copy()
+    return G, existing
@@ -0,0 +1,65 @@
+from roc_bike_growth import cache
+from roc_bike_growth.settings import CONFIG
+from shapely.geometry import LineString, Polygon
+import networkx as nx
+import pytest
+
+
+def make_test_graph() -> nx.MultiDiGraph:
+    '''
+    Make a test graph with the kinds of attributes osmnx produces, some missing on some edges
+    '''
+    G = nx.MultiDiGraph(crs="epsg:4326")
+    G.add_node(10, x=-77.6, y=43.15, street_count=3)
+    G.add_node(11, x=-77.61, y=43.16, street_count=1)
+    G.add_node(12, x=-77.62, y=43.17)
+    G.add_edge(10, 11, osmid=1, length=120.5, name="A-street", oneway=False)
+    G.add_edge(10, 11, osmid=[2, 3], length=130, name=["A-street", "B-street"])
+    G.add_edge(11, 12, osmid=4, length=80.0, geometry=LineString([(-77.61, 43.16), (-77.62, 43.17)]))
+    G.add_edge(12, 10, osmid=5, length=99.9, lanes="2")
+    return G
+
+
+def test_graph_arrays_roundtrip() -> None:
+    '''
+    Graphs should come back with the same nodes, edges, keys, attributes and order
+    '''
+    G = make_test_graph()
+    out = cache.graph_from_arrays(cache.graph_to_arrays(G))
+    assert out.graph == G.graph
+    assert list(out.nodes(data=True)) == list(G.nodes(data=True))
+    assert list(out.edges(keys=True, data=True)) == list(G.edges(keys=True, data=True))
+
+    # Equal values of different types in one column keep their type
+    for i, value in enumerate([True, 1, 1.0, True, 1, 1.0, False, 0]):
+        G.add_node(100 + i, x=-77.6, y=43.15, flag=value)
+    out = cache.graph_from_arrays(cache.graph_to_arrays(G))
+    assert [(v, type(v)) for _, v in out.nodes(data="flag")] == [(v, type(v)) for _, v in G.nodes(data="flag")]
+
+
+def test_cached(tmp_path, monkeypatch) -> None:
+    '''
+    Misses call build once, hits and offline runs read from disk, invalidation forces a rebuild
+    '''
+    monkeypatch.setattr(CONFIG, "cache_dir", str(tmp_path))
+    polygon = Polygon([(0, 0), (1, 0), (1, 1)])
+    calls = []
+
+    def build():
+        calls.append(1)
+        return make_test_graph()
+
+    first = cache.cached("graph_from_polygon", polygon, {"network_type": "drive"}, build)
+    second = cache.cached("graph_from_polygon", polygon, {"network_type": "drive"}, build)
+    assert len(calls) == 1
+    assert list(second.edges(keys=True, data=True)) == list(first.edges(keys=True, data=True))
+
+    cache.cached("graph_from_polygon", polygon, {"network_type": "bike"}, build)
+    assert len(calls) == 2
+
+    monkeypatch.setattr(CONFIG, "cache_only", True)
+    cache.cached("graph_from_polygon", polygon, {"network_type": "drive"}, build)
+    assert cache.invalidate("graph_from_polygon", polygon, {"network_type": "drive"})
+    with pytest.raises(FileNotFoundError):
+        cache.cached("graph_from_polygon", polygon, {"network_type": "drive"}, build)
+    assert len(calls) == 2
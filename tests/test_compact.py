@@ -0,0 +1,58 @@
+from roc_bike_growth.compact import CompactGraph
+import igraph as ig
+import networkx as nx
+import numpy as np
+import random
+
+
+def make_test_graph(n=200, seed=0) -> nx.MultiDiGraph:
+    '''
+    Make a random MultiDiGraph with osmnx-style ids, coordinates, lengths and flags
+    '''
+    rng = random.Random(seed)
+    G = nx.MultiDiGraph()
+    for i in range(n):
+        G.add_node(10 ** 9 + i * 7, x=-77.6 + rng.random() * 0.1, y=43.1 + rng.random() * 0.1, name="x")
+    nodes = list(G.nodes)
+    for _ in range(4 * n):
+        u, v = rng.choice(nodes), rng.choice(nodes)
+        G.add_edge(u, v, length=rng.uniform(10, 500), existing=rng.random() < 0.2, name="y")
+    return G
+
+
+def test_networkx_roundtrip() -> None:
+    '''
+    Edges, keys, lengths, flags and coordinates should survive networkx -> compact -> networkx / igraph
+    '''
+    G = make_test_graph()
+    C = CompactGraph.from_networkx(G)
+    assert C.n_nodes == G.number_of_nodes() and C.n_edges == G.number_of_edges()
+
+    out = C.to_networkx()
+    assert set(out.edges(keys=True)) == set(G.edges(keys=True))
+    for u, v, k, d in G.edges(keys=True, data=True):
+        assert out[u][v][k]["length"] == d["length"]
+        assert out[u][v][k]["existing"] == d["existing"]
+    for n, d in G.nodes(data=True):
+        assert abs(out.nodes[n]["x"] - d["x"]) < 1e-6
+        assert abs(out.nodes[n]["y"] - d["y"]) < 1e-6
+
+    back = CompactGraph.from_igraph(C.to_igraph())
+    assert sorted(back.edge_ids()) == sorted(C.edge_ids())
+    assert (back.flags == C.flags).all()
+
+
+def test_to_undirected() -> None:
+    '''
+    Undirected simple version should match nx.Graph(G) and its igraph conversion
+    '''
+    G = make_test_graph()
+    expected = ig.Graph.from_networkx(nx.Graph(G))
+    out = CompactGraph.from_networkx(G).to_undirected().to_igraph()
+    assert out.vs["_nx_name"] == expected.vs["_nx_name"]
+    assert sorted(map(sorted, out.get_edgelist())) == sorted(map(sorted, expected.get_edgelist()))
+    assert np.allclose(out.vs["x"], expected.vs["x"], atol=1e-6)
+
+    indptr, indices = CompactGraph.from_networkx(G).adjacency()
+    for i in range(out.vcount()):
+        assert list(indices[indptr[i] : indptr[i + 1]]) == sorted(set(out.neighbors(i)) - {i})
@@ -1,5 +1,7 @@
-from roc_bike_growth.graph_utils import get_street_segment, get_intersections
+from roc_bike_growth.graph_utils import get_street_segment, get_street_segments, get_intersections, ig_to_nx, merge_graphs, street_name_index, invalidate_street_name_index, graph_length_km, snap_to_nodes, node_index
+import igraph as ig
 import networkx as nx
+import numpy as np
 
 def make_test_graph() -> nx.MultiDiGraph:
     '''
@@ -56,4 +58,152 @@ def test_get_street_segment() -> None:
     
 
     
-    
\ No newline at end of file
+    
+
+def test_ig_to_nx() -> None:
+    '''
+    Nodes, attributes and parallel edge keys should survive networkx -> igraph -> networkx
+    '''
+    G = make_test_graph()
+    G.add_edge(1, 2, 3, name='A-street bypass')
+    G.graph['crs'] = 'epsg:4326'
+    nx.set_node_attributes(G, {n: n * 10 for n in G.nodes}, 'x')
+
+    out = ig_to_nx(ig.Graph.from_networkx(G))
+    assert list(out.nodes(data=True)) == list(G.nodes(data=True))
+    assert sorted(out.edges(keys=True, data=True)) == sorted(G.edges(keys=True, data=True))
+    assert out.graph == G.graph
+
+
+def test_merge_graphs() -> None:
+    '''
+    Only nodes and (u, v, key) edges missing from dst should be added, with their attributes
+    '''
+    G = make_test_graph()
+    nx.set_node_attributes(G, {n: {'x': n, 'y': -n, 'street_count': 1} for n in G.nodes})
+    src = nx.MultiDiGraph()
+    src.add_node(1, x=100, y=100, street_count=9)
+    src.add_node(13, x=13, y=-13, street_count=2, highway='stop')
+    src.add_edge(1, 2, 0, name='Bike path')  # already in G
+    src.add_edge(1, 2, 1, name='Bike path')
+    src.add_edge(12, 13, 0, name='Bike path')
+
+    counts = merge_graphs(G, src)
+    assert counts == {'nodes_added': 1, 'nodes_skipped': 3, 'edges_added': 2, 'edges_skipped': 1}
+    assert G.nodes[1] == {'x': 1, 'y': -1, 'street_count': 1}
+    assert G.nodes[13] == {'x': 13, 'y': -13, 'street_count': 2}
+    assert G[1][2][0] == {'name': 'A-street'}
+    assert G[1][2][1] == {'name': 'Bike path'}
+    assert G[12][13][0] == {'name': 'Bike path'}
+    G[12][13][0]['name'] = 'changed'
+    assert src[12][13][0]['name'] == 'Bike path'
+
+
+def test_street_name_index() -> None:
+    '''
+    The index should be cached on the graph, rebuilt when the graph changes and support
+    the other match modes
+    '''
+    G = make_test_graph()
+    index = street_name_index(G)
+    assert street_name_index(G) is index
+    assert index.nodes('b-street') == {1, 8, 9}
+
+    # Copies get their own index and G.graph stays clean
+    H = G.copy()
+    assert street_name_index(H) is not index and H.graph == G.graph == {}
+    H[1][2][0]['name'] = 'E-street'
+    invalidate_street_name_index(H)
+    assert street_name_index(H).nodes('e-street') == {1, 2} and index.nodes('e-street') == set()
+
+    G.add_edge(9, 13, name='D-street')
+    assert street_name_index(G) is not index
+    assert get_intersections(G, 'B-street', 'D-street') == {9}
+
+    assert street_name_index(G).match('^[ab]-', match='regex') == ['a-street', 'b-street']
+    assert street_name_index(G).match('A-stret', match='fuzzy', cutoff=0.9) == ['a-street']
+    assert street_name_index(G).match('street', match='token') == []
+    assert get_street_segment(G, '^a-', '^b-', '^c-', match='regex') == [1, 2, 3, 4]
+
+    # Rewiring that keeps the node and edge counts should be seen too
+    G = nx.MultiDiGraph()
+    G.add_edges_from([(1, 2, {'name': 'A street'}), (2, 3, {'name': 'B street'}), (3, 4, {'name': 'C street'}), (1, 4, {'name': 'D'})])
+    assert get_intersections(G, 'A street', 'B street') == {2}
+    G.remove_edge(2, 3)
+    G.add_edge(1, 3, name='B street')
+    assert get_intersections(G, 'A street', 'B street') == {1}
+
+
+def test_get_street_segments() -> None:
+    '''
+    Batch resolution should give the same routes as get_street_segment, with diagnostics
+    '''
+    G = make_test_graph()
+    segments = [('A-street', 'B-street', 'C-street'), ('A-street', 'C-street', 'B-street'), ('A-street', 'B-street', 'D-street')]
+
+    routes, diagnostics = get_street_segments(G, segments)
+    assert routes == [get_street_segment(G, *s) for s in segments]
+    assert routes[0] == [1, 2, 3, 4]
+    assert diagnostics[0]['src_matches'] == 1 and diagnostics[0]['dest_matches'] == 1
+    assert diagnostics[0]['found'] and not diagnostics[0]['ambiguous']
+    # A-street is one way from 1 towards 7
+    assert diagnostics[1]['candidates'] == 0 and routes[1] == []
+    assert diagnostics[2]['dest_matches'] == 0 and not diagnostics[2]['found']
+
+
+def test_graph_length_km() -> None:
+    '''
+    Reciprocal edges should count once, taking the length of the (max, min) direction, and add up by type
+    '''
+    G = nx.MultiDiGraph()
+    G.add_edge(20, 10, length=1000, bike_infrastructure_type='bike_boulevard')
+    G.add_edge(10, 20, length=900)
+    G.add_edge(10, 20, length=500, bike_infrastructure_type='bike_boulevard')  # key 1, no reverse
+    G.add_edge(30, 40, length=250, bike_infrastructure_type='bike_cyclewaytrack')
+    G.add_edge(40, 30, length=200)
+    G.add_edge(30, 30, length=100)
+    G.add_edge(30, 20)  # no length
+    assert graph_length_km(G) == 1.8
+    total, by_type = graph_length_km(G, by_type=True)
+    assert total == 1.8
+    assert by_type == {'bike_boulevard': 1.5, None: 0.3}
+    assert graph_length_km(nx.MultiDiGraph()) == 0
+
+
+def test_snap_to_nodes() -> None:
+    '''
+    Batch snapping should find the nearest node by great-circle distance, drop far points and reuse its tree
+    '''
+    rng = np.random.default_rng(0)
+    G = nx.MultiDiGraph()
+    for i in range(500):
+        G.add_node(1000 + i, x=-77.65 + rng.random() * 0.1, y=43.1 + rng.random() * 0.1)
+    X = np.append(-77.65 + rng.random(200) * 0.1, -77.0)  # last point about 50 km away
+    Y = np.append(43.1 + rng.random(200) * 0.1, 43.15)
+
+    ids, dist, snapped = snap_to_nodes(G, X, Y, max_dist=1000)
+    assert snapped[:-1].all() and not snapped[-1]
+    lon = np.array([d['x'] for _, d in G.nodes(data=True)])
+    lat = np.array([d['y'] for _, d in G.nodes(data=True)])
+    phi1, phi2 = np.radians(Y[:-1, None]), np.radians(lat[None, :])
+    a = np.sin((phi2 - phi1) / 2) ** 2 + np.cos(phi1) * np.cos(phi2) * np.sin(np.radians(lon[None, :] - X[:-1, None]) / 2) ** 2
+    great_circle = 2 * 6371000 * np.arcsin(np.sqrt(a))
+    assert (ids == np.array(list(G))[great_circle.argmin(axis=1)]).all()
+    assert np.allclose(dist, great_circle.min(axis=1), rtol=1e-3)
+    assert len(snap_to_nodes(G, X, Y)[0]) == 201
+
+    index = node_index(G)
+    assert node_index(G) is index
+    H = G.copy()
+    assert node_index(H) is not index
+    assert H.graph == G.graph == {}
+    G.add_node(1, x=-77.0, y=43.15)
+    assert snap_to_nodes(G, X[-1:], Y[-1:], max_dist=1000)[0].tolist() == [1]
+    G.nodes[1]['x'] = -76.0  # moved in place
+    assert snap_to_nodes(G, X[-1:], Y[-1:], max_dist=1000)[0].tolist() == []
+
+    # Empty graph or empty query snap nothing
+    ids, dist, snapped = snap_to_nodes(nx.MultiDiGraph(), X[:3], Y[:3])
+    assert len(ids) == 0 and snapped.tolist() == [False] * 3
+    ids, dist, snapped = snap_to_nodes(G, X[:0], Y[:0], max_dist=1000)
+    assert len(ids) == len(dist) == len(snapped) == 0
@@ -0,0 +1,211 @@
+from roc_bike_growth.loader import _fill_edge_geometry, ensure_edge_geometry, _apply_edge_geometry, crash_counts, add_crash_counts, load_crash_events, bike_infra_from_shapefiles, geocode_addresses, POIs_from_file, _downsample_poi_nodes_by_income, _tract_income
+from roc_bike_growth import cache
+from roc_bike_growth.settings import CONFIG
+from helpers import make_test_network
+from shapely.geometry import LineString
+import geopandas as gpd
+import networkx as nx
+import osmnx as ox
+import pandas as pd
+import pytest
+import time
+import numpy as np
+import pyproj
+import shapely
+
+
+def test_fill_edge_geometry() -> None:
+    '''
+    Missing geometries should become straight lines, existing ones kept, lazy graphs filled on demand
+    '''
+    G = nx.MultiDiGraph()
+    G.add_node(1, x=0.0, y=0.0)
+    G.add_node(2, x=1.0, y=2.0)
+    G.add_node(3, x=3.0, y=1.0)
+    curved = LineString([(1, 2), (2, 3), (3, 1)])
+    G.add_edge(1, 2)
+    G.add_edge(1, 2)
+    G.add_edge(2, 3, geometry=curved)
+    G.add_edge(3, 1, geometry=None)
+
+    lazy = _apply_edge_geometry(G.copy(), 'lazy')
+    assert [g for _, _, g in lazy.edges(data='geometry')] == [None, None, curved, None]
+    assert _apply_edge_geometry(G.copy(), False).graph.get('edge_geometry') is None
+
+    G = _fill_edge_geometry(G)
+    assert G.edges[1, 2, 1]['geometry'].equals(LineString([(0, 0), (1, 2)]))
+    assert G.edges[2, 3, 0]['geometry'] is curved
+    assert G.edges[3, 1, 0]['geometry'].equals(LineString([(3, 1), (0, 0)]))
+
+    ensure_edge_geometry(lazy)
+    assert [g.wkt for _, _, g in lazy.edges(data='geometry')] == [g.wkt for _, _, g in G.edges(data='geometry')]
+    lazy.add_edge(2, 1)
+    assert 'geometry' not in ensure_edge_geometry(lazy).edges[2, 1, 0]
+    assert ensure_edge_geometry(lazy, force=True).edges[2, 1, 0]['geometry'].equals(LineString([(1, 2), (0, 0)]))
+
+
+def test_crash_counts() -> None:
+    '''
+    Bulk snapping should match a brute-force nearest edge search, ties included
+    '''
+    G, _ = make_test_network()
+    G.edges[0, 1, 0]['geometry'] = LineString([(G.nodes[0]['x'], G.nodes[0]['y']), (-77.599, 43.1485), (G.nodes[1]['x'], G.nodes[1]['y'])])
+    rng = np.random.default_rng(0)
+    to_utm = pyproj.Transformer.from_crs('epsg:4326', 'epsg:26918', always_xy=True)
+    x, y = to_utm.transform(rng.uniform(-77.602, -77.576, 300), rng.uniform(43.148, 43.174, 300))
+    node = G.nodes[20]  # one event right on a node
+    x, y = np.append(x, to_utm.transform(node['x'], node['y'])[0]), np.append(y, to_utm.transform(node['x'], node['y'])[1])
+    events = gpd.GeoDataFrame(geometry=gpd.points_from_xy(x, y), crs='epsg:26918')
+
+    counts = crash_counts(G, events, max_dist=50)
+    _fill_edge_geometry(G)
+    lines = shapely.transform(
+        np.array([d['geometry'] for _, _, d in G.edges(data=True)]),
+        lambda c: np.column_stack(to_utm.transform(c[:, 0], c[:, 1])),
+    )
+    dist = shapely.distance(np.asarray(events.geometry.values)[:, None], lines[None, :])
+    nearest = (dist == dist.min(axis=1, keepdims=True)) & (dist <= 50)
+    assert counts.tolist() == nearest.sum(axis=0).tolist()
+    assert counts.sum() > len(events) and counts[[i for i, (u, v) in enumerate(G.edges()) if 20 in (u, v)]].min() >= 1
+
+    assert add_crash_counts(G, events, max_dist=50).tolist() == [d['crashes'] for _, _, d in G.edges(data=True)]
+    assert len(load_crash_events()) > 0
+
+
+def test_bike_infra_from_shapefiles() -> None:
+    '''
+    Drive edges along the BikeRochester lines should be kept with their type, also where the Status is missing,
+    a parallel street and short streets crossing the lines should not
+    '''
+    markings = gpd.read_file('data/BikeRochester/Bike Markings.shp').to_crs(4326)
+    markings = pd.concat([
+        markings[markings['Status'] == 'Existing'].iloc[:8],
+        markings[markings['Status'].isna()].iloc[:2],  # built lanes without a Status
+    ])
+    assert markings['Status'].isna().sum() == 2
+    to_local = pyproj.Transformer.from_crs(4326, CONFIG.local_crs, always_xy=True)
+    G = nx.MultiDiGraph(crs='epsg:4326')
+    on_street = {}
+    for row in markings.itertuples():
+        nodes = []
+        for x, y in row.geometry.coords:
+            nodes.append(len(G))
+            G.add_node(len(G), x=x, y=y)
+            G.add_node(len(G), x=x + 0.3, y=y)  # street outside the city, away from all bike lines
+        for a, b in zip(nodes, nodes[1:]):
+            G.add_edge(a, b, length=1.0)
+            G.add_edge(b, a, length=1.0)
+            G.add_edge(a + 1, b + 1, length=1.0)
+            on_street[(a, b)] = on_street[(b, a)] = row.Type
+
+        # Cross street of 20 m through the middle of the first segment, within snap_dist of the line throughout
+        (x0, x1), (y0, y1) = to_local.transform(*np.array(row.geometry.coords[:2]).T)
+        norm = np.hypot(x1 - x0, y1 - y0)
+        dx, dy = -(y1 - y0) / norm * 10, (x1 - x0) / norm * 10
+        xs, ys = to_local.transform([(x0 + x1) / 2 - dx, (x0 + x1) / 2 + dx], [(y0 + y1) / 2 - dy, (y0 + y1) / 2 + dy], direction='INVERSE')
+        c = len(G)
+        G.add_node(c, x=xs[0], y=ys[0])
+        G.add_node(c + 1, x=xs[1], y=ys[1])
+        G.add_edge(c, c + 1, length=20.0)
+        G.add_edge(c + 1, c, length=20.0)
+
+    B = bike_infra_from_shapefiles(G, add_tentative=False)
+    assert set(B.edges()) == set(on_street)
+    assert B.graph['crs'] == 'epsg:4326' and B.nodes[0] == G.nodes[0]
+    assert {t for _, _, t in B.edges(data='bike_infrastructure_type')} <= set(CONFIG.osm_bike_params)
+
+    by_type = dict(bike_infra_from_shapefiles(G, add_tentative=False, compose_all=False))
+    assert sum(H.number_of_edges() for H in by_type.values()) == B.number_of_edges()
+    assert all(t == name for name, H in by_type.items() for _, _, t in H.edges(data='bike_infrastructure_type'))
+
+    # Custom layers without "Bike Markings" have no mapping for the tentative markings
+    trails = bike_infra_from_shapefiles(G, layers={'Trails': 'bike_highwaycycleway'})
+    assert {t for _, _, t in trails.edges(data='bike_infrastructure_type')} <= {'bike_highwaycycleway'}
+
+
+def test_geocode_addresses(tmp_path, monkeypatch) -> None:
+    '''
+    Misses should be geocoded once within the rate limit, warm runs and "no result" failures not at all,
+    transport errors again on the next run
+    '''
+    monkeypatch.setattr(CONFIG, 'cache_dir', str(tmp_path))
+    calls = []
+
+    def geocode(query):
+        calls.append(query)
+        if query.startswith('nowhere'):
+            raise ox._errors.InsufficientResponseError(f'Nominatim could not geocode query {query!r}')
+        if query.startswith('offline'):
+            raise ConnectionError('connection refused')
+        return 43.0 + len(query) / 1000, -77.0
+
+    monkeypatch.setattr(ox.geocoder, 'geocode', geocode)
+    queries = [f'{i} main st rochester ny' for i in range(10)] + ['nowhere rochester ny', '0 main st rochester ny']
+    start = time.perf_counter()
+    points = geocode_addresses(queries, n_workers=4, rate=20)
+    assert time.perf_counter() - start >= 0.45  # 11 requests at 20 per second
+    assert sorted(calls) == sorted(set(queries))
+    assert points['nowhere rochester ny'] is None
+    assert points['3 main st rochester ny'].coords[0] == (-77.0, 43.0 + len('3 main st rochester ny') / 1000)
+
+    calls.clear()
+    assert geocode_addresses(queries) == points and calls == []
+    geocode_addresses(queries, retry_failed=True)
+    assert calls == ['nowhere rochester ny']
+
+    calls.clear()
+    assert geocode_addresses(['offline rochester ny']) == {'offline rochester ny': None}
+    assert geocode_addresses(['offline rochester ny']) == {'offline rochester ny': None}
+    assert calls == ['offline rochester ny'] * 2
+
+    monkeypatch.setattr(CONFIG, 'cache_only', True)
+    with pytest.raises(FileNotFoundError):
+        geocode_addresses(['new st rochester ny'])
+    monkeypatch.setattr(CONFIG, 'cache_only', False)
+
+    csv = tmp_path / 'pois.csv'
+    csv.write_text('Address,Business Name\n1 main st,A\nnowhere,B\n5 main st,C\n')
+    calls.clear()
+    pois = POIs_from_file(str(csv))
+    assert calls == [] and pois['Business Name'].tolist() == ['A', 'C']
+    assert pois.geometry.iloc[1].equals(points['5 main st rochester ny'])
+
+
+def test_downsample_poi_nodes_by_income(tmp_path, monkeypatch) -> None:
+    '''
+    Upper-income POIs should be sampled down by the seed, at the given quantile, from cached tracts
+    '''
+    monkeypatch.setattr(CONFIG, 'cache_dir', str(tmp_path))
+    _tract_income.cache_clear()
+    # 4 x 4 tracts of 0.01 degrees with incomes 1000 ... 16000
+    tracts = gpd.GeoDataFrame(
+        {
+            'GEOID': [str(i) for i in range(16)],
+            CONFIG.median_income_var: [1000.0 * (i + 1) for i in range(16)],
+            'geometry': [shapely.box(-77.6 + (i % 4) * 0.01, 43.1 + (i // 4) * 0.01, -77.59 + (i % 4) * 0.01, 43.11 + (i // 4) * 0.01) for i in range(16)],
+        },
+        crs='EPSG:4326',
+    )
+    params = {'county': 'Monroe, NY', 'year': 2019, 'variables': [CONFIG.median_income_var]}
+    assert cache.cached('acs_tract_income', None, params, lambda: tracts) is tracts
+
+    rng = np.random.default_rng(0)
+    X = np.append(rng.uniform(-77.6, -77.56, 2000), -77.0)  # last one outside all tracts
+    Y = np.append(rng.uniform(43.1, 43.14, 2000), 43.0)
+    income = np.zeros(len(X))
+    for geom, tract_income in zip(tracts.geometry, tracts[CONFIG.median_income_var]):
+        income[shapely.contains_xy(geom, X, Y)] = tract_income
+    for quantile in [0.25, 0.5]:
+        upper = income > np.quantile(tracts[CONFIG.median_income_var], quantile)
+        Xs, Ys = _downsample_poi_nodes_by_income(X, Y, 'Monroe, NY', 0.3, quantile, seed=1)
+        kept = np.isin(X, Xs)
+        assert kept[~upper].all() and kept.sum() == (~upper).sum() + round(upper.sum() * 0.7)
+        assert np.array_equal(Xs, X[kept]) and np.array_equal(Ys, Y[kept])
+
+    assert np.array_equal(_downsample_poi_nodes_by_income(X, Y, 'Monroe, NY', 0.5, seed=2)[0], _downsample_poi_nodes_by_income(X, Y, 'Monroe, NY', 0.5, seed=2)[0])
+    assert not np.array_equal(_downsample_poi_nodes_by_income(X, Y, 'Monroe, NY', 0.5, seed=2)[0], _downsample_poi_nodes_by_income(X, Y, 'Monroe, NY', 0.5, seed=3)[0])
+    start = time.perf_counter()
+    for pct in np.linspace(0, 1, 21):
+        _downsample_poi_nodes_by_income(X, Y, 'Monroe, NY', pct)
+    assert time.perf_counter() - start < 1
+    _tract_income.cache_clear()
@@ -0,0 +1,163 @@
+from roc_bike_growth.metrics import (
+    paper_coverage,
+    grid_coverage,
+    paper_global_efficiency,
+    paper_local_efficiency,
+    graph_resilience,
+    cal_n_components,
+    graph_cohesion,
+    MetricSuite,
+)
+from haversine import haversine_vector
+import igraph as ig
+import itertools
+import networkx as nx
+import numpy as np
+import random
+
+
+def make_test_graph() -> nx.MultiDiGraph:
+    '''
+    Make an L-shaped test graph of two ~1 km edges near Rochester
+    '''
+    G = nx.MultiDiGraph()
+    G.add_node(1, x=-77.61, y=43.15)
+    G.add_node(2, x=-77.61, y=43.159)
+    G.add_node(3, x=-77.5977, y=43.159)
+    G.add_edge(1, 2, length=1000)
+    G.add_edge(2, 1, length=1000)
+    G.add_edge(2, 3, length=1000)
+    return G
+
+
+def test_paper_coverage() -> None:
+    '''
+    Coverage of a single edge should be the area of its buffer, a stadium
+    '''
+    G = make_test_graph()
+    G.remove_node(3)
+    length = 43.159 - 43.15  # degrees of latitude
+    length *= np.pi / 180 * 6371000
+    expected = (2 * 500 * length + np.pi * 500 ** 2) / 1e6
+    assert abs(paper_coverage(G, buffer=500) - expected) / expected < 0.01
+    assert paper_coverage(nx.MultiDiGraph()) == 0.0
+
+
+def test_grid_coverage() -> None:
+    '''
+    Grid coverage should bound the exact coverage and get closer with smaller cells
+    '''
+    G = make_test_graph()
+    exact = paper_coverage(G, buffer=300)
+    area, lower, upper = grid_coverage(G, buffer=300)
+    assert lower <= exact <= upper
+    assert lower <= area <= upper
+    fine_area, fine_lower, fine_upper = grid_coverage(G, buffer=300, cell_size=5)
+    assert fine_lower <= exact <= fine_upper
+    assert fine_upper - fine_lower < upper - lower
+    assert abs(paper_coverage(G, buffer=300, method="grid") - area) < 1e-9
+
+
+def test_grid_coverage_bounds_angled_edge() -> None:
+    '''
+    Grid coverage bounds should hold for a single edge at angles not aligned with the grid
+    '''
+    for angle in [7, 22.5, 38, 45, 61, 83]:
+        G = nx.MultiDiGraph()
+        G.add_node(1, x=-77.6, y=43.15)
+        G.add_node(2, x=-77.6 + 0.004 * np.cos(np.radians(angle)) / np.cos(np.radians(43.15)), y=43.15 + 0.004 * np.sin(np.radians(angle)))
+        G.add_edge(1, 2)
+        exact = paper_coverage(G, buffer=100)
+        for cell_size in [10, 40, 100]:
+            _, lower, upper = grid_coverage(G, buffer=100, cell_size=cell_size)
+            assert lower <= exact <= upper
+
+
+def make_lattice(k=12, seed=0) -> nx.MultiDiGraph:
+    '''
+    Make a k x k street lattice with jittered coordinates and some missing edges
+    '''
+    rng = random.Random(seed)
+    G = nx.MultiDiGraph()
+    for i in range(k):
+        for j in range(k):
+            G.add_node(i * k + j, x=-77.65 + 0.004 * i + rng.uniform(-5e-4, 5e-4), y=43.12 + 0.003 * j + rng.uniform(-5e-4, 5e-4))
+    for i in range(k):
+        for j in range(k):
+            if i + 1 < k and rng.random() < 0.8:
+                G.add_edge(i * k + j, (i + 1) * k + j, length=1)
+            if j + 1 < k and rng.random() < 0.8:
+                G.add_edge(i * k + j, i * k + j + 1, length=1)
+    return G
+
+
+def test_paper_global_efficiency() -> None:
+    '''
+    Should match the pairwise loop it replaced, be reproducible with a seed and give a CI
+    '''
+    G = ig.Graph.from_networkx(nx.Graph(make_lattice()))
+    nodeindices = list(G.vs.indices)
+    d_ij = [d for row in G.distances(source=nodeindices, target=nodeindices) for d in row]
+    pairs = list(itertools.permutations(nodeindices, 2))
+    l_ij = haversine_vector([(G.vs[i]["y"], G.vs[i]["x"]) for i, _ in pairs], [(G.vs[j]["y"], G.vs[j]["x"]) for _, j in pairs], unit="m")
+    expected = sum(1 / d for d in d_ij if d != 0) / sum(1 / l for l in l_ij if l != 0)
+    assert abs(paper_global_efficiency(G) - expected) < 1e-9 * expected
+
+    assert paper_global_efficiency(G, pairs_thresh=50, seed=3) == paper_global_efficiency(G, pairs_thresh=50, seed=3)
+    estimate, (lower, upper) = paper_global_efficiency(G, pairs_thresh=50, seed=3, ci=0.95)
+    assert estimate == paper_global_efficiency(G, pairs_thresh=50, seed=3)
+    assert lower < estimate < upper
+
+
+def test_paper_local_efficiency() -> None:
+    '''
+    Should match averaging paper_global_efficiency over induced neighborhoods, with the same seeded sample
+    '''
+    G = make_lattice()
+    for i in range(11):
+        for j in range(0, 11, 2):
+            G.add_edge(i * 12 + j, (i + 1) * 12 + j + 1, length=1)  # diagonals make triangles
+    G_ig = ig.Graph.from_networkx(nx.Graph(G))
+
+    nodeindices = random.Random(4).sample(list(G_ig.vs.indices), 60)
+    expected = [
+        paper_global_efficiency(G_ig.induced_subgraph(G_ig.neighbors(i)))
+        for i in nodeindices
+        if len(G_ig.neighbors(i)) > 1
+    ]
+    expected = sum(expected) / len(expected)
+
+    assert abs(paper_local_efficiency(G, 60, seed=4) - expected) < 1e-6 * expected
+    assert abs(paper_local_efficiency(G_ig, 60, seed=4) - expected) < 1e-6 * expected
+    assert abs(paper_local_efficiency(G, 60, seed=4, n_jobs=2) - expected) < 1e-6 * expected
+
+
+def test_metric_suite() -> None:
+    '''
+    The suite should give the same values as the separate metric functions, for any subset
+    '''
+    G = make_lattice()
+    G.add_node(1000, x=-77.5, y=43.2)  # isolated node as a second component
+    record = MetricSuite(G, buffer=300, pairs_thresh=50, numnodepairs=50, seed=2, ci=0.9).compute()
+
+    coverage = paper_coverage(G, buffer=300)
+    assert record.density == graph_resilience(G, 'density')
+    assert record.largest_component == graph_resilience(G, 'largest_component')
+    assert record.n_components == cal_n_components(G)
+    assert abs(record.coverage - coverage) < 1e-9
+    assert abs(record.cohesion - graph_cohesion(G, coverage)) < 1e-9
+    estimate, ci = paper_global_efficiency(G, pairs_thresh=50, seed=2, ci=0.9)
+    assert record.global_efficiency == estimate and record.global_efficiency_ci == ci
+    assert record.local_efficiency == paper_local_efficiency(G, 50, seed=2)
+
+    subset = MetricSuite(G, buffer=300).compute(['cohesion'])
+    assert subset.cohesion == record.cohesion
+    assert subset.coverage is None and subset.global_efficiency is None
+
+    # A shared generator should not make local efficiency depend on the metric order
+    for i in range(11):
+        for j in range(0, 11, 2):
+            G.add_edge(i * 12 + j, (i + 1) * 12 + j + 1, length=1)  # diagonals make triangles
+    local_only = MetricSuite(G, numnodepairs=50, seed=random.Random(3)).compute(['local_efficiency'])
+    both = MetricSuite(G, pairs_thresh=50, numnodepairs=50, seed=random.Random(3)).compute(['global_efficiency', 'local_efficiency'])
+    assert local_only.local_efficiency == both.local_efficiency
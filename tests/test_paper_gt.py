@@ -0,0 +1,165 @@
+from roc_bike_growth.paper_gt import (
+    get_poipairs_by_distance,
+    gt_with_existing_full,
+    _set_mod_weight,
+    gt_with_existing_sweep,
+    iterative_pruning,
+    pruning_order_agreement,
+    new_edge_intersects,
+    SegmentGrid,
+    MyPoint,
+    segments_intersect,
+    segments_intersect_array,
+    segments_intersect_matrix,
+)
+from helpers import make_test_network
+import numpy as np
+import pytest
+import igraph as ig
+import networkx as nx
+import random
+
+
+def make_test_graph(n=60, seed=0) -> ig.Graph:
+    '''
+    Make a random directed geometric graph with the attributes gt_from_scratch expects
+    '''
+    rng = random.Random(seed)
+    G = ig.Graph.GRG(n, 0.25, torus=False)
+    G = G.as_directed(mode="mutual")
+    for i, v in enumerate(G.vs):
+        v["id"] = i
+    for e in G.es:
+        e["weight"] = rng.uniform(1, 100)
+        e["existing"] = rng.random() < 0.2
+    return G
+
+
+def test_get_poipairs_by_distance_batched() -> None:
+    '''
+    Batched distance matrix should give the same pairs, in the same order, as the path-by-path version
+    '''
+    for seed in range(3):
+        G = make_test_graph(seed=seed)
+        pois = random.Random(seed).sample(list(G.vs.indices), 25)
+        for route_factor in [0, 0.5, 1]:
+            expected = get_poipairs_by_distance(G, pois, route_factor, batched=False)
+            out = get_poipairs_by_distance(G, pois, route_factor, batched=True)
+            assert [p for p, _ in out] == [p for p, _ in expected]
+            for (_, d_out), (_, d_exp) in zip(out, expected):
+                assert abs(d_out - d_exp) < 1e-9
+
+
+def test_new_edge_intersects_index() -> None:
+    '''
+    Grid index should agree with the full edge scan, including shared endpoints and colinear edges
+    '''
+    rng = random.Random(1)
+    for _ in range(10):
+        n = 40
+        G = ig.Graph(n=n, directed=True)
+        # Coarse lattice coordinates so touching and colinear segments are common
+        G.vs["x"] = [rng.randint(0, 20) * 0.01 - 77.6 for _ in range(n)]
+        G.vs["y"] = [rng.randint(0, 20) * 0.01 + 43.1 for _ in range(n)]
+        index = SegmentGrid.from_graph(G)
+        for _ in range(300):
+            a, b = rng.sample(range(n), 2)
+            enew = (G.vs[a]["x"], G.vs[a]["y"], G.vs[b]["x"], G.vs[b]["y"])
+            expected = new_edge_intersects(G, enew, vectorized=False)
+            assert new_edge_intersects(G, enew) == expected
+            assert new_edge_intersects(G, enew, index=index) == expected
+            if not expected or rng.random() < 0.3:
+                G.add_edge(a, b)
+                index.add(*enew)
+
+
+def test_segments_intersect_array() -> None:
+    '''
+    Vectorized kernels should match the scalar segments_intersect on random segment sets
+    '''
+    rng = np.random.default_rng(0)
+    for scale in [5, 1000]:  # small integer grid gives many shared endpoints and colinear cases
+        segs_a = rng.integers(0, scale, size=(50, 4)).astype(float)
+        segs_b = rng.integers(0, scale, size=(80, 4)).astype(float)
+        expected = np.array(
+            [
+                [
+                    segments_intersect(MyPoint(a[0], a[1]), MyPoint(a[2], a[3]), MyPoint(b[0], b[1]), MyPoint(b[2], b[3]))
+                    for b in segs_b
+                ]
+                for a in segs_a
+            ]
+        )
+        assert (segments_intersect_matrix(segs_a, segs_b) == expected).all()
+        for a, row in zip(segs_a, expected):
+            assert (segments_intersect_array(a, segs_b) == row).all()
+
+
+def test_iterative_pruning_bw_modes() -> None:
+    '''
+    Incremental betweenness should delete the same edges in the same rounds as full recomputation
+    '''
+    rng = random.Random(0)
+    G = ig.Graph.Lattice([12, 12], circular=False).as_directed(mode="mutual")
+    for i, v in enumerate(G.vs):
+        v["id"] = i
+        v["x"], v["y"] = i % 12, i // 12
+    G.es["mod_weight"] = [rng.uniform(1, 100) for _ in G.es]
+    G.es["existing"] = [rng.random() < 0.05 for _ in G.es]
+    existing = nx.MultiDiGraph()
+    existing.add_edges_from([(0, 1)] * sum(G.es["existing"]))
+
+    report = pruning_order_agreement(G, existing, 0.5, "mod", "incremental")
+    assert report["rounds"] > 1
+    assert report["match_rate"] == 1.0
+    assert report["final_jaccard"] == 1.0
+
+    report = pruning_order_agreement(G, existing, 0.5, "mod", "sampled", bw_epsilon=0.3, seed=0)
+    assert 0 <= report["match_rate"] <= 1
+
+    G_pruned = iterative_pruning(G.copy(), existing, 0.5, "mod", bw_mode="sampled", bw_epsilon=0.3, seed=0)
+    assert G_pruned.ecount() <= G.ecount() * 0.5 + existing.number_of_edges()
+
+
+def test_gt_with_existing_sweep() -> None:
+    '''
+    One sweep should give the same networks as separate gt_with_existing_full runs
+    '''
+    prune_factors = [0.2, 0.5, 1]
+    for prune_measure in ["betweenness", "closeness", "iter_betweenness"]:
+        G, existing = make_test_network()
+        swept = dict(gt_with_existing_sweep(G, existing, prune_factors[::-1], route_factor=0.5, prune_measure=prune_measure))
+        assert list(swept) == sorted(prune_factors)
+        for prune_factor in prune_factors:
+            G, existing = make_test_network()
+            expected = gt_with_existing_full(G, existing, 0.5, prune_factor, prune_measure=prune_measure)
+            out = swept[prune_factor]
+            assert set(out.nodes) == set(expected.nodes)
+            assert set(out.edges(keys=True)) == set(expected.edges(keys=True))
+            assert nx.get_edge_attributes(out, "generated") == nx.get_edge_attributes(expected, "generated")
+
+
+def test_crash_factor() -> None:
+    '''
+    Crash counts should scale mod_weight, through the default or a custom cost, and steer the routes
+    '''
+    G = make_test_graph()
+    crashes = [i % 3 for i in range(G.ecount())]
+    with pytest.raises(ValueError):
+        _set_mod_weight(G, 0.5, crash_factor=1)
+    G.es["crashes"] = crashes
+    _set_mod_weight(G, 0.5, crash_factor=2)
+    expected = [w * (1 + 2 * c) * (0.5 if e else 1) for w, c, e in zip(G.es["weight"], crashes, G.es["existing"])]
+    assert np.allclose(G.es["mod_weight"], expected)
+    by_float = G.es["mod_weight"]
+    _set_mod_weight(G, 0.5, crash_factor=lambda w, c: w + 2 * w * c)
+    assert np.allclose(G.es["mod_weight"], by_float)
+
+    G, existing = make_test_network()
+    for u, v, d in G.edges(data=True):
+        d["crashes"] = 3 if u % 12 == 5 and v % 12 == 5 else 0  # one dangerous north-south street
+    plain = gt_with_existing_full(G.copy(), existing, 0, 1, crash_factor=0)
+    assert set(plain.edges) == set(gt_with_existing_full(G.copy(), existing, 0, 1).edges)
+    safe = gt_with_existing_full(G.copy(), existing, 0, 1, crash_factor=10)
+    dangerous = lambda H: sum(1 for u, v in H.edges() if u % 12 == 5 and v % 12 == 5)
+    assert dangerous(safe) < dangerous(plain)
@@ -0,0 +1,46 @@
+from roc_bike_growth.resiliency import resilience, largest_component_curve, attack_order
+import igraph as ig
+import networkx as nx
+import random
+
+
+def brute_force(G: nx.Graph, order: list) -> list:
+    '''
+    Largest component size after each removal, recomputed from scratch
+    '''
+    G = nx.Graph(G)
+    sizes = [max(map(len, nx.connected_components(G)), default=0)]
+    for node in order:
+        G.remove_node(node)
+        sizes.append(max(map(len, nx.connected_components(G)), default=0))
+    return sizes
+
+
+def test_largest_component_curve() -> None:
+    '''
+    Reverse union-find curve should match recomputing components after every removal
+    '''
+    G = nx.gnm_random_graph(120, 150, seed=1, directed=True)
+    G.add_edge(5, 5)
+    for strategy in ['random', 'degree', 'betweenness']:
+        order = attack_order(G, strategy, seed=2)
+        assert sorted(order) == sorted(G.nodes)
+        expected = brute_force(G.to_undirected(), order)
+        assert largest_component_curve(G, order).tolist() == expected
+        assert list(resilience({n: set(nx.all_neighbors(G, n)) for n in G}, order)) == expected
+
+    # Partial attacks and igraph input
+    order = attack_order(G, 'degree')[:30]
+    assert largest_component_curve(ig.Graph.from_networkx(G), order).tolist() == brute_force(G.to_undirected(), order)
+
+
+def test_attack_order() -> None:
+    '''
+    Degree order should start at the hub, random order should follow the seed
+    '''
+    G = nx.star_graph(6)
+    G.add_edge(1, 2)
+    assert attack_order(G, 'degree')[:3] == [0, 1, 2]
+    assert attack_order(G, 'betweenness')[0] == 0
+    assert attack_order(G, 'random', seed=3) == attack_order(G, 'random', seed=random.Random(3))
+    assert list(resilience(G, [0])) == [7, 2]
@@ -0,0 +1,69 @@
+from roc_bike_growth.results import ResultsStore
+from roc_bike_growth.scenarios import cell_id
+import networkx as nx
+import numpy as np
+
+
+def make_network(seed: int) -> nx.MultiDiGraph:
+    '''
+    Small network with the edge attributes of a generated one
+    '''
+    rng = np.random.default_rng(seed)
+    G = nx.MultiDiGraph()
+    for i in range(12):
+        G.add_node(1000 + i, x=-77.6 + rng.random() * 0.01, y=43.1 + rng.random() * 0.01)
+    for _ in range(20):
+        u, v = rng.integers(1000, 1012, 2).tolist()
+        G.add_edge(u, v, length=float(rng.random() * 100), existing=bool(rng.random() < 0.3), generated=True)
+    return G
+
+
+def test_results_store(tmp_path) -> None:
+    '''
+    Rows and networks should round trip, before and after compaction, and reruns should replace rows
+    '''
+    store = ResultsStore(str(tmp_path))
+    assert store.rows().empty
+    networks = {}
+    for i in range(5):
+        params = {'prune_factor': i / 10, 'poi_n': None if i % 2 else 5}
+        rid = cell_id(params)
+        networks[rid] = make_network(i)
+        store.add_network(rid, networks[rid], params)
+        store.add_row(rid, {**params, 'coverage': float(i), 'error': None if i else 'ValueError: x'})
+
+    rows = store.rows()
+    assert len(rows) == 5 and set(rows['run_id']) == set(networks)
+    assert store.compact() == 5 and store.compact() == 0
+    assert store.rows().equals(rows)
+    assert list(store.rows(['coverage']).columns) == ['run_id', 'coverage']
+
+    rid = cell_id({'prune_factor': 0.2, 'poi_n': 5})
+    store.add_row(rid, {'coverage': 10.0})
+    assert store.rows().set_index('run_id')['coverage'][rid] == 10.0 and len(store.rows()) == 5
+
+    base = make_network(2)
+    G = store.network(rid, base)
+    assert sorted(G.edges(keys=True, data=True)) == sorted(networks[rid].edges(keys=True, data=True))
+    assert dict(G.nodes(data='y')) == {n: base.nodes[n]['y'] for n in G}
+    assert store.params(rid) == {'prune_factor': 0.2, 'poi_n': 5}
+    assert store.edges(rid).num_rows == 20
+
+    assert store.remove(rid) and not store.remove(rid)
+    assert len(store.rows()) == 4 and not store.has_network(rid)
+
+
+def test_results_store_mixed_types(tmp_path) -> None:
+    '''
+    A parameter that is a number in one run and a string in another should be read back as strings
+    '''
+    store = ResultsStore(str(tmp_path))
+    store.add_row('a', {'by_factor': 2, 'coverage': 1})
+    store.add_row('b', {'by_factor': 'mod', 'coverage': 1.5})
+    rows = store.rows().set_index('run_id')
+    assert rows['by_factor'].to_dict() == {'a': '2', 'b': 'mod'}
+    assert rows['coverage'].to_dict() == {'a': 1.0, 'b': 1.5}
+
+    assert store.compact() == 2
+    store.add_row('c', {'by_factor': 3})
+    assert store.rows().set_index('run_id')['by_factor'].to_dict() == {'a': '2', 'b': 'mod', 'c': '3'}
@@ -0,0 +1,51 @@
+from roc_bike_growth.scenarios import run_scenarios, scenario_grid, cell_id, load_results, results_store
+from roc_bike_growth.paper_gt import gt_with_existing_full
+from helpers import make_test_network
+import pytest
+
+
+def test_scenario_grid() -> None:
+    '''
+    Grid should expand to every combination with defaults filled in and stable ids
+    '''
+    scenarios = scenario_grid({'prune_factor': [0.2, 0.5], 'route_factor': [0, 1]})
+    assert len(scenarios) == 4
+    assert scenarios[0]['prune_measure'] == 'betweenness'
+    assert len({cell_id(s) for s in scenarios}) == 4
+    assert cell_id(scenarios[0]) == cell_id(dict(reversed(list(scenarios[0].items()))))
+    with pytest.raises(ValueError):
+        scenario_grid({'prune': [0.2]})
+
+
+def test_run_scenarios(tmp_path) -> None:
+    '''
+    Pool and in-process runs should agree with gt_with_existing_full, and a rerun should resume
+    '''
+    grid = {'prune_factor': [0.3, 1], 'route_factor': [0, 0.5], 'poi_n': [None, 8]}
+    metrics = ['n_components', 'coverage']
+
+    G, existing = make_test_network()
+    pooled = run_scenarios(G, existing, grid, str(tmp_path / 'pool'), metrics, n_jobs=2)
+    G, existing = make_test_network()
+    serial = run_scenarios(G, existing, grid, str(tmp_path / 'serial'), metrics, n_jobs=1, save_networks=True)
+    assert len(pooled) == 8 and pooled['error'].isna().all()
+    pooled = pooled.sort_values('cell_id').reset_index(drop=True)
+    serial = serial.sort_values('cell_id').reset_index(drop=True)
+    assert (pooled[metrics + ['n_edges', 'seed']] == serial[metrics + ['n_edges', 'seed']]).all().all()
+
+    G, existing = make_test_network()
+    expected = gt_with_existing_full(G, existing, 0.5, 0.3)
+    row = serial[(serial['prune_factor'] == 0.3) & (serial['route_factor'] == 0.5) & serial['poi_n'].isna()]
+    assert row['n_edges'].item() == expected.number_of_edges()
+    G_stored = results_store(str(tmp_path / 'serial')).network(row['cell_id'].item(), G)
+    generated = sorted((u, v, k, g == True) for u, v, k, g in expected.edges(keys=True, data='generated'))
+    assert sorted(G_stored.edges(keys=True, data='generated')) == generated
+    assert G_stored.nodes(data='x') == expected.nodes(data='x')
+
+    # Resume: remove one cell, only that one is run again
+    assert results_store(str(tmp_path / 'serial')).remove(serial['cell_id'][0])
+    rerun = []
+    G, existing = make_test_network()
+    out = run_scenarios(G, existing, grid, str(tmp_path / 'serial'), metrics, n_jobs=1, progress=rerun.append)
+    assert [r['cell_id'] for r in rerun] == [serial['cell_id'][0]]
+    assert len(out) == 8 and len(load_results(str(tmp_path / 'serial'))) == 8